@@ -2,19 +2,42 @@ import os
 import sys
 import time
 import json
+import gzip
+import math
+import struct
 import threading
 import queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib.parse import unquote, urlparse
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-import requests
+import collections
+import itertools
+import subprocess
+import atexit
+import logging
+import logging.handlers
+import contextlib
+import hashlib
+import email.utils
+import socket
+import zlib
+import re
+import io
+import html
+import mmap
+import datetime
+import shutil
+import zipfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import quote, unquote, urlparse, parse_qs
+# selenium / webdriver_manager / requests 导入较慢，延迟到首次扫描或下载时再加载
 from tkinter import *
 from tkinter import ttk, filedialog, messagebox
 from tkinter.scrolledtext import ScrolledText
 
+# 程序启动时间（用于统计窗口就绪耗时）
+APP_START_TIME = time.perf_counter()
+# 本实例的标识（多机协作时区分各节点的租约和临时文件）
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}"
+
 def format_size(size_bytes):
     """格式化文件大小"""
     if size_bytes < 1024:
@@ -26,14 +49,4016 @@ def format_size(size_bytes):
     else:
         return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
 
-def format_speed(speed_bytes):
-    """格式化下载速度"""
-    if speed_bytes < 1024:
-        return f"{speed_bytes:.0f} B/s"
-    elif speed_bytes < 1024 * 1024:
-        return f"{speed_bytes / 1024:.1f} KB/s"
-    else:
-        return f"{speed_bytes / (1024 * 1024):.1f} MB/s"
+def format_speed(speed_bytes):
+    """格式化下载速度"""
+    if speed_bytes < 1024:
+        return f"{speed_bytes:.0f} B/s"
+    elif speed_bytes < 1024 * 1024:
+        return f"{speed_bytes / 1024:.1f} KB/s"
+    else:
+        return f"{speed_bytes / (1024 * 1024):.1f} MB/s"
+
+def get_relative_path(url, base_url):
+    """从URL中提取相对路径"""
+    parsed = urlparse(url)
+    path = unquote(parsed.path)
+    base_parsed = urlparse(base_url)
+    base_path = base_parsed.path.rstrip('/')
+    
+    if path.startswith(base_path):
+        path = path[len(base_path):]
+    return path.lstrip('/')
+
+def map_mirror_url(url, from_base, to_base):
+    """把一个镜像上的文件URL映射到另一个镜像（按相对路径对应）"""
+    if from_base.rstrip('/') == to_base.rstrip('/'):
+        return url
+    relative_path = get_relative_path(url, from_base)
+    return to_base.rstrip('/') + '/' + quote(relative_path)
+
+# 二进制缓存格式: gzip( 魔数 | 版本号 | 头信息JSON | 条目... )
+# 每个条目: url 字符串 + 按头信息中 fields 顺序排列的字段值，字段值以1字节类型标记开头
+CACHE_MAGIC = b'GCBC'
+CACHE_VERSION = 1
+_VALUE_NONE, _VALUE_INT, _VALUE_STR, _VALUE_JSON = 0, 1, 2, 3
+
+def _pack_str(buf, text):
+    """写入带长度前缀的UTF-8字符串"""
+    data = text.encode('utf-8')
+    buf += struct.pack('<I', len(data))
+    buf += data
+
+def _pack_value(buf, value):
+    """写入带类型标记的字段值"""
+    if value is None:
+        buf.append(_VALUE_NONE)
+    elif isinstance(value, int) and not isinstance(value, bool):
+        buf.append(_VALUE_INT)
+        buf += struct.pack('<q', value)
+    elif isinstance(value, str):
+        buf.append(_VALUE_STR)
+        _pack_str(buf, value)
+    else:
+        buf.append(_VALUE_JSON)
+        _pack_str(buf, json.dumps(value, ensure_ascii=False))
+
+def _read_exact(f, size):
+    """读取指定字节数，不足时视为文件损坏"""
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("缓存文件不完整")
+    return data
+
+def _read_str(f):
+    """读取带长度前缀的UTF-8字符串"""
+    size, = struct.unpack('<I', _read_exact(f, 4))
+    return _read_exact(f, size).decode('utf-8')
+
+def _read_value(f):
+    """读取带类型标记的字段值"""
+    kind = _read_exact(f, 1)[0]
+    if kind == _VALUE_NONE:
+        return None
+    if kind == _VALUE_INT:
+        return struct.unpack('<q', _read_exact(f, 8))[0]
+    if kind == _VALUE_STR:
+        return _read_str(f)
+    if kind == _VALUE_JSON:
+        return json.loads(_read_str(f))
+    raise ValueError(f"未知的字段类型: {kind}")
+
+def write_binary_cache(path, header, files):
+    """写入二进制缓存（先写临时文件，再原子替换）"""
+    fields = sorted({key for info in files.values() for key in info})
+    header = dict(header, fields=fields, count=len(files))
+    # 临时文件名带节点和线程标识：多个线程或共用目录的多个实例同时写入时互不覆盖
+    tmp_path = f"{path}.{NODE_ID}.{threading.get_ident()}.tmp"
+    try:
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            buf = bytearray(CACHE_MAGIC)
+            buf += struct.pack('<H', CACHE_VERSION)
+            _pack_str(buf, json.dumps(header, ensure_ascii=False))
+            f.write(buf)
+            for url, info in files.items():
+                buf = bytearray()
+                _pack_str(buf, url)
+                for key in fields:
+                    _pack_value(buf, info.get(key))
+                f.write(buf)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+def iter_binary_cache(path):
+    """流式读取二进制缓存：先产出头信息，再逐条产出 (url, info)"""
+    with gzip.open(path, 'rb') as f:
+        if _read_exact(f, len(CACHE_MAGIC)) != CACHE_MAGIC:
+            raise ValueError("不是有效的缓存文件")
+        version, = struct.unpack('<H', _read_exact(f, 2))
+        if version > CACHE_VERSION:
+            raise ValueError(f"不支持的缓存版本: {version}")
+        header = json.loads(_read_str(f))
+        yield header
+        fields = header.get('fields', [])
+        for _ in range(header.get('count', 0)):
+            url = _read_str(f)
+            info = {}
+            for key in fields:
+                value = _read_value(f)
+                if value is not None:
+                    info[key] = value
+            yield url, info
+
+class SelectionModel:
+    """选中状态模型 - 独立于Treeview，维护选中集合和选中文件总字节数"""
+    
+    def __init__(self, on_change=None):
+        self.selected = set()
+        self.sizes = {}  # {path: size_bytes}，可选中的全部文件
+        self.total_bytes = 0
+        self.on_change = on_change  # 选中状态变化回调 on_change(paths, selected)
+    
+    def __len__(self):
+        return len(self.selected)
+    
+    def __contains__(self, path):
+        return path in self.selected
+    
+    def __iter__(self):
+        return iter(self.selected)
+    
+    def set_catalog(self, sizes):
+        """替换文件目录，目录中已不存在的文件自动取消选中"""
+        self.sizes = dict(sizes)
+        self.selected &= self.sizes.keys()
+        self.total_bytes = sum(self.sizes[path] for path in self.selected)
+    
+    def set_size(self, path, size_bytes):
+        """添加文件或更新文件大小"""
+        if path in self.selected:
+            self.total_bytes += size_bytes - self.sizes.get(path, 0)
+        self.sizes[path] = size_bytes
+    
+    def select(self, paths):
+        """批量选中，返回状态发生变化的文件"""
+        changed = (set(paths) & self.sizes.keys()) - self.selected
+        self.selected |= changed
+        self.total_bytes += sum(self.sizes[path] for path in changed)
+        if self.on_change and changed:
+            self.on_change(changed, True)
+        return changed
+    
+    def deselect(self, paths):
+        """批量取消选中，返回状态发生变化的文件"""
+        changed = self.selected & set(paths)
+        self.selected -= changed
+        self.total_bytes -= sum(self.sizes[path] for path in changed)
+        if self.on_change and changed:
+            self.on_change(changed, False)
+        return changed
+    
+    def invert(self, paths):
+        """在指定范围内反选，返回状态发生变化的文件"""
+        paths = set(paths) & self.sizes.keys()
+        to_deselect = paths & self.selected
+        self.deselect(to_deselect)
+        return self.select(paths - to_deselect) | to_deselect
+    
+    def clear(self):
+        """全部取消选中，返回状态发生变化的文件"""
+        changed = self.selected
+        self.selected = set()
+        self.total_bytes = 0
+        if self.on_change and changed:
+            self.on_change(changed, False)
+        return changed
+    
+    def toggle(self, path):
+        """切换单个文件，返回切换后的状态"""
+        if path in self.selected:
+            self.deselect([path])
+            return False
+        return bool(self.select([path]))
+
+class Mirror:
+    """单个镜像源的测速结果和健康状态"""
+    
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.latency = None  # 秒
+        self.throughput = None  # 字节/秒（指数平滑）
+        self.failures = 0  # 连续失败次数
+        self.down_until = 0  # 故障冷却截止时间
+    
+    @property
+    def healthy(self):
+        return time.time() >= self.down_until
+    
+    def describe(self):
+        """生成测速结果描述"""
+        latency = f"{self.latency * 1000:.0f} ms" if self.latency is not None else "未知"
+        throughput = format_speed(self.throughput) if self.throughput else "未知"
+        status = "正常" if self.healthy else f"故障({self.failures})"
+        return f"{self.base_url} | 延迟 {latency} | 速度 {throughput} | {status}"
+
+class MirrorPool:
+    """镜像池 - 测速，并把下载路由到最快的可用镜像，出错时自动切换"""
+    
+    def __init__(self, primary, mirrors=()):
+        self.primary = primary  # 扫描所用的主地址，文件URL均以它为基准
+        self.configured = list(mirrors)  # 配置的镜像列表（原样保存，用于判断配置是否变化）
+        self.mirrors = [Mirror(primary)]
+        for base_url in mirrors:
+            if base_url.rstrip('/') != primary.rstrip('/'):
+                self.mirrors.append(Mirror(base_url))
+        self.lock = threading.Lock()
+    
+    def map_url(self, url, mirror):
+        """把主地址下的文件URL映射到指定镜像"""
+        return map_mirror_url(url, self.primary, mirror.base_url)
+    
+    def healthy_count(self):
+        with self.lock:
+            return sum(1 for mirror in self.mirrors if mirror.healthy)
+    
+    def choose(self, exclude=()):
+        """选择最快的可用镜像；全部故障时选择最早恢复的镜像"""
+        with self.lock:
+            candidates = [m for m in self.mirrors if m.healthy and m not in exclude]
+            if not candidates:
+                candidates = [m for m in self.mirrors if m not in exclude] or self.mirrors
+                return min(candidates, key=lambda m: m.down_until)
+            # 吞吐量越高越好，其次延迟越低越好；未测速的镜像排在已测速的之后
+            return min(candidates, key=lambda m: (-(m.throughput or 0),
+                                                  m.latency if m.latency is not None else float('inf')))
+    
+    def report_success(self, mirror, num_bytes, seconds):
+        """记录一次成功的传输，更新平滑吞吐量"""
+        with self.lock:
+            mirror.failures = 0
+            mirror.down_until = 0
+            if seconds > 0 and num_bytes > 0:
+                speed = num_bytes / seconds
+                mirror.throughput = speed if mirror.throughput is None else 0.7 * mirror.throughput + 0.3 * speed
+    
+    def report_failure(self, mirror):
+        """记录一次失败，按失败次数指数退避暂停使用该镜像"""
+        with self.lock:
+            mirror.failures += 1
+            mirror.down_until = time.time() + min(300, 5 * 2 ** (mirror.failures - 1))
+    
+    def probe(self, session, sample_url, sample_bytes=256 * 1024):
+        """并行测速所有镜像：HEAD 测延迟，Range 请求测吞吐量"""
+        def probe_one(mirror):
+            url = self.map_url(sample_url, mirror)
+            try:
+                start = time.perf_counter()
+                response = session.head(url, timeout=10, allow_redirects=True)
+                response.raise_for_status()
+                latency = time.perf_counter() - start
+                with self.lock:
+                    mirror.latency = latency
+                
+                start = time.perf_counter()
+                received = 0
+                with session.get(url, headers={'Range': f'bytes=0-{sample_bytes - 1}'},
+                                 stream=True, timeout=30) as r:
+                    r.raise_for_status()
+                    for chunk in r.iter_content(chunk_size=65536):
+                        received += len(chunk)
+                        if received >= sample_bytes:
+                            break
+                self.report_success(mirror, received, time.perf_counter() - start)
+            except OSError:  # requests 的网络错误均为 OSError 的子类
+                self.report_failure(mirror)
+        
+        with ThreadPoolExecutor(max_workers=len(self.mirrors)) as executor:
+            list(executor.map(probe_one, self.mirrors))
+
+class SizeProber:
+    """后台获取文件大小的服务 - 按优先级排队，可取消，结果通过回调逐个返回"""
+    PRIORITY_SELECTED = 0  # 已选中的文件
+    PRIORITY_VISIBLE = 1  # 展开的文件夹中可见的文件
+    PRIORITY_BACKGROUND = 2  # 其余文件
+    
+    def __init__(self, fetch, on_result, num_workers=16):
+        self.fetch = fetch  # fetch(url) -> {'size_bytes', 'etag', 'last_modified'}，失败时返回None
+        self.on_result = on_result  # on_result(url, result)，在工作线程中调用
+        self.num_workers = num_workers
+        self.queue = queue.PriorityQueue()
+        self.pending = {}  # {url: 当前有效的优先级}
+        self.generation = 0
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.workers = []
+    
+    def submit(self, urls, priority):
+        """提交探测请求；已在队列中的文件只会被提升优先级"""
+        with self.lock:
+            for url in urls:
+                current = self.pending.get(url)
+                if current is not None and current <= priority:
+                    continue
+                self.pending[url] = priority
+                self.queue.put((priority, next(self.sequence), self.generation, url))
+            self._start_workers()
+    
+    def cancel(self, urls):
+        """取消尚未开始的探测"""
+        with self.lock:
+            for url in urls:
+                self.pending.pop(url, None)
+    
+    def cancel_all(self):
+        """取消全部尚未开始的探测（重新扫描时调用）"""
+        with self.lock:
+            self.generation += 1
+            self.pending.clear()
+    
+    def demote(self, urls, priority):
+        """降低尚未开始的探测的优先级（原有的高优先级条目随之作废）"""
+        with self.lock:
+            for url in urls:
+                current = self.pending.get(url)
+                if current is not None and current < priority:
+                    self.pending[url] = priority
+                    self.queue.put((priority, next(self.sequence), self.generation, url))
+    
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+    
+    def _start_workers(self):
+        while len(self.workers) < self.num_workers:
+            worker = threading.Thread(target=self._worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def _worker(self):
+        while True:
+            priority, _, generation, url = self.queue.get()
+            with self.lock:
+                # 已取消、已过期或已被更高优先级的条目处理过
+                if generation != self.generation or self.pending.get(url) != priority:
+                    continue
+                del self.pending[url]
+            self.on_result(url, self.fetch(url))
+
+class FolderNode:
+    """前缀树中的文件夹节点，保存子树的汇总统计"""
+    __slots__ = ('children', 'files', 'file_count', 'total_bytes', 'downloaded_bytes', 'selected_bytes')
+    
+    def __init__(self):
+        self.children = {}  # {名称: FolderNode}
+        self.files = set()  # 直接位于此文件夹下的文件名
+        self.file_count = 0
+        self.total_bytes = 0
+        self.downloaded_bytes = 0
+        self.selected_bytes = 0
+
+class PathTrie:
+    """路径前缀树 - 按文件夹汇总文件数、总字节数、已下载字节数和已选字节数"""
+    
+    def __init__(self):
+        self.root = FolderNode()
+        self.files = {}  # {path: [size_bytes, downloaded, selected]}
+    
+    def clear(self):
+        self.root = FolderNode()
+        self.files = {}
+    
+    def _path_nodes(self, path, create=False):
+        """返回从根到文件所在文件夹的节点列表"""
+        nodes = [self.root]
+        for part in path.split('/')[:-1]:
+            node = nodes[-1].children.get(part)
+            if node is None:
+                if not create:
+                    return None
+                node = nodes[-1].children[part] = FolderNode()
+            nodes.append(node)
+        return nodes
+    
+    def _apply(self, path, count, size, downloaded, selected):
+        """把增量累加到文件的所有上级文件夹"""
+        for node in self._path_nodes(path):
+            node.file_count += count
+            node.total_bytes += size
+            node.downloaded_bytes += downloaded
+            node.selected_bytes += selected
+    
+    def add_file(self, path, size_bytes, downloaded=False, selected=False):
+        """添加文件（已存在时先移除旧记录）"""
+        if path in self.files:
+            self.remove_file(path)
+        nodes = self._path_nodes(path, create=True)
+        nodes[-1].files.add(path.rpartition('/')[2])
+        self.files[path] = [size_bytes, downloaded, selected]
+        self._apply(path, 1, size_bytes, size_bytes if downloaded else 0, size_bytes if selected else 0)
+    
+    def remove_file(self, path):
+        """移除文件，并删除变空的文件夹"""
+        state = self.files.pop(path, None)
+        if state is None:
+            return
+        size_bytes, downloaded, selected = state
+        self._apply(path, -1, -size_bytes, -size_bytes if downloaded else 0, -size_bytes if selected else 0)
+        
+        nodes = self._path_nodes(path)
+        nodes[-1].files.discard(path.rpartition('/')[2])
+        parts = path.split('/')[:-1]
+        for i in range(len(parts), 0, -1):
+            if nodes[i].file_count:
+                break
+            del nodes[i - 1].children[parts[i - 1]]
+    
+    def set_size(self, path, size_bytes):
+        """更新文件大小"""
+        state = self.files.get(path)
+        if state is None or state[0] == size_bytes:
+            return
+        delta = size_bytes - state[0]
+        state[0] = size_bytes
+        self._apply(path, 0, delta, delta if state[1] else 0, delta if state[2] else 0)
+    
+    def set_downloaded(self, path, downloaded):
+        """更新文件的下载状态"""
+        state = self.files.get(path)
+        if state is None or state[1] == downloaded:
+            return
+        state[1] = downloaded
+        self._apply(path, 0, 0, state[0] if downloaded else -state[0], 0)
+    
+    def set_selected(self, paths, selected):
+        """批量更新文件的选中状态"""
+        for path in paths:
+            state = self.files.get(path)
+            if state is None or state[2] == selected:
+                continue
+            state[2] = selected
+            self._apply(path, 0, 0, 0, state[0] if selected else -state[0])
+    
+    def get_folder(self, folder):
+        """获取文件夹节点，不存在时返回None"""
+        if not folder:
+            return self.root
+        nodes = self._path_nodes(folder + '/')
+        return nodes[-1] if nodes else None
+    
+    def files_under(self, folder):
+        """获取文件夹下的所有文件（递归），只遍历该子树"""
+        node = self.get_folder(folder)
+        if node is None:
+            return []
+        files = []
+        stack = [(folder + '/' if folder else '', node)]
+        while stack:
+            prefix, node = stack.pop()
+            files.extend(prefix + name for name in node.files)
+            for name, child in node.children.items():
+                stack.append((prefix + name + '/', child))
+        return files
+    
+    def iter_folders(self):
+        """遍历所有文件夹，产出 (folder_path, node)"""
+        stack = [('', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            for name, child in node.children.items():
+                path = prefix + name
+                yield path, child
+                stack.append((path + '/', child))
+
+def format_folder_size(node):
+    """格式化文件夹大小，如 "12.3 GB (已下载 4.1 GB)" """
+    text = format_size(node.total_bytes)
+    if node.downloaded_bytes:
+        text += f" (已下载 {format_size(node.downloaded_bytes)})"
+    return text
+
+def format_eta(remaining):
+    """格式化剩余时间"""
+    if remaining < 60:
+        return f"{remaining:.0f}秒"
+    elif remaining < 3600:
+        return f"{remaining/60:.1f}分"
+    else:
+        return f"{remaining/3600:.1f}时"
+
+class JsonLineFormatter(logging.Formatter):
+    """把日志记录格式化为一行JSON（附加字段通过 extra={'fields': {...}} 传入）"""
+    
+    def format(self, record):
+        data = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        data.update(getattr(record, 'fields', {}))
+        return json.dumps(data, ensure_ascii=False)
+
+_structured_log_listener = None
+
+def setup_structured_log(log_file="gcb_log.jsonl", max_bytes=10 * 1024 * 1024, backup_count=5):
+    """创建结构化日志记录器：调用方只把记录放入队列，由后台线程写入按大小轮转的JSON Lines文件"""
+    global _structured_log_listener
+    logger = logging.getLogger('gcb')
+    if _structured_log_listener is not None:
+        return logger
+    
+    file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                        encoding='utf-8', delay=True)
+    file_handler.setFormatter(JsonLineFormatter())
+    log_queue = queue.SimpleQueue()
+    _structured_log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _structured_log_listener.start()
+    atexit.register(_structured_log_listener.stop)  # 退出前写完队列中的日志
+    
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+# 写入结构化日志的下载事件及其级别（进度事件过于频繁，不写入）
+DOWNLOAD_EVENT_LEVELS = {
+    'job_queued': logging.INFO,
+    'job_started': logging.INFO,
+    'job_done': logging.INFO,
+    'task_started': logging.DEBUG,
+    'task_skipped': logging.INFO,
+    'task_done': logging.INFO,
+    'task_linked': logging.INFO,
+    'task_retry': logging.WARNING,
+    'task_deferred': logging.INFO,
+    'task_paused': logging.INFO,
+    'task_resumed': logging.INFO,
+    'task_cancelled': logging.WARNING,
+    'task_processed': logging.INFO,
+    'task_process_failed': logging.ERROR,
+    'task_failed': logging.ERROR,
+    'task_error': logging.ERROR,
+    'log': logging.INFO
+}
+
+def log_download_event(logger, event):
+    """把下载事件写入结构化日志（可在工作线程中调用，不阻塞）"""
+    level = DOWNLOAD_EVENT_LEVELS.get(event['type'])
+    if level is None:
+        return
+    fields = {key: value for key, value in event.items() if key not in ('type', 'time', 'seq', 'message', 'slot')}
+    fields['event'] = event['type']
+    if 'slot' in event:
+        fields['task'] = event['slot'] + 1
+    message = event.get('message') or event.get('path') or event['type']
+    logger.log(level, message, extra={'fields': fields})
+
+def create_http_session(pool_size):
+    """创建带连接池的HTTP会话"""
+    import requests
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_file_metadata(session, url, timeout=5):
+    """获取单个文件的大小、ETag和修改时间（HEAD不支持或响应超时时改用GET）"""
+    import requests
+    # 不接受压缩传输，Content-Length即文件本身的大小
+    headers = {'Accept-Encoding': 'identity'}
+    try:
+        try:
+            response = session.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+        except requests.Timeout:
+            response = None  # 部分服务器处理HEAD很慢，GET只读取响应头即可
+        if response is None or response.status_code == 405:  # HEAD不支持，尝试GET
+            response = session.get(url, headers=headers, timeout=timeout, stream=True, allow_redirects=True)
+            response.close()
+        if response.status_code != 200:
+            return None
+        content_length = response.headers.get('content-length')
+        return {
+            'size_bytes': int(content_length) if content_length else 0,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified')
+        }
+    except (requests.RequestException, ValueError):
+        return None
+
+def remove_quietly(path):
+    """删除文件（不存在或删除失败时忽略）"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def parse_retry_after(value):
+    """解析 Retry-After 响应头（秒数或HTTP日期），返回需要等待的秒数，无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+def build_catalog(found_urls, target_url):
+    """根据扫描到的链接构建文件目录 {url: info}，大小留待后续获取"""
+    catalog = {}
+    for href in found_urls:
+        relative_path = get_relative_path(href, target_url)
+        if not relative_path:
+            relative_path = unquote(href.split("/")[-1])
+        catalog[href] = {'path': relative_path, 'size': '待获取', 'size_bytes': 0}
+    return catalog
+
+def get_driver_version(driver_path):
+    """获取ChromeDriver版本号"""
+    try:
+        output = subprocess.run([driver_path, '--version'], capture_output=True, text=True, timeout=10).stdout
+        # 输出形如 "ChromeDriver 120.0.6099.109 (...)"
+        parts = output.split()
+        return parts[1] if len(parts) > 1 else output.strip()
+    except Exception:
+        return '未知'
+
+def resolve_chromedriver(cache_file, check_interval, log):
+    """获取ChromeDriver路径 - 优先使用本地缓存，超过校验间隔才联网重新解析"""
+    cache = {}
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception:
+            cache = {}
+    cached_path = cache.get('path')
+    cached_valid = bool(cached_path) and os.path.exists(cached_path)
+    
+    if cached_valid and time.time() - cache.get('checked_at', 0) < check_interval:
+        log(f"使用缓存的ChromeDriver (版本 {cache.get('version', '未知')})")
+        return cached_path
+    
+    from webdriver_manager.chrome import ChromeDriverManager
+    try:
+        driver_path = ChromeDriverManager().install()
+    except Exception as e:
+        # 离线或解析失败时回退到缓存的驱动
+        if cached_valid:
+            log(f"ChromeDriver版本校验失败，继续使用缓存驱动: {e}")
+            return cached_path
+        raise
+    
+    version = get_driver_version(driver_path)
+    data = {
+        'path': driver_path,
+        'version': version,
+        'checked_at': time.time(),
+        'last_update': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        log(f"保存驱动缓存失败: {e}")
+    log(f"已解析ChromeDriver (版本 {version})")
+    return driver_path
+
+def collect_file_links(target_url, driver_cache_file, driver_check_interval, status, log, started_at=None):
+    """使用无头浏览器收集页面中的所有文件链接"""
+    started_at = started_at or time.perf_counter()
+    status("正在加载扫描组件...")
+    import_start = time.perf_counter()
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.common.exceptions import WebDriverException
+    import_elapsed = time.perf_counter() - import_start
+    
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-gpu')
+    options.page_load_strategy = 'eager'  # 加速页面加载
+    
+    status("正在启动浏览器...")
+    driver_start = time.perf_counter()
+    driver_path = resolve_chromedriver(driver_cache_file, driver_check_interval, log)
+    driver_elapsed = time.perf_counter() - driver_start
+    driver = webdriver.Chrome(service=Service(driver_path), options=options)
+    
+    try:
+        scan_start_elapsed = time.perf_counter() - started_at
+        log(f"扫描启动耗时: {scan_start_elapsed:.2f} 秒 (加载组件 {import_elapsed:.2f} 秒, 解析驱动 {driver_elapsed:.2f} 秒)")
+        
+        status(f"正在访问: {target_url}")
+        driver.get(target_url)
+        time.sleep(3)
+        
+        # 尝试展开文件树
+        status("正在展开文件树...")
+        try:
+            expand_script = """
+            if (typeof $ !== 'undefined' && $.jstree) {
+                $('.jstree').jstree('open_all');
+            }
+            if (typeof $ !== 'undefined' && $.ui && $.ui.fancytree) {
+                $.ui.fancytree.getTree().expandAll();
+            }
+            document.querySelectorAll('.jstree-closed, .fancytree-expander').forEach(el => el.click());
+            """
+            driver.execute_script(expand_script)
+            time.sleep(2)
+        except WebDriverException:
+            pass  # 页面没有可展开的文件树
+        
+        target_extensions = ('.nc', '.xlsx', '.xls', '.csv', '.zip', '.pdf')
+        found_urls = set()
+        stable_count = 0
+        
+        status("正在收集文件链接...")
+        
+        # 快速收集所有链接
+        while stable_count < 2:
+            new_count = 0
+            
+            # 批量获取href属性
+            hrefs = driver.execute_script("""
+                var links = document.querySelectorAll('a');
+                var hrefs = [];
+                for (var i = 0; i < links.length; i++) {
+                    if (links[i].href) hrefs.push(links[i].href);
+                }
+                return hrefs;
+            """)
+            
+            for href in hrefs:
+                if href and href not in found_urls and href.lower().endswith(target_extensions):
+                    found_urls.add(href)
+                    new_count += 1
+            
+            if new_count == 0:
+                stable_count += 1
+            else:
+                stable_count = 0
+                
+            status(f"已发现 {len(found_urls)} 个文件链接...")
+            
+            try:
+                driver.execute_script("window.scrollBy(0, 1000);")
+                driver.execute_script("""
+                    document.querySelectorAll('.jstree-closed').forEach(el => {
+                        var icon = el.querySelector('.jstree-icon');
+                        if (icon) icon.click();
+                    });
+                """)
+            except WebDriverException:
+                pass
+            time.sleep(0.5)
+        
+        return found_urls
+    finally:
+        # 关闭浏览器，释放资源
+        driver.quit()
+
+@contextlib.contextmanager
+def file_lock(path, timeout=30, stale_after=60):
+    """基于锁文件的跨进程/跨主机互斥锁（O_EXCL创建，适用于NFS共享目录），持有者崩溃后锁文件超时失效"""
+    lock_path = path + '.lock'
+    owner = f"{NODE_ID}-{threading.get_ident()}"  # 写入锁文件，释放时核对，不删除其它节点的锁
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, owner.encode('utf-8'))
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(lock_path) > stale_after
+            except OSError:
+                continue  # 锁刚被释放
+            if stale:
+                # 锁已过期：先改名再删除，多个节点同时清理时只有一个能改名成功
+                stale_path = f"{lock_path}.{owner}.stale"
+                try:
+                    os.rename(lock_path, stale_path)
+                    if time.time() - os.path.getmtime(stale_path) <= stale_after:
+                        os.rename(stale_path, lock_path)  # 改名前已被其它节点重新获取，还原
+                    else:
+                        os.remove(stale_path)
+                        continue
+                except OSError:
+                    pass
+            if time.time() > deadline:
+                raise TimeoutError(f"等待文件锁超时: {lock_path}")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                held = f.read() == owner
+            if held:
+                os.remove(lock_path)
+        except OSError:
+            pass
+
+class DownloadRecords:
+    """已下载/下载失败记录（线程安全，界面和后台服务共用）
+    
+    保存时在文件锁内读取磁盘上的记录并合并本机的变更，多个实例（包括其它主机上的节点）共用同一记录文件时不会互相覆盖
+    """
+    
+    def __init__(self, downloaded_record_file, failed_record_file):
+        self.downloaded_record_file = downloaded_record_file
+        self.failed_record_file = failed_record_file
+        self.downloaded = set()  # 已下载完成的文件路径
+        self.failed = set()  # 下载失败的文件路径
+        self.processed = {}  # 下载后处理的结果 {path: {步骤: 结果}}，保存在已下载记录文件中
+        self.changes = {'downloaded': {}, 'failed': {}, 'processed': {}}  # 尚未保存的变更 {path: True加入/False移除}，processed为 {path: 结果/None移除}
+        self.lock = threading.Lock()
+    
+    def _load(self, name, record_file):
+        if not os.path.exists(record_file):
+            return False
+        with open(record_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self.lock:
+            records = getattr(self, name)
+            records.clear()
+            records.update(data.get(name, []))
+            self.changes[name].clear()
+            if name == 'downloaded':
+                self.processed = data.get('processed', {})
+                self.changes['processed'].clear()
+        return True
+    
+    def load_downloaded(self):
+        """加载已下载记录，返回是否存在记录文件"""
+        return self._load('downloaded', self.downloaded_record_file)
+    
+    def load_failed(self):
+        """加载下载失败记录，返回是否存在记录文件"""
+        return self._load('failed', self.failed_record_file)
+    
+    def _save(self, name, record_file):
+        """合并保存：磁盘上的记录（可能含其它节点的结果）加上本机的变更，写入临时文件后替换"""
+        with file_lock(record_file), self.lock:
+            merged = set()
+            saved = {}
+            if os.path.exists(record_file):
+                with open(record_file, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                merged.update(saved.get(name, []))
+            for path, present in self.changes[name].items():
+                if present:
+                    merged.add(path)
+                else:
+                    merged.discard(path)
+            data = {
+                name: list(merged),
+                'last_update': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            if name == 'downloaded':
+                processed = saved.get('processed', {})
+                for path, result in self.changes['processed'].items():
+                    if result is None:
+                        processed.pop(path, None)
+                    else:
+                        processed[path] = result
+                if processed:
+                    data['processed'] = processed
+                self.changes['processed'].clear()
+                self.processed = processed
+            tmp_path = f"{record_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, record_file)
+            self.changes[name].clear()
+            records = getattr(self, name)
+            records.clear()
+            records.update(merged)
+    
+    def save_downloaded(self):
+        """保存已下载记录"""
+        self._save('downloaded', self.downloaded_record_file)
+    
+    def save_failed(self):
+        """保存下载失败记录"""
+        self._save('failed', self.failed_record_file)
+    
+    def _set(self, name, path, present):
+        """修改内存中的记录并登记变更（调用方持有self.lock）"""
+        records = getattr(self, name)
+        if present:
+            records.add(path)
+        else:
+            records.discard(path)
+        self.changes[name][path] = present
+    
+    def mark_downloaded(self, relative_path):
+        """标记文件为已下载（清除该文件以前的处理结果）"""
+        with self.lock:
+            self._set('downloaded', relative_path, True)
+            self._set_processed(relative_path, None)
+            # 从失败列表中移除
+            was_failed = relative_path in self.failed
+            self._set('failed', relative_path, False)
+        if was_failed:
+            self.save_failed()
+        self.save_downloaded()
+    
+    def mark_failed(self, relative_path):
+        """标记文件为下载失败"""
+        with self.lock:
+            self._set('failed', relative_path, True)
+            # 确保不在成功列表中
+            self._set('downloaded', relative_path, False)
+        self.save_failed()
+        self.save_downloaded()
+    
+    def discard_downloaded(self, paths):
+        """从已下载记录中移除文件（本地文件已删除），需随后调用save_downloaded"""
+        with self.lock:
+            for path in paths:
+                self._set('downloaded', path, False)
+                self._set_processed(path, None)
+    
+    def _set_processed(self, path, result):
+        """修改内存中的处理结果并登记变更（调用方持有self.lock）"""
+        if result is None:
+            if path not in self.processed:
+                return
+            self.processed.pop(path)
+        else:
+            self.processed[path] = result
+        self.changes['processed'][path] = result
+    
+    def mark_processed(self, relative_path, results):
+        """记录文件的下载后处理结果 {步骤: 结果}"""
+        with self.lock:
+            self._set_processed(relative_path, results)
+        self.save_downloaded()
+    
+    def snapshot(self):
+        """已下载和下载失败记录的副本 (downloaded, failed)，供界面线程遍历（记录本身由下载线程修改）"""
+        with self.lock:
+            return set(self.downloaded), set(self.failed)
+
+class ShardCoordinator:
+    """多机协作 - 多个实例共用同一下载目录（如NFS）时分配文件
+    
+    hash:  按相对路径的CRC32对节点数取模，各节点只下载自己的分片
+    lease: 下载前在 <下载目录>/.gcb_leases 中以O_EXCL创建租约文件，下载期间定期续约；
+           节点崩溃后租约过期，文件由其它节点接管
+    """
+    lease_dir_name = ".gcb_leases"
+    
+    def __init__(self, save_dir, mode='lease', shard_index=0, shard_count=1, lease_ttl=120):
+        if mode not in ('lease', 'hash'):
+            raise ValueError(f"未知的协作模式: {mode}")
+        if mode == 'hash' and not 0 <= shard_index < shard_count:
+            raise ValueError(f"分片序号超出范围: {shard_index}/{shard_count}")
+        self.mode = mode
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.lease_ttl = lease_ttl  # 租约有效期（秒），超过该时间未续约视为节点已崩溃
+        self.retry_interval = 15  # 文件被其它节点占用时，隔多久再尝试（秒）
+        self.node_id = NODE_ID
+        self.lease_dir = os.path.join(save_dir, self.lease_dir_name)
+        self.held = set()  # 本节点持有租约的文件
+        self.lock = threading.Lock()
+        if mode == 'lease':
+            os.makedirs(self.lease_dir, exist_ok=True)
+    
+    def describe(self):
+        if self.mode == 'hash':
+            return f"哈希分片 {self.shard_index + 1}/{self.shard_count}"
+        return f"租约（节点 {self.node_id}）"
+    
+    def owns(self, relative_path):
+        """哈希模式下文件是否属于本节点"""
+        return zlib.crc32(relative_path.encode('utf-8')) % self.shard_count == self.shard_index
+    
+    def filter_items(self, items):
+        """哈希模式只保留本节点的分片；租约模式按节点错开起始位置，减少节点间争抢同一文件"""
+        if self.mode == 'hash':
+            return [item for item in items if self.owns(item[1])]
+        if not items:
+            return list(items)
+        offset = zlib.crc32(self.node_id.encode('utf-8')) % len(items)
+        return list(items[offset:]) + list(items[:offset])
+    
+    def lease_path(self, relative_path):
+        return os.path.join(self.lease_dir, hashlib.sha1(relative_path.encode('utf-8')).hexdigest() + '.lease')
+    
+    def claim(self, relative_path):
+        """申请文件的租约，文件正被其它节点下载时返回False"""
+        if self.mode == 'hash':
+            return True
+        lease_file = self.lease_path(relative_path)
+        for _ in range(3):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(lease_file)
+                except OSError:
+                    continue  # 租约刚被释放
+                if age <= self.lease_ttl:
+                    return False
+                # 租约已过期：先改名再删除，多个节点同时接管时只有一个能改名成功
+                stale_file = f"{lease_file}.{self.node_id}.stale"
+                try:
+                    os.rename(lease_file, stale_file)
+                    if time.time() - os.path.getmtime(stale_file) <= self.lease_ttl:
+                        os.rename(stale_file, lease_file)  # 改名前已被其它节点接管，还原
+                        return False
+                    os.remove(stale_file)
+                except OSError:
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'node': self.node_id, 'path': relative_path, 'claimed_at': time.time()}, f)
+            with self.lock:
+                self.held.add(relative_path)
+            return True
+        return False
+    
+    def release(self, relative_path):
+        """释放租约"""
+        with self.lock:
+            if relative_path not in self.held:
+                return
+            self.held.discard(relative_path)
+        try:
+            os.remove(self.lease_path(relative_path))
+        except OSError:
+            pass
+    
+    def renew_all(self):
+        """续约本节点持有的所有租约"""
+        with self.lock:
+            held = list(self.held)
+        for relative_path in held:
+            try:
+                os.utime(self.lease_path(relative_path))
+            except OSError:
+                pass
+    
+    def start_heartbeat(self, done_event):
+        """后台定期续约，直到done_event被设置"""
+        if self.mode != 'lease':
+            return
+        
+        def heartbeat():
+            while not done_event.wait(self.lease_ttl / 4):
+                self.renew_all()
+        
+        threading.Thread(target=heartbeat, daemon=True).start()
+
+class DownloadCancelled(Exception):
+    """下载被取消"""
+    
+    def __init__(self):
+        super().__init__("用户取消")
+
+class DownloadPaused(Exception):
+    """下载被暂停（已下载的部分保留在 .part 文件中）"""
+    
+    def __init__(self):
+        super().__init__("用户暂停")
+
+class IncompleteDownload(IOError):
+    """收到的数据少于应有的长度（连接中途断开或分段未下载完），可重试，已收到的部分保留用于续传"""
+
+class TaskHandle:
+    """正在下载的单个文件的控制句柄 - 暂停、继续、取消"""
+    
+    def __init__(self, job, url, relative_path, slot):
+        self.job = job
+        self.url = url
+        self.path = relative_path
+        self.slot = slot
+        self.paused = False
+        self.cancelled = False
+        self.segmented = False  # 分段下载时暂停在原地等待，不释放任务槽位
+        self.committing = False  # 已下载完成，落盘和改名交给了写入线程池
+        self.stored_name = None  # 保存在磁盘上的相对路径（压缩保存时加 .gz）
+        self.running = threading.Event()  # 未暂停时置位
+        self.running.set()
+    
+    def pause(self):
+        self.paused = True
+        self.running.clear()
+    
+    def resume(self):
+        self.paused = False
+        self.running.set()
+    
+    def cancel(self):
+        self.cancelled = True
+        self.running.set()
+    
+    def check(self):
+        """在数据块之间调用：取消时抛出DownloadCancelled，暂停时抛出DownloadPaused"""
+        if self.job.cancelled or self.cancelled:
+            raise DownloadCancelled()
+        if self.paused:
+            raise DownloadPaused()
+    
+    def sleep(self, seconds):
+        """重试前等待，期间取消或暂停时立即抛出异常"""
+        deadline = time.time() + seconds
+        while True:
+            self.check()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.5))
+    
+    def wait_if_paused(self):
+        """分段下载暂停时原地等待继续（已写入的分段保留），取消时立即返回"""
+        while not self.running.wait(0.5):
+            if self.job.cancelled:
+                return
+
+class BatchProgress:
+    """批次整体进度 - 按字节加权，EWMA平滑总吞吐量，并估算整个批次的剩余时间
+    
+    下载线程只调用 add_bytes（每个线程累加自己的计数单元，无需加锁），界面或接口定时调用 snapshot 读取
+    """
+    throughput_tau = 10.0  # 吞吐量EWMA的时间常数（秒）
+    overhead_alpha = 0.2  # 单文件固定开销（连接到首字节）的EWMA系数
+    
+    def __init__(self, sizes, parallelism):
+        self.sizes = dict(sizes)  # {relative_path: 字节数，0或None表示未知}
+        self.parallelism = max(1, parallelism)
+        self.local = threading.local()
+        self.cells = []  # 各线程的字节计数单元 [n]，只由所属线程修改
+        self.cells_lock = threading.Lock()  # 线程首次登记计数单元、文件结束和读取已结束的计数时使用
+        self.inflight = {}  # {relative_path: 已接收字节}，正在下载的文件
+        self.started = {}  # {relative_path: 开始时间}
+        self.finished_bytes = 0  # 已结束文件（完成/跳过/失败）计入进度的字节数
+        self.finished_files = 0
+        self.overhead = None  # 每个文件的平均固定开销（秒）
+        self.throughput = None  # EWMA平滑后的总吞吐量（字节/秒）
+        self.last_sample = (time.time(), 0)
+    
+    def add_bytes(self, num_bytes):
+        """累加本线程接收的字节数（无锁）"""
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = self.local.cell = [0]
+            with self.cells_lock:
+                self.cells.append(cell)
+        cell[0] += num_bytes
+    
+    def transferred(self):
+        """所有线程累计接收的字节数"""
+        return sum(cell[0] for cell in list(self.cells))
+    
+    def file_started(self, relative_path):
+        self.started[relative_path] = time.time()
+        self.inflight[relative_path] = 0
+    
+    def file_progress(self, relative_path, downloaded):
+        """记录文件已接收的字节数，首个数据块到达时更新单文件开销估计"""
+        started = self.started.pop(relative_path, None)
+        if started is not None:
+            latency = time.time() - started
+            self.overhead = latency if self.overhead is None else (
+                self.overhead_alpha * latency + (1 - self.overhead_alpha) * self.overhead)
+        self.inflight[relative_path] = downloaded
+    
+    def file_finished(self, relative_path, actual_bytes=None):
+        """文件结束（完成、跳过或失败）；完成时以实际大小修正未知的文件大小"""
+        self.started.pop(relative_path, None)
+        self.inflight.pop(relative_path, None)
+        with self.cells_lock:
+            if actual_bytes is not None:
+                self.sizes[relative_path] = actual_bytes
+            self.finished_bytes += self.sizes.get(relative_path) or 0
+            self.finished_files += 1
+    
+    def total_bytes(self):
+        """批次总字节数，未知大小的文件按已知文件的平均大小估计"""
+        known = [size for size in self.sizes.values() if size]
+        if not known:
+            return 0
+        return sum(known) + (len(self.sizes) - len(known)) * (sum(known) / len(known))
+    
+    def snapshot(self):
+        """采样一次吞吐量并返回整体进度"""
+        now = time.time()
+        transferred = self.transferred()
+        last_time, last_transferred = self.last_sample
+        elapsed = now - last_time
+        if elapsed >= 0.2:
+            rate = (transferred - last_transferred) / elapsed
+            weight = 1 - math.exp(-elapsed / self.throughput_tau)
+            self.throughput = rate if self.throughput is None else weight * rate + (1 - weight) * self.throughput
+            self.last_sample = (now, transferred)
+        
+        with self.cells_lock:
+            total = self.total_bytes()
+            finished_bytes, finished_files = self.finished_bytes, self.finished_files
+        done = min(finished_bytes + sum(self.inflight.copy().values()), total) if total else 0
+        remaining_files = max(len(self.sizes) - finished_files, 0)
+        eta = None
+        if remaining_files == 0:
+            eta = 0
+        elif self.throughput:
+            # 传输时间按总吞吐量计算；每个文件的固定开销由并行的任务分摊
+            eta = (total - done) / self.throughput + remaining_files * (self.overhead or 0) / self.parallelism
+        return {
+            'done_bytes': int(done),
+            'total_bytes': int(total),
+            'fraction': done / total if total else finished_files / max(len(self.sizes), 1),
+            'throughput': self.throughput or 0,
+            'eta': eta,
+            'files_done': finished_files,
+            'files_total': len(self.sizes)
+        }
+
+class DownloadJob:
+    """一个下载批次 - 记录待下载文件、并发上限、统计和事件流"""
+    max_events = 5000  # 事件保留条数（进度事件较多，只保留最近的）
+    
+    def __init__(self, job_id, items, save_dir, parallelism, description='', overwrite=False, sizes=None, etags=None):
+        self.id = job_id
+        self.items = list(items)  # [(url, relative_path), ...]
+        self.save_dir = save_dir
+        self.parallelism = max(1, parallelism)
+        self.description = description
+        self.overwrite = overwrite  # 覆盖已存在的文件（同步模式更新变化的文件）
+        self.coordinator = None  # 多机协作时的ShardCoordinator
+        self.placement = None  # 多卷存放时的VolumePlacement
+        self.deferred = collections.deque()  # 被其它节点占用、稍后再试的文件 (可重试时间, url, path)
+        self.urgent = collections.deque()  # 优先下载的文件，排在所有批次的待下载文件之前
+        self.paused_tasks = collections.OrderedDict()  # 已暂停的文件 {path: url}
+        self.state = 'queued'  # queued / running / done / cancelled
+        self.created_at = time.time()
+        self.finished_at = None
+        self.pending = collections.deque(self.items)
+        self.active = 0
+        self.free_slots = list(range(self.parallelism))  # 任务槽位，界面按槽位显示进度条
+        self.cancelled = False
+        self.stats = {'completed': 0, 'skipped': 0, 'failed': 0, 'cancelled': 0, 'processed': 0, 'process_failed': 0,
+                      'linked': 0, 'saved_bytes': 0, 'disk_saved': 0,
+                      'transfer_saved': 0, 'storage_saved': 0}  # linked为直接复用已有文件的数量；后两项为压缩传输和压缩保存节省的字节
+        self.committing = 0  # 已下载完成、等待落盘和改名的文件数
+        self.post_tasks = {}  # 正在进行下载后处理的文件 {Future: path}
+        self.etags = dict(etags or {})  # 目录中已知的ETag {relative_path: ETag}，下载前按它查找可复用的文件
+        sizes = sizes or {}
+        self.progress = BatchProgress({path: sizes.get(path) for _, path in self.items}, self.parallelism)
+        self.events = []
+        self.event_base = 0  # events[0] 的序号
+        self.cond = threading.Condition()
+        self.done = threading.Event()
+        self.listeners = []  # listener(event)，在工作线程中调用
+    
+    @property
+    def total(self):
+        return len(self.items)
+    
+    def emit(self, event_type, **fields):
+        """发布事件：保存到事件流并通知监听者"""
+        with self.cond:
+            event = dict(fields, type=event_type, job=self.id, seq=self.event_base + len(self.events), time=time.time())
+            self.events.append(event)
+            if len(self.events) > self.max_events:
+                drop = len(self.events) - self.max_events
+                del self.events[:drop]
+                self.event_base += drop
+            self.cond.notify_all()
+        for listener in self.listeners:
+            listener(event)
+    
+    def events_since(self, seq, timeout=None):
+        """获取序号不小于seq的事件，没有新事件时最多等待timeout秒"""
+        with self.cond:
+            if self.event_base + len(self.events) <= seq and not self.done.is_set():
+                self.cond.wait(timeout)
+            start = max(0, seq - self.event_base)
+            return self.events[start:]
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'state': self.state,
+            'save_dir': self.save_dir,
+            'parallelism': self.parallelism,
+            'total': self.total,
+            'pending': len(self.pending) + len(self.urgent) + len(self.deferred),
+            'paused': list(self.paused_tasks),
+            'active': self.active,
+            'processing': len(self.post_tasks),
+            'stats': dict(self.stats),
+            'progress': self.progress.snapshot(),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+class PersistentQueue:
+    """可在崩溃后恢复的下载队列 - 把批次的文件顺序、状态、重试次数和已下载字节数保存到磁盘
+    
+    作为下载事件的监听者更新状态，状态变化只标记为待写入，由后台线程合并后原子写入，
+    频繁的进度事件不会频繁写盘；程序崩溃或断电时最多丢失最近 flush_interval 秒的状态，
+    续传以磁盘上的 .part 文件为准，已完成的文件再次下载时会被跳过。
+    """
+    flush_interval = 1.0  # 合并写入的间隔（秒）
+    finished_states = ('done', 'skipped', 'failed', 'cancelled')
+    
+    def __init__(self, state_file="gcb_queue_state.json"):
+        self.state_file = state_file
+        self.batch = None  # {'save_dir', 'parallelism', 'created_at', 'files': {path: {url, state, attempts, bytes, size}}}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # 写盘和删除状态文件互斥
+        self.dirty = False
+        self.wake = threading.Event()
+        self.writer = None
+        self.writes = 0  # 实际写盘次数
+    
+    def load(self):
+        """读取上次未完成的批次，没有或已完成时返回None"""
+        if not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            batch = json.load(f)
+        # JSON对象保持写入时的顺序，即下载顺序
+        if not any(entry['state'] not in self.finished_states for entry in batch['files'].values()):
+            return None
+        return batch
+    
+    def begin(self, items, save_dir, parallelism, sizes=None):
+        """开始记录新批次（覆盖上次的批次），立即写盘"""
+        sizes = sizes or {}
+        files = collections.OrderedDict()
+        for url, relative_path in items:
+            files[relative_path] = {'url': url, 'state': 'pending', 'attempts': 0, 'bytes': 0,
+                                    'size': sizes.get(relative_path) or 0}
+        self.activate({'save_dir': save_dir, 'parallelism': parallelism, 'created_at': time.time(), 'files': files})
+    
+    def resume(self, batch):
+        """继续上次的批次：中断时正在下载的文件重新排队，返回待下载列表和已暂停的文件"""
+        files = collections.OrderedDict(batch['files'])
+        for entry in files.values():
+            if entry['state'] == 'active':
+                entry['state'] = 'pending'
+        batch = dict(batch, files=files)
+        self.activate(batch)
+        items = [(entry['url'], path) for path, entry in files.items() if entry['state'] in ('pending', 'paused')]
+        paused = [path for path, entry in files.items() if entry['state'] == 'paused']
+        return items, paused
+    
+    def activate(self, batch):
+        with self.lock:
+            self.batch = batch
+        self.flush(force=True)
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._run, daemon=True)
+            self.writer.start()
+            atexit.register(self.flush)  # 关闭窗口时写入最后的状态
+    
+    def discard(self):
+        """放弃上次未完成的批次"""
+        with self.write_lock:
+            with self.lock:
+                self.batch = None
+                self.dirty = False
+            if os.path.exists(self.state_file):
+                os.remove(self.state_file)
+    
+    def summary(self, batch=None):
+        """统计批次中各状态的文件数和待下载文件已下载的字节数"""
+        batch = batch or self.batch
+        counts = collections.Counter(entry['state'] for entry in batch['files'].values())
+        partial = sum(entry['bytes'] for entry in batch['files'].values() if entry['state'] not in self.finished_states)
+        return {'total': len(batch['files']), 'counts': dict(counts), 'partial_bytes': partial}
+    
+    def on_event(self, event):
+        """下载事件监听者（在工作线程中调用）"""
+        kind = event['type']
+        with self.lock:
+            if self.batch is None:
+                return
+            files = self.batch['files']
+            if kind == 'job_done':
+                if event['state'] == 'done':
+                    # 批次全部结束，不再需要恢复
+                    self.batch = None
+                    self.dirty = False
+                    finished = True
+                else:
+                    finished = False
+            elif kind == 'task_prioritized':
+                # 优先下载的文件移到最前，保持与下载队列一致的顺序
+                for relative_path in reversed(event['paths']):
+                    if relative_path in files:
+                        files.move_to_end(relative_path, last=False)
+                self.dirty = True
+            else:
+                entry = files.get(event.get('path'))
+                if entry is None:
+                    return
+                if kind == 'task_started':
+                    entry['state'] = 'active'
+                elif kind == 'progress':
+                    entry['bytes'] = event['downloaded']
+                    if event['total']:
+                        entry['size'] = event['total']
+                elif kind == 'task_retry':
+                    entry['attempts'] = event['attempt']
+                elif kind in ('task_done', 'task_linked'):
+                    entry.update(state='done', bytes=event['bytes'])
+                elif kind == 'task_skipped':
+                    entry['state'] = 'skipped'
+                elif kind in ('task_failed', 'task_error'):
+                    entry['state'] = 'failed'
+                elif kind == 'task_paused':
+                    entry['state'] = 'paused'
+                elif kind == 'task_resumed':
+                    entry['state'] = 'pending'
+                elif kind == 'task_cancelled':
+                    # 停止整个批次时文件仍待下载，下次可以继续
+                    entry['state'] = 'pending' if event.get('stopped') else 'cancelled'
+                elif kind == 'task_deferred':
+                    entry['state'] = 'pending'
+                else:
+                    return
+                self.dirty = True
+            if kind != 'job_done':
+                self.wake.set()
+                return
+        if finished:
+            self.discard()
+        else:
+            self.flush(force=True)
+    
+    def _run(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.flush_interval)  # 合并这段时间内的所有变化
+            self.wake.clear()
+            try:
+                self.flush()
+            except OSError:
+                pass  # 下次状态变化时重试
+    
+    def flush(self, force=False):
+        """把当前状态原子写入磁盘（先写临时文件并fsync，再替换）"""
+        with self.write_lock:
+            with self.lock:
+                if self.batch is None or not (self.dirty or force):
+                    return
+                data = json.dumps(self.batch, ensure_ascii=False)
+                self.dirty = False
+            tmp_path = f"{self.state_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_file)
+            self.writes += 1
+
+class WriteStream:
+    """单个文件的写入流 - 网络线程把数据块放入有界缓冲区，由共享的磁盘写入线程按偏移写入
+    
+    缓冲区满时 write 阻塞等待（背压），写入线程出错时在下一次 write 或 close 时抛出
+    """
+    
+    def __init__(self, pool, path, mode, max_buffer, tasks):
+        self.pool = pool
+        self.path = path
+        self.file = open(path, mode)
+        self.position = self.file.tell()  # 写入线程的当前文件位置（追加模式下为文件末尾）
+        self.max_buffer = max_buffer  # 缓冲区上限（字节）
+        self.tasks = tasks  # 所属写入线程的任务队列，同一文件的数据块按顺序写入
+        self.buffered = 0  # 已接收尚未写入磁盘的字节数
+        self.wait_seconds = 0.0  # 网络线程等待缓冲区空间的累计时间
+        self.error = None
+        self.closing = False
+        self.closed = threading.Event()
+        self.cond = threading.Condition()
+    
+    def write(self, offset, data):
+        """放入一个数据块（offset为其在文件中的位置，可多线程调用），返回字节数"""
+        size = len(data)
+        with self.cond:
+            if self.buffered and self.buffered + size > self.max_buffer and self.error is None:
+                start = time.time()
+                while self.buffered and self.buffered + size > self.max_buffer and self.error is None:
+                    self.cond.wait()
+                waited = time.time() - start
+                self.wait_seconds += waited
+                self.pool.record_stall(waited)
+            if self.error is not None:
+                raise self.error
+            self.buffered += size
+        self.pool.record_buffered(size)
+        self.tasks.put((self, offset, data))
+        return size
+    
+    def close(self, sync=False):
+        """等待缓冲的数据全部写入后关闭文件，sync为True时同时落盘（fsync）；写入出错时抛出异常"""
+        with self.cond:
+            if not self.closing:
+                self.closing = True
+                self.tasks.put((self, sync, None))
+        self.closed.wait()
+        if self.error is not None:
+            raise self.error
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        # 异常退出时（暂停、取消、网络错误）同样写完已接收的数据，保证 .part 文件大小即续传位置
+        try:
+            self.close()
+        except OSError:
+            if exc_type is None:
+                raise
+    
+    def _write(self, offset, data):
+        """在写入线程中执行"""
+        if self.error is None:
+            try:
+                start = time.time()
+                if offset != self.position:
+                    self.file.seek(offset)
+                self.file.write(data)
+                self.position = offset + len(data)
+                self.pool.record_write(len(data), time.time() - start)
+            except OSError as e:
+                self.error = e
+        with self.cond:
+            self.buffered -= len(data)
+            self.cond.notify_all()
+        self.pool.record_buffered(-len(data))
+    
+    def _close(self, sync):
+        """在写入线程中执行"""
+        try:
+            if self.error is None:
+                self.file.flush()
+                if sync:
+                    start = time.time()
+                    os.fsync(self.file.fileno())
+                    self.pool.record_fsync(time.time() - start)
+        except OSError as e:
+            self.error = e
+        finally:
+            try:
+                self.file.close()
+            except OSError as e:
+                self.error = self.error or e
+            with self.cond:
+                self.cond.notify_all()
+            self.closed.set()
+
+class DiskWriterPool:
+    """共享的磁盘写入线程 - 网络读取和磁盘写入分离，磁盘变慢时占用缓冲内存而不拖慢网络传输
+    
+    所有下载（包括分段下载的各段）共用这些线程，每个文件固定由一个线程按顺序写入
+    """
+    
+    def __init__(self, workers=2, buffer_size=8 * 1024 * 1024):
+        self.workers = workers  # 写入线程数
+        self.buffer_size = buffer_size  # 每个文件的写入缓冲区上限（字节）
+        self.queues = []
+        self.next_queue = itertools.count()
+        self.lock = threading.Lock()
+        self.stats = {'written': 0, 'write_seconds': 0.0, 'buffered': 0, 'peak_buffered': 0,
+                      'stalls': 0, 'stall_seconds': 0.0, 'fsyncs': 0, 'fsync_seconds': 0.0}
+        self.commit_delay = 0.1  # 落盘前等待的时间（秒），期间下载完成的文件一起落盘，每个目录只fsync一次
+        self.commits = None  # 等待落盘和改名的文件，首次使用时启动提交线程
+    
+    def open(self, path, mode='wb'):
+        """打开文件，返回WriteStream（首次使用时启动写入线程）"""
+        with self.lock:
+            if not self.queues:
+                for _ in range(self.workers):
+                    tasks = queue.Queue()
+                    threading.Thread(target=self._run, args=(tasks,), daemon=True).start()
+                    self.queues.append(tasks)
+            tasks = self.queues[next(self.next_queue) % len(self.queues)]
+        return WriteStream(self, path, mode, self.buffer_size, tasks)
+    
+    def _run(self, tasks):
+        while True:
+            stream, offset, data = tasks.get()
+            if data is None:
+                stream._close(offset)
+            else:
+                stream._write(offset, data)
+    
+    def commit(self, part_path, file_path, sync, callback):
+        """把下载完成的临时文件改名为目标文件，结束后调用 callback(error)（成功时error为None）
+        
+        sync为True时先落盘（fsync）再改名，由提交线程批量完成，调用方不必等待；否则立即改名。
+        """
+        if not sync:
+            try:
+                os.replace(part_path, file_path)
+            except OSError as e:
+                callback(e)
+            else:
+                callback(None)
+            return
+        with self.lock:
+            if self.commits is None:
+                self.commits = queue.Queue()
+                threading.Thread(target=self._run_commits, daemon=True).start()
+        self.commits.put((part_path, file_path, callback))
+    
+    def _run_commits(self):
+        while True:
+            batch = [self.commits.get()]
+            time.sleep(self.commit_delay)
+            while True:
+                try:
+                    batch.append(self.commits.get_nowait())
+                except queue.Empty:
+                    break
+            start = time.time()
+            results = []
+            for part_path, file_path, callback in batch:
+                try:
+                    fd = os.open(part_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    os.replace(part_path, file_path)
+                    results.append((callback, None))
+                except OSError as e:
+                    results.append((callback, e))
+            if os.name == 'posix':
+                # 改名记录在目录中，目录同样落盘（Windows不支持对目录fsync）
+                for folder in {os.path.dirname(os.path.abspath(file_path)) for _, file_path, _ in batch}:
+                    try:
+                        fd = os.open(folder, os.O_RDONLY)
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+                    except OSError:
+                        pass
+            self.record_fsync(time.time() - start, len(batch))
+            for callback, error in results:
+                try:
+                    callback(error)
+                except Exception:
+                    pass  # 回调自行处理错误，提交线程继续运行
+    
+    def record_buffered(self, delta):
+        with self.lock:
+            self.stats['buffered'] += delta
+            self.stats['peak_buffered'] = max(self.stats['peak_buffered'], self.stats['buffered'])
+    
+    def record_write(self, num_bytes, seconds):
+        with self.lock:
+            self.stats['written'] += num_bytes
+            self.stats['write_seconds'] += seconds
+    
+    def record_stall(self, seconds):
+        with self.lock:
+            self.stats['stalls'] += 1
+            self.stats['stall_seconds'] += seconds
+    
+    def record_fsync(self, seconds, files=1):
+        with self.lock:
+            self.stats['fsyncs'] += files
+            self.stats['fsync_seconds'] += seconds
+    
+    def snapshot(self):
+        """写入统计：缓冲字节数（当前/峰值）、磁盘写入速度、网络等待磁盘的次数和时间、fsync次数和时间"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['write_speed'] = stats['written'] / stats['write_seconds'] if stats['write_seconds'] else 0
+        return stats
+
+# 下载时协商压缩传输（gzip/deflate）的文本类型；NetCDF、ZIP等本身已压缩的文件按原样传输，字节范围和续传位置保持准确
+COMPRESSIBLE_TYPES = ('.csv', '.tsv', '.txt', '.dat', '.json', '.xml', '.md')
+GZIP_STORE_TYPES = ('.csv',)  # 可以压缩保存（加 .gz 后缀）的文件类型
+GZIP_SUFFIX = '.gz'
+
+def gzip_store_name(relative_path):
+    """文件压缩保存时的路径，不支持压缩保存的类型返回None"""
+    if relative_path.lower().endswith(GZIP_STORE_TYPES):
+        return relative_path + GZIP_SUFFIX
+    return None
+
+def find_stored_file(file_path):
+    """文件在磁盘上的实际路径（原样保存或压缩保存为 .gz），都不存在时返回None"""
+    candidates = [file_path]
+    if gzip_store_name(file_path):
+        candidates.append(file_path + GZIP_SUFFIX)
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return None
+
+def stored_size_matches(stored_path, size):
+    """磁盘上的文件内容是否为size字节（压缩保存的文件比较gzip尾部记录的原始大小，该值按4GB取模）"""
+    if not stored_path.endswith(GZIP_SUFFIX) or size is None:
+        return os.path.getsize(stored_path) == size
+    with open(stored_path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0] == size % (1 << 32)
+
+def open_data_file(file_path, mode='rb', **kwargs):
+    """打开下载的文件，压缩保存（.gz）的文件自动解压 - file_path为原始文件名，mode和其它参数同open()
+    
+    例: with open_data_file('GCB_Data/GCB2024/national.csv', 'rt', encoding='utf-8') as f: ...
+    """
+    stored_path = find_stored_file(file_path) or file_path
+    if stored_path != file_path:
+        return gzip.open(stored_path, mode, **kwargs)
+    return open(file_path, mode, **kwargs)
+
+def compute_checksum(file_path, options):
+    """计算文件内容的校验和（压缩保存的文件按解压后的内容计算，在子进程中运行）"""
+    algorithm = options.get('checksum_algorithm', 'sha256')
+    digest = hashlib.new(algorithm)
+    with open_data_file(file_path) as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return {'algorithm': algorithm, 'value': digest.hexdigest()}
+
+def file_crc32(file_path):
+    """按块计算文件的CRC32"""
+    crc = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+def extract_zip(file_path, options):
+    """流式解压ZIP到同名目录（逐个成员边读边写，不把压缩包读入内存），已存在且大小和CRC相同的成员跳过（在子进程中运行）"""
+    target_dir = os.path.splitext(file_path)[0]
+    result = {'target': target_dir, 'extracted': 0, 'skipped': 0, 'unsafe': 0, 'bytes': 0}
+    with zipfile.ZipFile(file_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            # 拒绝绝对路径和 .. 等指向目标目录之外的成员
+            parts = [part for part in member.filename.replace('\\', '/').split('/') if part not in ('', '.')]
+            if not parts or '..' in parts or member.filename.startswith(('/', '\\')) or ':' in parts[0]:
+                result['unsafe'] += 1
+                continue
+            target = os.path.join(target_dir, *parts)
+            if (os.path.isfile(target) and os.path.getsize(target) == member.file_size
+                    and file_crc32(target) == member.CRC):
+                result['skipped'] += 1
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 先解压到临时文件（读完时zipfile会校验CRC），完整后再替换；出错（CRC错误、磁盘已满等）时删除临时文件
+            tmp_path = target + '.part'
+            try:
+                with archive.open(member) as src, open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(tmp_path, target)
+            except BaseException:
+                remove_quietly(tmp_path)
+                raise
+            result['extracted'] += 1
+            result['bytes'] += member.file_size
+    return result
+
+# 下载后处理步骤：名称 -> (适用的扩展名，None表示所有文件; 处理函数)
+POST_PROCESS_STEPS = {
+    'checksum': (None, compute_checksum),
+    'extract': (('.zip',), extract_zip),
+}
+
+def run_post_steps(file_path, steps, options):
+    """在子进程中依次执行下载后处理步骤，返回 {步骤: 结果}，单个步骤出错不影响其它步骤"""
+    results = {}
+    for step in steps:
+        start = time.time()
+        try:
+            result = POST_PROCESS_STEPS[step][1](file_path, options)
+        except Exception as e:
+            result = {'error': str(e)}
+        result['elapsed'] = round(time.time() - start, 3)
+        results[step] = result
+    return results
+
+def describe_post_results(results):
+    """把下载后处理结果整理成一行说明"""
+    if isinstance(results.get('error'), str):
+        return f"处理失败: {results['error']}"
+    parts = []
+    for step, result in results.items():
+        if 'error' in result:
+            parts.append(f"{step} 失败: {result['error']}")
+        elif step == 'extract':
+            text = f"解压 {result['extracted']} 个文件"
+            if result['skipped']:
+                text += f"，跳过 {result['skipped']} 个相同文件"
+            if result['unsafe']:
+                text += f"，忽略 {result['unsafe']} 个路径不安全的成员"
+            parts.append(text)
+        elif step == 'checksum':
+            parts.append(f"{result['algorithm']}: {result['value']}")
+    return "；".join(parts)
+
+class PostProcessor:
+    """下载后处理 - 在独立的进程池中处理下载完成的文件（校验和、解压等），与后续下载并行，不占用下载线程"""
+    
+    def __init__(self, steps=(), workers=None):
+        self.steps = list(steps)  # 启用的处理步骤（POST_PROCESS_STEPS中的名称），为空时不处理
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))  # 处理进程数
+        self.options = {'checksum_algorithm': 'sha256'}
+        self.executor = None
+        self.lock = threading.Lock()
+    
+    def steps_for(self, relative_path):
+        """适用于该文件的处理步骤"""
+        name = relative_path.lower()
+        return [step for step in self.steps
+                if POST_PROCESS_STEPS[step][0] is None or name.endswith(POST_PROCESS_STEPS[step][0])]
+    
+    def _submit(self, fn, *args):
+        """提交到进程池，返回Future；进程池异常退出后自动重建"""
+        with self.lock:
+            if self.executor is None or getattr(self.executor, '_broken', False):
+                # 使用spawn：界面和下载线程运行中fork子进程可能死锁
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor.submit(fn, *args)
+    
+    def submit(self, file_path, steps):
+        """提交处理，返回Future（结果为 {步骤: 结果}）"""
+        return self._submit(run_post_steps, file_path, steps, dict(self.options))
+    
+    def checksum(self, file_path):
+        """在进程池中计算文件的SHA-256（供去重使用），返回Future（结果同compute_checksum）"""
+        return self._submit(compute_checksum, file_path, {'checksum_algorithm': 'sha256'})
+
+FICLONE = 0x40049409  # Linux ioctl：在支持写时复制的文件系统（btrfs、XFS等）上克隆文件
+
+def etag_identifies_content(etag, size):
+    """ETag能否代表文件内容：弱ETag以及nginx/Apache默认格式（修改时间-大小[-inode]，含大小的十六进制）
+    只说明同一个文件未变化，不同文件的ETag可能相同，不能用于跨路径去重"""
+    if not etag or etag.startswith('W/'):
+        return False
+    value = etag.strip('"')
+    return len(value) >= 16 and format(size, 'x') not in value.split('-')
+
+def link_file(source, target, allow_copy=True):
+    """把已有文件放到目标位置：优先reflink（写时复制），其次硬链接，都不支持时复制（allow_copy为False时抛出异常），返回使用的方式"""
+    tmp_path = f"{target}.{NODE_ID}.link"
+    remove_quietly(tmp_path)
+    method = None
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        method = 'reflink'
+    except (ImportError, OSError):
+        remove_quietly(tmp_path)
+    try:
+        if method is None:
+            try:
+                os.link(source, tmp_path)
+                method = 'hardlink'
+            except OSError:
+                if not allow_copy:
+                    raise
+                shutil.copyfile(source, tmp_path)
+                method = 'copy'
+        os.replace(tmp_path, target)
+    except OSError:
+        remove_quietly(tmp_path)
+        raise
+    return method
+
+LINK_METHOD_NAMES = {'reflink': "写时复制", 'hardlink': "硬链接", 'copy': "本地复制"}
+
+class DedupeIndex:
+    """去重索引 - 记录已下载文件的大小、ETag和内容哈希（SHA-256）
+    
+    新版本中重新发布的未变化文件按大小+ETag找到已有文件后直接链接，不再下载；
+    下载完成的文件与已有文件内容相同时改为链接，节省磁盘空间。
+    按绝对路径保存，使用前核对文件的大小和修改时间，文件被修改或删除后自动作废。
+    """
+    save_interval = 5  # 两次写盘的最短间隔（秒），批次结束时总会保存
+    
+    def __init__(self, index_file="gcb_dedupe_index.json"):
+        self.index_file = index_file
+        self.entries = {}  # {绝对路径: {'size', 'mtime', 'etag', 'sha256'}}
+        self.by_etag = {}  # {(大小, ETag): set(路径)}
+        self.etag_sizes = collections.Counter()  # by_etag中各文件大小的文件数，用于判断是否值得先获取ETag
+        self.by_hash = {}  # {sha256: set(路径)}
+        self.imported = set()  # 已导入同步清单和校验和的下载目录
+        self.loaded = False
+        self.dirty = False
+        self.last_save = 0
+        self.lock = threading.Lock()
+    
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    for path, entry in json.load(f).get('files', {}).items():
+                        self._put(path, entry)
+    
+    def _put(self, path, entry):
+        self._drop(path)
+        self.entries[path] = entry
+        if entry.get('etag') and etag_identifies_content(entry['etag'], entry['size']):
+            self.by_etag.setdefault((entry['size'], entry['etag']), set()).add(path)
+            self.etag_sizes[entry['size']] += 1
+        if entry.get('sha256'):
+            self.by_hash.setdefault(entry['sha256'], set()).add(path)
+        self.dirty = True
+    
+    def _drop(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return
+        for table, key in ((self.by_etag, (entry['size'], entry.get('etag'))), (self.by_hash, entry.get('sha256'))):
+            paths = table.get(key)
+            if paths and path in paths:
+                paths.discard(path)
+                if table is self.by_etag:
+                    self.etag_sizes[entry['size']] -= 1
+                    if not self.etag_sizes[entry['size']]:
+                        del self.etag_sizes[entry['size']]
+                if not paths:
+                    del table[key]
+        self.dirty = True
+    
+    def _valid(self, path):
+        """文件仍存在且未被修改（大小和修改时间与记录一致）"""
+        entry = self.entries[path]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == entry['size'] and int(st.st_mtime) == entry['mtime']
+    
+    def _find(self, table, key, exclude=None):
+        for path in list(table.get(key, ())):
+            if path == exclude:
+                continue
+            if self._valid(path):
+                return path
+            self._drop(path)
+        return None
+    
+    def add(self, file_path, etag=None, sha256=None):
+        """记录下载完成（或已链接）的文件"""
+        self.load()
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        with self.lock:
+            self._put(path, {'size': st.st_size, 'mtime': int(st.st_mtime), 'etag': etag, 'sha256': sha256})
+    
+    def find_by_etag(self, size, etag, exclude=None):
+        """按大小+ETag查找内容相同的已有文件（ETag不能代表内容时返回None）"""
+        if not size or not etag_identifies_content(etag, size):
+            return None
+        self.load()
+        with self.lock:
+            return self._find(self.by_etag, (size, etag), os.path.abspath(exclude) if exclude else None)
+    
+    def has_size(self, size):
+        """索引中是否有该大小、ETag能代表内容的文件"""
+        self.load()
+        with self.lock:
+            return size in self.etag_sizes
+    
+    def find_by_hash(self, sha256, exclude=None):
+        """按内容哈希查找已有文件"""
+        self.load()
+        with self.lock:
+            return self._find(self.by_hash, sha256, os.path.abspath(exclude) if exclude else None)
+    
+    def get(self, file_path):
+        """获取仍然有效的索引条目"""
+        self.load()
+        path = os.path.abspath(file_path)
+        with self.lock:
+            if path in self.entries and self._valid(path):
+                return dict(self.entries[path])
+        return None
+    
+    def import_save_dir(self, save_dir, processed=None):
+        """导入下载目录中已有的信息：同步清单中的ETag和下载后处理计算的SHA-256（每个目录只导入一次）"""
+        self.load()
+        save_dir = os.path.abspath(save_dir)
+        with self.lock:
+            if save_dir in self.imported:
+                return 0
+            self.imported.add(save_dir)
+        manifest = {}
+        manifest_file = os.path.join(save_dir, SyncRunner.manifest_name)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f).get('files', {})
+        hashes = {path: result['checksum']['value'] for path, result in (processed or {}).items()
+                  if result.get('checksum', {}).get('algorithm') == 'sha256' and 'value' in result['checksum']}
+        added = 0
+        for relative_path in set(manifest) | set(hashes):
+            path = os.path.join(save_dir, relative_path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            etag = manifest.get(relative_path, {}).get('etag')
+            if manifest.get(relative_path, {}).get('size_bytes') not in (None, 0, st.st_size):
+                etag = None  # 清单与文件不一致
+            with self.lock:
+                if path in self.entries:
+                    continue
+                self._put(path, {'size': st.st_size, 'mtime': int(st.st_mtime), 'etag': etag,
+                                 'sha256': hashes.get(relative_path)})
+            added += 1
+        return added
+    
+    def save(self, force=True):
+        """保存索引（force为False时距上次保存不足save_interval秒则跳过）"""
+        with self.lock:
+            if not self.dirty or (not force and time.time() - self.last_save < self.save_interval):
+                return
+            data = {'files': self.entries, 'last_update': time.strftime('%Y-%m-%d %H:%M:%S')}
+            tmp_path = f"{self.index_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+            self.dirty = False
+            self.last_save = time.time()
+
+def _existing_parent(path):
+    """路径本身或最近的已存在的上级目录"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def free_space(path):
+    """路径所在磁盘的剩余空间（路径尚不存在时查询最近的已存在的上级目录）"""
+    return shutil.disk_usage(_existing_parent(path)).free
+
+class VolumePlacement:
+    """多卷存放 - 把文件按策略分散到多个目标卷（磁盘），下载目录中用符号链接组成统一的目录树
+    
+    每个文件所在的卷记录在下载目录的路径映射中，不支持符号链接时（如Windows没有权限）按路径映射查找文件。
+    策略: free_space 剩余空间最多的卷；round_robin 轮流；pinned 按顶层文件夹固定到指定的卷（未固定的按剩余空间）。
+    """
+    map_name = "gcb_volume_map.json"  # 路径映射 {relative_path: 卷目录}，保存在下载目录中
+    policy_names = {'free_space': "剩余空间优先", 'round_robin': "轮流", 'pinned': "按文件夹固定"}
+    save_interval = 5  # 两次保存路径映射的最短间隔（秒）
+    
+    def __init__(self, save_dir, volumes, policy='free_space', pins=None):
+        if policy not in self.policy_names:
+            raise ValueError(f"未知的存放策略: {policy}")
+        self.save_dir = save_dir
+        self.policy = policy
+        self.pins = {folder: os.path.abspath(volume) for folder, volume in (pins or {}).items()}  # {顶层文件夹: 卷目录}
+        # 未固定的文件只分配到列出的卷上（只配置了固定卷时使用固定卷）
+        self.volumes = [os.path.abspath(volume) for volume in volumes] or sorted(set(self.pins.values()))
+        if not self.volumes:
+            raise ValueError("没有配置存储卷")
+        self.targets = list(collections.OrderedDict.fromkeys(self.volumes + list(self.pins.values())))  # 所有卷
+        self.map_file = os.path.join(save_dir, self.map_name)
+        self.path_map = {}
+        self.reserved = collections.Counter()  # 已分配但尚未下载完成的字节数 {卷: 字节}
+        self.sizes = {}  # 已分配文件的预计大小 {relative_path: 字节}
+        self.turn = 0  # 轮流策略的下一个卷
+        self.symlinks = True  # 创建符号链接失败后只使用路径映射
+        self.dirty = False
+        self.last_save = 0
+        self.lock = threading.Lock()
+        if os.path.exists(self.map_file):
+            with open(self.map_file, 'r', encoding='utf-8') as f:
+                self.path_map = json.load(f).get('files', {})
+    
+    def describe(self):
+        return f"{len(self.targets)} 个存储卷，{self.policy_names[self.policy]}"
+    
+    def _pick(self, relative_path, size, available):
+        """按策略选择卷；available为各卷可用空间（已扣除已分配的部分）"""
+        folder = relative_path.replace('\\', '/').split('/')[0]
+        if self.policy == 'pinned' and folder in self.pins:
+            return self.pins[folder]
+        if self.policy == 'round_robin':
+            for i in range(len(self.volumes)):
+                volume = self.volumes[(self.turn + i) % len(self.volumes)]
+                if available[volume] >= size:
+                    self.turn = (self.turn + i + 1) % len(self.volumes)
+                    return volume
+        return max(self.volumes, key=lambda volume: available[volume])
+    
+    def plan(self, sizes):
+        """预估按当前策略存放一批文件后各卷需要的空间 {卷: 字节}（不实际分配）"""
+        with self.lock:
+            turn = self.turn
+            available = {volume: free_space(volume) - self.reserved[volume] for volume in self.targets}
+            needed = collections.Counter({volume: 0 for volume in self.targets})
+            for relative_path, size in sizes.items():
+                volume = self.path_map.get(relative_path)
+                if volume not in available:
+                    volume = self._pick(relative_path, size or 0, available)
+                needed[volume] += size or 0
+                available[volume] -= size or 0
+            self.turn = turn
+        return dict(needed)
+    
+    def assign(self, relative_path, size=0):
+        """为文件分配存放的卷（已分配过的文件沿用原来的卷，中断的下载可以续传），返回实际的文件路径
+        
+        新的分配立即保存：程序崩溃后仍能找到卷上已下载的部分（.part）和文件。
+        """
+        with self.lock:
+            volume = self.path_map.get(relative_path)
+            assigned = volume is None or volume not in self.targets
+            if assigned:
+                available = {v: free_space(v) - self.reserved[v] for v in self.targets}
+                volume = self._pick(relative_path, size or 0, available)
+                self.path_map[relative_path] = volume
+                self.dirty = True
+            if relative_path not in self.sizes:
+                self.sizes[relative_path] = size or 0
+                self.reserved[volume] += size or 0
+        if assigned:
+            try:
+                self.save()
+            except OSError:
+                pass  # 保存失败时保持未保存状态，之后随批次再次保存
+        return os.path.join(volume, relative_path)
+    
+    def resolve(self, relative_path):
+        """文件的实际路径（没有分配过卷的文件位于下载目录中）"""
+        volume = self.path_map.get(relative_path)
+        if volume is None:
+            return os.path.join(self.save_dir, relative_path)
+        return os.path.join(volume, relative_path)
+    
+    def release(self, relative_path):
+        """文件下载结束（成功或失败），释放预留的空间"""
+        with self.lock:
+            size = self.sizes.pop(relative_path, None)
+            volume = self.path_map.get(relative_path)
+            if size is not None and volume is not None:
+                self.reserved[volume] -= size
+    
+    def link(self, relative_path):
+        """在下载目录中创建指向实际文件的符号链接，返回是否已链接"""
+        self.release(relative_path)
+        return self._symlink(self.resolve(relative_path), os.path.join(self.save_dir, relative_path))
+    
+    def link_directory(self, relative_path, target_dir):
+        """在下载目录中创建指向卷上目录（如ZIP的解压目录）的符号链接，下载目录中已有同名目录时保留，返回是否已链接"""
+        logical_path = os.path.join(self.save_dir, relative_path)
+        if os.path.isdir(logical_path) and not os.path.islink(logical_path):
+            return False
+        return self._symlink(target_dir, logical_path)
+    
+    def _symlink(self, target, logical_path):
+        """原子地创建（或替换）符号链接 logical_path -> target"""
+        if not self.symlinks or os.path.abspath(target) == os.path.abspath(logical_path):
+            return False
+        os.makedirs(os.path.dirname(logical_path) or '.', exist_ok=True)
+        tmp_path = f"{logical_path}.{NODE_ID}.symlink"
+        try:
+            remove_quietly(tmp_path)
+            os.symlink(os.path.abspath(target), tmp_path, target_is_directory=os.path.isdir(target))
+            os.replace(tmp_path, logical_path)
+            return True
+        except (OSError, NotImplementedError):
+            remove_quietly(tmp_path)
+            self.symlinks = False  # 之后只记录路径映射
+            return False
+    
+    def remove(self, relative_path):
+        """删除文件及其在下载目录中的符号链接"""
+        for path in (self.resolve(relative_path), os.path.join(self.save_dir, relative_path)):
+            if os.path.lexists(path):
+                os.remove(path)
+        with self.lock:
+            if self.path_map.pop(relative_path, None) is not None:
+                self.dirty = True
+    
+    def save(self, force=True):
+        """保存路径映射（force为False时距上次保存不足save_interval秒则跳过）"""
+        with self.lock:
+            if not self.dirty or (not force and time.time() - self.last_save < self.save_interval):
+                return
+            data = {'volumes': self.targets, 'policy': self.policy, 'files': self.path_map,
+                    'last_update': time.strftime('%Y-%m-%d %H:%M:%S')}
+            os.makedirs(self.save_dir, exist_ok=True)
+            tmp_path = f"{self.map_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.map_file)
+            self.dirty = False
+            self.last_save = time.time()
+
+def preflight_space(save_dir, sizes, placement=None):
+    """下载前检查剩余空间：sizes为待下载文件的大小 {relative_path: 字节}，返回空间不足的 [(目录, 需要, 剩余)]
+    
+    位于同一磁盘上的多个卷合并计算。
+    """
+    if placement:
+        needed = placement.plan(sizes)
+    else:
+        needed = {os.path.abspath(save_dir): sum(size or 0 for size in sizes.values())}
+    devices = collections.OrderedDict()  # {设备号: [目录, 需要的字节数]}
+    for path, size in needed.items():
+        device = os.stat(_existing_parent(path)).st_dev
+        devices.setdefault(device, [path, 0])[1] += size
+    short = []
+    for path, size in devices.values():
+        available = free_space(path)
+        if size > available:
+            short.append((path, size, available))
+    return short
+
+def describe_space_shortage(short):
+    """空间不足的说明（用于日志和提示）"""
+    return "；".join(f"{path} 需要 {format_size(size)}，剩余 {format_size(available)}" for path, size, available in short)
+
+class DownloadEngine:
+    """下载引擎 - 多个下载批次共享一个连接池和一个并发预算"""
+    
+    def __init__(self, records, max_workers=5, max_retries=3, retry_delay=1):
+        self.records = records
+        self.max_workers = max_workers  # 所有批次合计的最大并发下载数
+        self.max_retries = max_retries  # 最大重试次数
+        self.retry_delay = retry_delay  # 重试间隔（秒）
+        self.max_retry_after = 120  # 服务器要求等待（429/503 的 Retry-After）的最长时间（秒）
+        self.timeout = (10, 120)  # (连接超时, 读取超时)（秒），数据停止到达超过读取超时即重试
+        self.segment_threshold = 256 * 1024 * 1024  # 超过该大小且有多个可用镜像时分段下载（字节）
+        self.segment_size = 32 * 1024 * 1024  # 分段大小（字节）
+        self.segment_workers = 4  # 单个文件的最大分段并发数
+        self.fsync_on_complete = True  # 文件下载完成后先落盘（fsync）再改名，断电后不会留下不完整的文件（写入线程池批量执行）
+        self.compress_transfer = True  # 文本类型（COMPRESSIBLE_TYPES）传输时请求gzip/deflate压缩
+        self.store_compressed = False  # CSV文件边下载边压缩，保存为 .csv.gz
+        self.compress_level = 6  # 压缩保存的gzip压缩级别
+        self.writer_pool = DiskWriterPool()  # 所有下载共用的磁盘写入线程
+        self.post_processor = PostProcessor()  # 下载后处理（默认不启用任何步骤）
+        self.dedupe = None  # DedupeIndex，跨版本去重（None表示不去重）
+        self.session = None
+        self.mirror_pool = None
+        self.shard = None  # 多机协作配置 {'mode', 'shard_index', 'shard_count', 'lease_ttl'}，None表示单机
+        self.jobs = collections.OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.finished_job_ttl = 3600  # 已结束的批次保留的时间（秒），之后从列表中移除
+        self.max_finished_jobs = 50  # 最多保留的已结束批次数
+        self.tasks = {}  # 正在下载的文件 {(job_id, path): TaskHandle}
+        self.paused = False  # 整个队列暂停：不再开始新文件，连接池保持不变
+        self.cond = threading.Condition()
+        self.workers = []
+    
+    def get_session(self):
+        """获取共享的HTTP会话（所有批次复用同一个连接池）"""
+        with self.cond:
+            if self.session is None:
+                self.session = create_http_session(max(self.max_workers * self.segment_workers, 10))
+            return self.session
+    
+    def set_max_workers(self, max_workers):
+        """调整并发预算"""
+        with self.cond:
+            self.max_workers = max_workers
+            self._start_workers()
+            self.cond.notify_all()
+    
+    def submit(self, items, save_dir, parallelism, description='', listener=None, overwrite=False, sizes=None,
+               placement=None, etags=None):
+        """提交下载批次，返回DownloadJob；sizes为已知的文件大小 {relative_path: 字节数}，用于按字节计算整体进度；
+        placement为VolumePlacement时文件分散存放到多个卷；etags为目录中已知的ETag {relative_path: ETag}"""
+        self.get_session()
+        if self.dedupe:
+            try:
+                self.dedupe.import_save_dir(save_dir, self.records.processed)
+            except (OSError, ValueError):
+                pass  # 清单损坏时只是少了可复用的文件
+        coordinator = None
+        if self.shard:
+            # 多机协作：哈希模式只保留本节点的分片，租约模式在下载前逐个申请
+            coordinator = ShardCoordinator(save_dir, **self.shard)
+            items = coordinator.filter_items(list(items))
+        with self.cond:
+            self._evict_finished_jobs()
+            job = DownloadJob(next(self.job_ids), items, save_dir, parallelism, description, overwrite, sizes, etags)
+            job.coordinator = coordinator
+            job.placement = placement
+            if listener:
+                job.listeners.append(listener)
+            self.jobs[job.id] = job
+            job.emit('job_queued', total=job.total)
+            if placement:
+                job.emit('log', message=f"多卷存放: {placement.describe()}")
+            if coordinator:
+                job.emit('log', message=f"多机协作: {coordinator.describe()}，本节点负责 {job.total} 个文件")
+                coordinator.start_heartbeat(job.done)
+            self._finish_if_done(job)
+            self._start_workers()
+            self.cond.notify_all()
+        return job
+    
+    def cancel(self, job_id):
+        """取消批次：排队中的文件不再下载，正在下载的文件尽快中止（已下载的部分保留，下次下载时续传）"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return job
+            job.cancelled = True
+            futures = list(job.post_tasks)
+            self._finish_if_done(job)
+            self.cond.notify_all()
+        # 尚未开始的下载后处理不再执行，正在处理的文件等待其完成
+        for future in futures:
+            future.cancel()
+        return job
+    
+    def list_jobs(self):
+        with self.cond:
+            self._evict_finished_jobs()
+            return list(self.jobs.values())
+    
+    def _evict_finished_jobs(self):
+        """移除结束超过finished_job_ttl的批次，并只保留最近的max_finished_jobs个已结束批次（调用方持有self.cond）"""
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.done.is_set()]
+        for index, job in enumerate(finished):
+            if now - job.finished_at > self.finished_job_ttl or index < len(finished) - self.max_finished_jobs:
+                del self.jobs[job.id]
+    
+    def target_path(self, job, relative_path, stored_name=None):
+        """文件实际保存的路径（多卷存放时为分配的卷上的路径，启用多卷存放前已下载的文件留在原处）
+        
+        stored_name为保存在磁盘上的相对路径（压缩保存时加 .gz，默认同relative_path），按它分配卷，按relative_path预留空间。
+        """
+        stored_name = stored_name or relative_path
+        file_path = os.path.join(job.save_dir, stored_name)
+        if job.placement is None or (stored_name not in job.placement.path_map and os.path.lexists(file_path)):
+            return file_path
+        return job.placement.assign(stored_name, job.progress.sizes.get(relative_path))
+    
+    def stored_name(self, relative_path):
+        """文件保存在磁盘上的相对路径（启用压缩保存时CSV加 .gz 后缀）"""
+        if self.store_compressed:
+            return gzip_store_name(relative_path) or relative_path
+        return relative_path
+    
+    def part_path(self, job, relative_path):
+        """文件下载过程中使用的临时文件（多机协作时带节点标识，各节点互不干扰）"""
+        file_path = self.target_path(job, relative_path, self.stored_name(relative_path))
+        if job.coordinator:
+            return f"{file_path}.{job.coordinator.node_id}.part"
+        return file_path + '.part'
+    
+    def _take_queued(self, job, relative_path):
+        """从批次的待下载队列中取出文件，返回其url（不在队列中时返回None）"""
+        for items in (job.urgent, job.pending):
+            for item in items:
+                if item[1] == relative_path:
+                    items.remove(item)
+                    return item[0]
+        for item in job.deferred:
+            if item[2] == relative_path:
+                job.deferred.remove(item)
+                return item[1]
+        return None
+    
+    def pause_task(self, job_id, relative_path):
+        """暂停单个文件：正在下载的文件保留已下载的部分，排队中的文件移出队列"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            handle = self.tasks.get((job_id, relative_path))
+            if handle is not None:
+                handle.pause()
+                if handle.segmented:
+                    job.emit('task_paused', slot=handle.slot, path=relative_path, in_place=True)
+                return True
+            url = self._take_queued(job, relative_path)
+            if url is None:
+                return False
+            job.paused_tasks[relative_path] = url
+        job.emit('task_paused', path=relative_path)
+        return True
+    
+    def resume_task(self, job_id, relative_path):
+        """继续已暂停的文件（排到队列最前，从已下载的位置续传）"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            handle = self.tasks.get((job_id, relative_path))
+            if handle is not None and handle.paused:
+                handle.resume()
+            elif relative_path in job.paused_tasks:
+                job.urgent.append((job.paused_tasks.pop(relative_path), relative_path))
+            else:
+                return False
+            self.cond.notify_all()
+        job.emit('task_resumed', path=relative_path)
+        return True
+    
+    def cancel_task(self, job_id, relative_path):
+        """取消单个文件并删除已下载的部分"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            handle = self.tasks.get((job_id, relative_path))
+            if handle is not None:
+                handle.cancel()
+                return True
+            if job.paused_tasks.pop(relative_path, None) is None and self._take_queued(job, relative_path) is None:
+                return False
+            job.stats['cancelled'] += 1
+            job.progress.file_finished(relative_path)
+            self._finish_if_done(job)
+            self.cond.notify_all()
+        part_path = self.part_path(job, relative_path)
+        if os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+        if job.placement:
+            job.placement.release(self.stored_name(relative_path))
+        job.emit('task_cancelled', path=relative_path)
+        return True
+    
+    def prioritize(self, job_id, paths):
+        """把文件（包括已暂停的）移到队列最前，按给定顺序下载，返回移动的文件数"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return 0
+            moved_paths = []
+            for relative_path in paths:
+                url = job.paused_tasks.pop(relative_path, None) or self._take_queued(job, relative_path)
+                if url is not None:
+                    job.urgent.append((url, relative_path))
+                    moved_paths.append(relative_path)
+            self.cond.notify_all()
+        if moved_paths:
+            job.emit('task_prioritized', paths=moved_paths)
+        return len(moved_paths)
+    
+    def pause_all(self):
+        """暂停整个队列：不再开始新文件，正在下载的文件同时暂停"""
+        with self.cond:
+            self.paused = True
+            handles = list(self.tasks.values())
+        for handle in handles:
+            self.pause_task(handle.job.id, handle.path)
+    
+    def resume_all(self):
+        """继续整个队列，包括单独暂停的文件"""
+        with self.cond:
+            self.paused = False
+            paused = [(job.id, path) for job in self.jobs.values() for path in job.paused_tasks]
+            paused += [(handle.job.id, handle.path) for handle in self.tasks.values() if handle.paused]
+            self.cond.notify_all()
+        for job_id, relative_path in paused:
+            self.resume_task(job_id, relative_path)
+    
+    def _start_workers(self):
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker, args=(len(self.workers),), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def _next_task(self):
+        """挑选下一个可运行的文件：先看各批次的优先下载文件，再按提交顺序（遵守各批次自己的并发上限）"""
+        if self.paused:
+            return None
+        now = time.time()
+        for urgent_pass in (True, False):
+            for job in self.jobs.values():
+                if job.cancelled or job.active >= job.parallelism:
+                    continue
+                if urgent_pass:
+                    if not job.urgent:
+                        continue
+                    url, relative_path = job.urgent.popleft()
+                elif job.pending:
+                    url, relative_path = job.pending.popleft()
+                elif job.deferred and job.deferred[0][0] <= now:
+                    _, url, relative_path = job.deferred.popleft()
+                else:
+                    continue
+                job.active += 1
+                job.free_slots.sort()
+                slot = job.free_slots.pop(0)
+                if job.state == 'queued':
+                    job.state = 'running'
+                    job.emit('job_started')
+                return job, slot, url, relative_path
+        return None
+    
+    def _finish_if_done(self, job):
+        """批次中没有正在下载、落盘或处理的文件且已无待下载或已暂停的文件（或已取消）时结束批次"""
+        waiting = job.pending or job.deferred or job.urgent or job.paused_tasks
+        if job.done.is_set() or job.active or job.committing or job.post_tasks or (waiting and not job.cancelled):
+            return
+        job.state = 'cancelled' if job.cancelled else 'done'
+        job.finished_at = time.time()
+        job.emit('job_done', state=job.state, stats=dict(job.stats))
+        job.done.set()
+    
+    def _worker(self, index):
+        while True:
+            with self.cond:
+                task = None
+                while task is None:
+                    if index < self.max_workers:
+                        task = self._next_task()
+                    if task is None:
+                        # 有等待重试的文件时定时醒来检查
+                        self.cond.wait(1.0 if any(job.deferred for job in self.jobs.values()) else None)
+                job, slot, url, relative_path = task
+                handle = self.tasks[(job.id, relative_path)] = TaskHandle(job, url, relative_path, slot)
+            try:
+                if job.coordinator and not job.coordinator.claim(relative_path):
+                    # 其它节点正在下载该文件：稍后再试（届时文件已存在则跳过，节点崩溃则租约过期后接管）
+                    job.emit('task_deferred', slot=slot, path=relative_path)
+                    with self.cond:
+                        job.deferred.append((time.time() + job.coordinator.retry_interval, url, relative_path))
+                else:
+                    try:
+                        self.download_file(job, slot, url, relative_path, handle)
+                    finally:
+                        if not handle.committing:  # 等待落盘的文件在改名后释放
+                            self.release_task(job, relative_path, handle.stored_name)
+            except Exception as e:
+                job.emit('log', message=f"[任务{slot+1}] 下载出错: {e}")
+            finally:
+                with self.cond:
+                    self.tasks.pop((job.id, relative_path), None)
+                    job.active -= 1
+                    job.free_slots.append(slot)
+                    self._finish_if_done(job)
+                    self.cond.notify_all()
+                self.save_indexes(job)
+    
+    def release_task(self, job, relative_path, stored_name=None):
+        """文件下载结束，释放多机协作的租约和多卷存放预留的空间（按分配时的stored_name）"""
+        if job.coordinator:
+            job.coordinator.release(relative_path)
+        if job.placement:
+            job.placement.release(stored_name or relative_path)
+    
+    def _commit_finished(self, job, relative_path, stored_name):
+        """下载完成的文件已落盘和改名（或失败），在提交线程中调用"""
+        self.release_task(job, relative_path, stored_name)
+        with self.cond:
+            job.committing -= 1
+            self._finish_if_done(job)
+            self.cond.notify_all()
+        self.save_indexes(job)
+    
+    def start_post_processing(self, job, relative_path, file_path):
+        """把下载完成的文件交给下载后处理进程池，结果写入下载记录"""
+        steps = self.post_processor.steps_for(relative_path)
+        if not steps:
+            return
+        try:
+            future = self.post_processor.submit(file_path, steps)
+        except Exception as e:
+            job.emit('task_process_failed', path=relative_path, error=str(e))
+            return
+        with self.cond:
+            job.post_tasks[future] = relative_path
+        future.add_done_callback(lambda f: self._post_processed(job, f))
+    
+    def _post_processed(self, job, future):
+        """下载后处理结束（在进程池的管理线程中调用）"""
+        with self.cond:
+            relative_path = job.post_tasks.get(future)
+        if relative_path is None:
+            return
+        try:
+            results = None if future.cancelled() else future.result()
+        except Exception as e:
+            results = {'error': str(e)}
+        if results is not None:
+            try:
+                self.records.mark_processed(relative_path, results)
+            except Exception as e:
+                job.emit('log', message=f"保存处理结果失败: {e}")
+            # 进程池本身出错时结果只有error，否则逐个步骤检查
+            failed = 'error' in results or any('error' in result for result in results.values())
+            extracted = results.get('extract')
+            if job.placement and isinstance(extracted, dict) and 'target' in extracted:
+                # 解压目录位于卷上，在下载目录中创建指向它的符号链接
+                try:
+                    job.placement.link_directory(os.path.splitext(relative_path)[0], extracted['target'])
+                except OSError as e:
+                    job.emit('log', message=f"创建解压目录的链接失败: {e}")
+            with job.cond:
+                job.stats['process_failed' if failed else 'processed'] += 1
+            job.emit('task_process_failed' if failed else 'task_processed', path=relative_path, results=results)
+        with self.cond:
+            job.post_tasks.pop(future, None)
+            self._finish_if_done(job)
+            self.cond.notify_all()
+        self.save_indexes(job)
+    
+    def save_indexes(self, job):
+        """保存去重索引和多卷存放的路径映射（批次进行中按间隔保存，批次结束时立即保存）"""
+        if self.dedupe:
+            try:
+                self.dedupe.save(force=job.done.is_set())
+            except OSError as e:
+                job.emit('log', message=f"保存去重索引失败: {e}")
+        if job.placement:
+            try:
+                job.placement.save(force=job.done.is_set())
+            except OSError as e:
+                job.emit('log', message=f"保存存储卷路径映射失败: {e}")
+    
+    def reuse_existing(self, job, slot, relative_path, file_path, source, etag):
+        """远程文件与已下载的文件相同（大小+ETag一致）：链接已有文件，不再下载"""
+        try:
+            method = link_file(source, file_path)
+        except OSError as e:
+            job.emit('log', message=f"[任务{slot+1}] 复用已有文件失败，改为下载: {e}")
+            return False
+        size = os.path.getsize(file_path)
+        entry = self.dedupe.get(source) or {}
+        try:
+            self.dedupe.add(file_path, etag, entry.get('sha256'))
+        except OSError:
+            pass
+        self.records.mark_downloaded(relative_path)
+        with job.cond:
+            job.stats['completed'] += 1
+            job.stats['linked'] += 1
+            job.stats['saved_bytes'] += size
+            if method != 'copy':
+                job.stats['disk_saved'] += size
+        if job.placement:
+            job.placement.link(relative_path)
+        job.progress.file_finished(relative_path, size)
+        job.emit('task_linked', slot=slot, path=relative_path, source=source, method=method, bytes=size)
+        self.start_post_processing(job, relative_path, file_path)
+        return True
+    
+    def deduplicate_downloaded(self, job, slot, relative_path, file_path, etag, sha256):
+        """记录下载完成的文件；与已有文件内容相同时改为链接到已有文件，节省磁盘空间
+        
+        下载时没有计算哈希的文件（分段下载、续传）交给下载后处理的进程池计算，算完后再去重，不占用下载线程。
+        """
+        if sha256 is not None:
+            self._deduplicate(job, slot, file_path, etag, sha256)
+            return
+        future = self.post_processor.checksum(file_path)
+        with self.cond:
+            job.post_tasks[future] = relative_path
+        future.add_done_callback(lambda f: self._checksum_done(job, slot, file_path, etag, f))
+    
+    def _checksum_done(self, job, slot, file_path, etag, future):
+        """去重用的哈希计算结束（在进程池的管理线程中调用）"""
+        try:
+            if not future.cancelled():
+                self._deduplicate(job, slot, file_path, etag, future.result()['value'])
+        except Exception as e:
+            job.emit('log', message=f"[任务{slot+1}] 记录去重信息失败: {e}")
+        with self.cond:
+            job.post_tasks.pop(future, None)
+            self._finish_if_done(job)
+            self.cond.notify_all()
+        self.save_indexes(job)
+    
+    def _deduplicate(self, job, slot, file_path, etag, sha256):
+        """按哈希查找内容相同的已有文件，找到时改为链接到该文件，并把文件加入去重索引"""
+        source = self.dedupe.find_by_hash(sha256, exclude=file_path)
+        if source and os.path.getsize(source) == os.path.getsize(file_path):
+            try:
+                method = link_file(source, file_path, allow_copy=False)
+                size = os.path.getsize(file_path)
+                with job.cond:
+                    job.stats['disk_saved'] += size
+                job.emit('log', message=f"[任务{slot+1}] 与已有文件内容相同，已改为{LINK_METHOD_NAMES[method]}: {source}")
+            except OSError:
+                pass  # 不支持链接时保留下载的文件
+        self.dedupe.add(file_path, etag, sha256)
+    
+    def make_progress_reporter(self, job, slot, relative_path, total_size, initial=0):
+        """创建进度回调 on_bytes(n)，按0.3秒间隔发布进度事件（线程安全，分段下载时多线程共用）；initial为续传前已有的字节数"""
+        lock = threading.Lock()
+        state = {'downloaded': initial, 'last_time': time.time(), 'last_downloaded': initial}
+        job.emit('progress', slot=slot, path=relative_path, downloaded=initial, total=total_size, speed=0)
+        
+        def on_bytes(num_bytes):
+            job.progress.add_bytes(num_bytes)
+            with lock:
+                state['downloaded'] += num_bytes
+                downloaded = state['downloaded']
+                job.progress.file_progress(relative_path, downloaded)
+                current_time = time.time()
+                if current_time - state['last_time'] < 0.3:
+                    return
+                elapsed = current_time - state['last_time']
+                speed = (downloaded - state['last_downloaded']) / elapsed if elapsed > 0 else 0
+                state['last_time'] = current_time
+                state['last_downloaded'] = downloaded
+            job.emit('progress', slot=slot, path=relative_path, downloaded=downloaded, total=total_size, speed=speed)
+        
+        return on_bytes
+    
+    def should_download_segmented(self, total_size, response):
+        """判断是否按字节范围从多个镜像并行下载"""
+        return (total_size >= self.segment_threshold
+                and response.headers.get('accept-ranges', '').lower() == 'bytes'
+                and self.mirror_pool.healthy_count() >= 2)
+    
+    def download_segments(self, job, handle, url, file_path, total_size, on_bytes):
+        """把大文件按字节范围拆分，每段路由到当前最快的可用镜像并行下载，返回等待磁盘写入的时间（秒）"""
+        session = self.get_session()
+        segments = queue.Queue()
+        for start in range(0, total_size, self.segment_size):
+            segments.put((start, min(start + self.segment_size, total_size) - 1, 0))
+        
+        with open(file_path, 'wb') as f:
+            f.truncate(total_size)
+        
+        errors = []
+        
+        def fetch_segments(stream):
+            while not (job.cancelled or handle.cancelled):
+                try:
+                    start, end, attempts = segments.get_nowait()
+                except queue.Empty:
+                    return
+                
+                mirror = self.mirror_pool.choose()
+                position = start
+                start_time = time.time()
+                try:
+                    headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+                    with session.get(self.mirror_pool.map_url(url, mirror), headers=headers,
+                                     stream=True, timeout=self.timeout) as r:
+                        if r.status_code != 206:
+                            raise IOError(f"镜像不支持分段下载 (HTTP {r.status_code})")
+                        for chunk in r.iter_content(chunk_size=65536):
+                            handle.wait_if_paused()
+                            if job.cancelled or handle.cancelled:
+                                return
+                            position += stream.write(position, chunk)
+                            on_bytes(len(chunk))
+                    if position != end + 1:
+                        raise IncompleteDownload("分段数据不完整")
+                    self.mirror_pool.report_success(mirror, position - start, time.time() - start_time)
+                except OSError as e:
+                    if stream.error is not None:
+                        # 磁盘写入失败，换镜像也无济于事
+                        errors.append(stream.error)
+                        return
+                    # 换一个镜像继续下载该段剩余部分
+                    self.mirror_pool.report_failure(mirror)
+                    if attempts + 1 >= self.max_retries:
+                        errors.append(e)
+                        return
+                    segments.put((position, end, attempts + 1))
+        
+        num_workers = min(self.segment_workers, segments.qsize())
+        with self.writer_pool.open(file_path, 'r+b') as stream:
+            threads = [threading.Thread(target=fetch_segments, args=(stream,), daemon=True) for _ in range(num_workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            
+            if job.cancelled or handle.cancelled:
+                raise DownloadCancelled()
+            if stream.error is not None:
+                raise stream.error
+            if errors:
+                raise IncompleteDownload(f"分段下载失败: {errors[0]}")
+            if not segments.empty():
+                raise IncompleteDownload("分段下载未完成")
+            stream.close()
+        return stream.wait_seconds
+    
+    def download_file(self, job, slot, url, relative_path, handle=None):
+        """下载单个文件 - 带重试机制，出错时自动切换镜像，已有 .part 文件时从断点续传"""
+        import requests
+        session = self.get_session()
+        handle = handle or TaskHandle(job, url, relative_path, slot)
+        # 压缩保存时文件名加 .gz；另一种保存形式的文件（切换设置之前下载的）同样视为已存在
+        stored_name = self.stored_name(relative_path)
+        compress = stored_name != relative_path
+        handle.stored_name = stored_name  # 结束时按分配卷时的名称释放预留空间
+        file_path = self.target_path(job, relative_path, stored_name)
+        other_name = relative_path if compress else gzip_store_name(relative_path)
+        other_path = None
+        if other_name:
+            other_path = job.placement.resolve(other_name) if job.placement else os.path.join(job.save_dir, other_name)
+        content_path = file_path[:-len(GZIP_SUFFIX)] if compress else file_path  # 供下载后处理透明读取
+        file_dir = os.path.dirname(file_path)
+        # 先写入临时文件，下载完成后再替换：目标文件存在即完整，暂停或停止后可续传，覆盖失败时保留原文件
+        download_path = self.part_path(job, relative_path)
+        
+        job.emit('task_started', slot=slot, path=relative_path)
+        job.progress.file_started(relative_path)
+        task_start = time.time()
+        
+        try:
+            if file_dir and not os.path.exists(file_dir):
+                os.makedirs(file_dir, exist_ok=True)
+            
+            # 覆盖模式下，多机协作时其它节点在本批次开始后已更新的文件同样跳过
+            existing, existing_name = file_path, stored_name
+            if not os.path.exists(file_path) and other_path and os.path.exists(other_path):
+                existing, existing_name = other_path, other_name
+            if os.path.exists(existing) and (not job.overwrite or (
+                    job.coordinator and os.path.getmtime(existing) >= job.created_at)):
+                if job.placement:
+                    job.placement.link(existing_name)  # 上次下载完成后未来得及创建链接
+                with job.cond:
+                    job.stats['skipped'] += 1
+                # 压缩保存的文件大小不是内容大小，按已知大小计入进度
+                job.progress.file_finished(relative_path, None if existing_name != relative_path else os.path.getsize(existing))
+                job.emit('task_skipped', slot=slot, path=relative_path)
+                return True
+            
+            # 下载前按目录中的大小和ETag查找其它版本中内容相同的已有文件，找到时直接链接，不发出下载请求；
+            # 目录中没有ETag时，只在索引里有同样大小的文件时才用HEAD获取
+            if self.dedupe and not compress:
+                size = job.progress.sizes.get(relative_path)
+                etag = job.etags.get(relative_path)
+                if not etag and size and self.dedupe.has_size(size):
+                    metadata = fetch_file_metadata(session, url)
+                    if metadata and metadata['size_bytes'] == size:
+                        etag = metadata['etag']
+                source = self.dedupe.find_by_etag(size, etag, exclude=file_path) if etag else None
+                if source and self.reuse_existing(job, slot, relative_path, file_path, source, etag):
+                    remove_quietly(download_path)
+                    return True
+            
+            # 重试机制（每次重试优先换用其它镜像）
+            last_error = None
+            failed_mirrors = []
+            wait = self.retry_delay
+            for retry in range(self.max_retries):
+                mirror = None
+                try:
+                    handle.check()
+                    
+                    if retry > 0:
+                        job.emit('task_retry', slot=slot, path=relative_path, attempt=retry,
+                                 max_attempts=self.max_retries - 1, wait=round(wait, 1))
+                        handle.sleep(wait)
+                        wait = self.retry_delay
+                    
+                    mirror = self.mirror_pool.choose(exclude=failed_mirrors)
+                    if mirror.base_url != self.mirror_pool.primary:
+                        job.emit('log', message=f"[任务{slot+1}] 使用镜像: {mirror.base_url}")
+                    
+                    # 已有部分数据（暂停、停止或上次中断）时请求剩余部分
+                    offset = os.path.getsize(download_path) if os.path.exists(download_path) else 0
+                    if offset and compress:
+                        # 压缩流中断后无法接着压缩，从头下载
+                        remove_quietly(download_path)
+                        offset = 0
+                    headers = {'Range': f'bytes={offset}-'} if offset else {}
+                    # 文本类型请求压缩传输；续传和其它类型按原样传输，Range和Content-Length都对应文件本身的字节
+                    negotiate = self.compress_transfer and not offset and relative_path.lower().endswith(COMPRESSIBLE_TYPES)
+                    headers['Accept-Encoding'] = 'gzip, deflate' if negotiate else 'identity'
+                    with session.get(self.mirror_pool.map_url(url, mirror), headers=headers, stream=True, timeout=self.timeout) as r:
+                        r.raise_for_status()
+                        if offset and r.status_code != 206:
+                            offset = 0  # 服务器不支持续传，从头下载
+                        content_length = int(r.headers.get('content-length', 0))
+                        encoded = r.headers.get('content-encoding', 'identity').lower() not in ('', 'identity')
+                        # 压缩传输时Content-Length是压缩后的长度，文件大小按目录中已知的大小计算
+                        if content_length and not encoded:
+                            total_size = offset + content_length
+                        else:
+                            total_size = job.progress.sizes.get(relative_path) or 0
+                        etag = r.headers.get('etag')
+                        # 下载前不知道大小或ETag时按响应头再查一次；去重索引记录的是磁盘上的文件大小，压缩保存的文件不按ETag复用
+                        source = self.dedupe.find_by_etag(total_size, etag, exclude=file_path) \
+                            if self.dedupe and not compress else None
+                        if source:
+                            # 其它版本中已下载过内容相同的文件：链接已有文件，不再下载
+                            r.close()
+                            if self.reuse_existing(job, slot, relative_path, file_path, source, etag):
+                                remove_quietly(download_path)
+                                return True
+                        on_bytes = self.make_progress_reporter(job, slot, relative_path, total_size, offset)
+                        if offset:
+                            job.emit('log', message=f"[任务{slot+1}] 从 {format_size(offset)} 处继续下载")
+                        
+                        if not offset and not encoded and not compress and self.should_download_segmented(total_size, r):
+                            # 大文件分段从多个镜像下载，各段的镜像故障由分段下载自行处理
+                            mirror = None
+                            r.close()
+                            handle.segmented = True
+                            job.emit('log', message=f"[任务{slot+1}] 大文件，从多个镜像分段下载")
+                            disk_wait = self.download_segments(job, handle, url, download_path, total_size, on_bytes)
+                            downloaded = total_size
+                            wire_bytes = total_size
+                            digest = None
+                        else:
+                            downloaded = offset
+                            position = offset  # 写入位置（压缩保存时为压缩后的字节数）
+                            start_time = time.time()
+                            # 去重时边下载边计算内容哈希（续传时下载完成后再读取文件计算）
+                            digest = hashlib.sha256() if self.dedupe and not offset else None
+                            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 31) if compress else None
+                            # 网络线程只负责接收，磁盘写入交给写入线程，慢速磁盘只会占用缓冲区
+                            with self.writer_pool.open(download_path, 'ab' if offset else 'wb') as stream:
+                                for chunk in r.iter_content(chunk_size=65536):
+                                    handle.check()
+                                    data = compressor.compress(chunk) if compressor else chunk
+                                    if data:
+                                        position += stream.write(position, data)
+                                    downloaded += len(chunk)
+                                    on_bytes(len(chunk))
+                                    if digest is not None:
+                                        digest.update(chunk)
+                                # 连接被提前关闭时响应体可能短于 Content-Length（压缩传输时按网络上收到的字节比较）
+                                wire_bytes = r.raw.tell() if encoded else downloaded - offset
+                                if content_length and wire_bytes < content_length:
+                                    raise IncompleteDownload(f"数据不完整: 收到 {wire_bytes} / {content_length} 字节")
+                                if compressor:
+                                    stream.write(position, compressor.flush())
+                                stream.close()
+                            disk_wait = stream.wait_seconds
+                            self.mirror_pool.report_success(mirror, wire_bytes, time.time() - start_time)
+                    
+                    # 下载成功：落盘（fsync）和改名由写入线程池批量完成，任务槽位随即释放
+                    def committed(error):
+                        try:
+                            if error is not None:
+                                raise error
+                            if job.placement:
+                                # 在下载目录中创建指向实际文件的符号链接，各卷上的文件组成一个统一的目录树
+                                job.placement.link(stored_name)
+                            if other_path and os.path.lexists(other_path):
+                                # 覆盖时删除另一种保存形式的旧文件
+                                if job.placement:
+                                    job.placement.remove(other_name)
+                                else:
+                                    os.remove(other_path)
+                            self.records.mark_downloaded(relative_path)
+                            with job.cond:
+                                job.stats['completed'] += 1
+                                job.stats['transfer_saved'] += downloaded - offset - wire_bytes
+                                if compress:
+                                    job.stats['storage_saved'] += downloaded - os.path.getsize(file_path)
+                            job.progress.file_finished(relative_path, downloaded)
+                            job.emit('task_done', slot=slot, path=relative_path, bytes=downloaded, wire_bytes=wire_bytes,
+                                     elapsed=round(time.time() - task_start, 3), disk_wait=round(disk_wait, 3))
+                            if self.dedupe:
+                                try:
+                                    self.deduplicate_downloaded(job, slot, relative_path, file_path, etag,
+                                                                digest.hexdigest() if digest is not None else None)
+                                except Exception as e:
+                                    job.emit('log', message=f"[任务{slot+1}] 记录去重信息失败: {e}")
+                            self.start_post_processing(job, relative_path, content_path)
+                        except Exception as e:
+                            self.records.mark_failed(relative_path)
+                            with job.cond:
+                                job.stats['failed'] += 1
+                            job.progress.file_finished(relative_path)
+                            job.emit('task_error', slot=slot, path=relative_path, error=str(e),
+                                     elapsed=round(time.time() - task_start, 3))
+                            remove_quietly(download_path)
+                        finally:
+                            self._commit_finished(job, relative_path, stored_name)
+                    
+                    handle.committing = True
+                    with self.cond:
+                        job.committing += 1
+                    self.writer_pool.commit(download_path, file_path, self.fsync_on_complete, committed)
+                    return True
+                        
+                except (DownloadCancelled, DownloadPaused):
+                    raise
+                except requests.HTTPError as e:
+                    last_error = e
+                    status = e.response.status_code
+                    if status in (429, 503):
+                        # 限流或暂时不可用：按服务器要求的时间等待，镜像本身没有故障
+                        retry_after = parse_retry_after(e.response.headers.get('retry-after'))
+                        if retry_after is not None:
+                            wait = max(self.retry_delay, min(retry_after, self.max_retry_after))
+                            continue
+                    elif status == 416:
+                        # 已下载的部分超出了远程文件（文件已变化），从头下载
+                        remove_quietly(download_path)
+                        continue
+                    if mirror is not None:
+                        self.mirror_pool.report_failure(mirror)
+                        failed_mirrors.append(mirror)
+                    if 400 <= status < 500 and status != 408 and len(failed_mirrors) >= len(self.mirror_pool.mirrors):
+                        break  # 文件不存在或无权访问，所有镜像都试过后不再重试
+                except (requests.RequestException, IncompleteDownload) as e:
+                    # 连接重置、读取超时或数据不完整：保留已收到的部分，下次从断点续传
+                    last_error = e
+                    if mirror is not None:
+                        self.mirror_pool.report_failure(mirror)
+                        failed_mirrors.append(mirror)
+                    if handle.segmented:
+                        # 分段下载的临时文件不是连续数据，不能续传
+                        handle.segmented = False
+                        remove_quietly(download_path)
+                    elif compress:
+                        remove_quietly(download_path)  # 压缩保存的临时文件不能续传
+            
+            # 所有重试都失败
+            error_msg = str(last_error) if last_error else "未知错误"
+            self.records.mark_failed(relative_path)
+            with job.cond:
+                job.stats['failed'] += 1
+            job.progress.file_finished(relative_path)
+            job.emit('task_failed', slot=slot, path=relative_path, error=error_msg, retries=self.max_retries,
+                     elapsed=round(time.time() - task_start, 3))
+            return False
+                    
+        except DownloadPaused:
+            # 保留 .part 文件，继续时从断点续传
+            with self.cond:
+                if handle.paused:
+                    job.paused_tasks[relative_path] = url
+                else:
+                    # 暂停后写完缓冲数据期间已被继续：排到队列最前重新开始（从 .part 续传）
+                    job.urgent.append((url, relative_path))
+                    self.cond.notify_all()
+                resumed = not handle.paused
+            job.emit('task_paused', slot=slot, path=relative_path)
+            if resumed:
+                job.emit('task_resumed', path=relative_path)  # 槽位已释放，文件回到队列
+            return False
+        except DownloadCancelled:
+            if handle.cancelled:
+                with job.cond:
+                    job.stats['cancelled'] += 1
+            job.progress.file_finished(relative_path)
+            job.emit('task_cancelled', slot=slot, path=relative_path, stopped=not handle.cancelled)
+            # 停止整个批次时保留已下载的部分供下次续传；单独取消的文件和分段下载（非连续数据）删除
+            if handle.cancelled or handle.segmented:
+                remove_quietly(download_path)
+            return False
+        except Exception as e:
+            self.records.mark_failed(relative_path)
+            with job.cond:
+                job.stats['failed'] += 1
+            job.progress.file_finished(relative_path)
+            job.emit('task_error', slot=slot, path=relative_path, error=str(e),
+                     elapsed=round(time.time() - task_start, 3))
+            remove_quietly(download_path)
+            return False
+
+class SyncRunner:
+    """同步模式 - 对比远程文件和本地清单，只下载新增或变化的文件，可选删除上游已移除的文件"""
+    manifest_name = "gcb_manifest.json"  # 本地清单，保存在下载目录中
+    prune_limit = 0.5  # 待删除文件超过清单的该比例时拒绝删除（防止扫描不完整误删）
+    
+    def __init__(self, engine, catalog, save_dir, prune=False, probe_workers=32, log=print, placement=None):
+        self.engine = engine
+        self.catalog = dict(catalog)  # {url: info}
+        self.save_dir = save_dir
+        self.placement = placement  # 多卷存放时的VolumePlacement
+        self.prune = prune
+        self.probe_workers = probe_workers  # 对比时并发获取远程元数据的线程数
+        self.log = log
+        self.manifest_file = os.path.join(save_dir, self.manifest_name)
+        self.manifest = {}  # {relative_path: {url, size_bytes, etag, last_modified, synced_at}}
+        self.updates = {}  # 本次同步对清单的修改 {relative_path: entry，None表示删除}
+        self.remote = {}  # {relative_path: (url, metadata)}
+        self.changes = {'new': [], 'changed': [], 'missing': [], 'removed': [], 'unreachable': [], 'adopted': []}
+        self.unchanged = 0
+        self.synced = []  # 本次下载成功的文件
+        self.skipped = []  # 已由其它节点更新的文件（多机协作）
+        self.assigned = set()  # 分配给本节点下载的文件
+        self.pruned = []
+        self.started_at = time.time()
+        self.job = None
+        self.report_file = None
+    
+    def load_manifest(self):
+        """加载本地清单"""
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f).get('files', {})
+    
+    def set_entry(self, path, entry):
+        """修改清单条目（entry为None表示删除）"""
+        if entry is None:
+            self.manifest.pop(path, None)
+        else:
+            self.manifest[path] = entry
+        self.updates[path] = entry
+    
+    def save_manifest(self):
+        """保存本地清单：在文件锁内合并磁盘上的清单（可能含其它节点的更新），写入临时文件后替换"""
+        with file_lock(self.manifest_file):
+            files = {}
+            if os.path.exists(self.manifest_file):
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    files = json.load(f).get('files', {})
+            for path, entry in self.updates.items():
+                if entry is None:
+                    files.pop(path, None)
+                else:
+                    files[path] = entry
+            data = {
+                'files': files,
+                'last_sync': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            tmp_path = f"{self.manifest_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_file)
+        self.manifest = files
+        self.updates = {}
+    
+    def fetch_remote(self):
+        """并发获取所有远程文件的大小、ETag和修改时间"""
+        session = create_http_session(self.probe_workers)
+        with ThreadPoolExecutor(max_workers=self.probe_workers) as executor:
+            futures = {executor.submit(fetch_file_metadata, session, url): (url, info['path'])
+                       for url, info in self.catalog.items()}
+            for future in as_completed(futures):
+                url, path = futures[future]
+                self.remote[path] = (url, future.result())
+    
+    @staticmethod
+    def is_changed(entry, metadata):
+        """远程文件相对于清单记录是否有变化（优先比较ETag，其次修改时间，最后比较大小）"""
+        if entry.get('etag') and metadata.get('etag'):
+            return entry['etag'] != metadata['etag']
+        if entry.get('last_modified') and metadata.get('last_modified'):
+            return entry['last_modified'] != metadata['last_modified']
+        return entry.get('size_bytes') != metadata['size_bytes']
+    
+    def plan(self):
+        """对比远程目录和本地清单，生成变更列表"""
+        self.load_manifest()
+        self.fetch_remote()
+        
+        for path, (url, metadata) in sorted(self.remote.items()):
+            if metadata is None:
+                self.changes['unreachable'].append(path)
+                continue
+            entry = self.manifest.get(path)
+            file_path = self.local_file(path)
+            if entry is None:
+                # 没有清单记录但本地已有大小一致的文件（如之前用普通下载获取的），直接纳入清单
+                if metadata['size_bytes'] and file_path and stored_size_matches(file_path, metadata['size_bytes']):
+                    self.set_entry(path, dict(metadata, url=url, synced_at=time.time()))
+                    self.changes['adopted'].append(path)
+                else:
+                    self.changes['new'].append(path)
+            elif file_path is None:
+                self.changes['missing'].append(path)
+            elif self.is_changed(entry, metadata):
+                self.changes['changed'].append(path)
+            else:
+                self.unchanged += 1
+        
+        self.changes['removed'] = sorted(path for path in self.manifest if path not in self.remote)
+        return self.changes
+    
+    def stored_names(self, path):
+        """文件在磁盘上可能的相对路径：原样保存和压缩保存（.gz）"""
+        return [name for name in (path, gzip_store_name(path)) if name]
+    
+    def local_file(self, path):
+        """本地文件的实际路径（多卷存放且无法创建符号链接时按路径映射查找，也查找压缩保存的文件），不存在时返回None"""
+        for name in self.stored_names(path):
+            file_path = self.placement.resolve(name) if self.placement else os.path.join(self.save_dir, name)
+            if os.path.isfile(file_path):
+                return file_path
+        return None
+    
+    def download_items(self):
+        """需要下载的文件 [(url, relative_path), ...]"""
+        paths = self.changes['new'] + self.changes['changed'] + self.changes['missing']
+        return [(self.remote[path][0], path) for path in paths]
+    
+    def preflight(self):
+        """检查各卷剩余空间是否足够下载本次变更（变化的文件下载完成前新旧文件同时存在），返回空间不足的卷"""
+        sizes = {path: self.remote[path][1]['size_bytes'] for _, path in self.download_items()}
+        return preflight_space(self.save_dir, sizes, self.placement)
+    
+    def prune_removed(self):
+        """删除上游已移除的本地文件"""
+        removed = self.changes['removed']
+        if not removed:
+            return
+        if len(removed) > len(self.manifest) * self.prune_limit:
+            self.log(f"上游移除的文件过多 ({len(removed)}/{len(self.manifest)})，可能是扫描不完整，已跳过删除")
+            return
+        for path in removed:
+            file_path = os.path.join(self.save_dir, path)
+            try:
+                for name in self.stored_names(path):
+                    if self.placement:
+                        self.placement.remove(name)
+                    elif os.path.isfile(os.path.join(self.save_dir, name)):
+                        os.remove(os.path.join(self.save_dir, name))
+                # 清理删除后留下的空目录
+                folder = os.path.dirname(file_path)
+                while folder and os.path.abspath(folder) != os.path.abspath(self.save_dir) and not os.listdir(folder):
+                    os.rmdir(folder)
+                    folder = os.path.dirname(folder)
+            except OSError as e:
+                self.log(f"删除文件失败: {path} ({e})")
+                continue
+            self.set_entry(path, None)
+            self.pruned.append(path)
+        self.engine.records.discard_downloaded(self.pruned)
+        self.engine.records.save_downloaded()
+        if self.placement:
+            self.placement.save()
+    
+    def on_event(self, event):
+        """记录下载成功（或复用已有文件）的文件（工作线程调用）"""
+        if event['type'] in ('task_done', 'task_linked'):
+            self.synced.append(event['path'])
+        elif event['type'] == 'task_skipped':
+            self.skipped.append(event['path'])
+    
+    def start(self, parallelism, listener=None):
+        """执行删除并提交下载批次；没有需要下载的文件时返回None"""
+        os.makedirs(self.save_dir, exist_ok=True)
+        if self.prune:
+            self.prune_removed()
+        items = self.download_items()
+        if not items:
+            return None
+        sizes = {path: self.remote[path][1]['size_bytes'] for _, path in items}
+        etags = {path: self.remote[path][1].get('etag') for _, path in items}
+        self.job = self.engine.submit(items, self.save_dir, parallelism, description="同步", overwrite=True, sizes=sizes,
+                                      placement=self.placement, etags=etags)
+        self.assigned = {path for _, path in self.job.items}
+        self.job.listeners.append(self.on_event)
+        if listener:
+            self.job.listeners.append(listener)
+        return self.job
+    
+    def finish(self):
+        """下载批次结束后更新清单并写入变更报告，返回报告内容"""
+        for path in self.synced:
+            url, metadata = self.remote[path]
+            self.set_entry(path, dict(metadata, url=url, synced_at=time.time()))
+        self.save_manifest()
+        if self.placement:
+            self.placement.save()  # 批次结束时工作线程也会保存，无界面同步可能在此之前退出
+        
+        synced = set(self.synced)
+        failed = sorted(self.assigned - synced - set(self.skipped))
+        report = {
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'elapsed': round(time.time() - self.started_at, 2),
+            'save_dir': self.save_dir,
+            'summary': {
+                'remote': len(self.remote),
+                'unchanged': self.unchanged,
+                'new': len(self.changes['new']),
+                'changed': len(self.changes['changed']),
+                'missing': len(self.changes['missing']),
+                'adopted': len(self.changes['adopted']),
+                'removed': len(self.changes['removed']),
+                'pruned': len(self.pruned),
+                'downloaded': len(synced),
+                'other_nodes': len(self.skipped),
+                'failed': len(failed),
+                'unreachable': len(self.changes['unreachable']),
+                'bytes': sum(self.remote[path][1]['size_bytes'] for path in synced),
+                'linked': self.job.stats['linked'] if self.job else 0,
+                'saved_bytes': self.job.stats['saved_bytes'] if self.job else 0,
+                'transfer_saved': self.job.stats['transfer_saved'] if self.job else 0,
+                'storage_saved': self.job.stats['storage_saved'] if self.job else 0
+            },
+            'new': self.changes['new'],
+            'changed': self.changes['changed'],
+            'missing': self.changes['missing'],
+            'removed': self.changes['removed'],
+            'pruned': self.pruned,
+            'failed': failed,
+            'unreachable': self.changes['unreachable']
+        }
+        self.report_file = os.path.join(self.save_dir, f"gcb_sync_report_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(self.report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+    
+    def describe(self):
+        """变更摘要（用于日志）"""
+        return (f"新增 {len(self.changes['new'])}，变化 {len(self.changes['changed'])}，"
+                f"本地缺失 {len(self.changes['missing'])}，未变化 {self.unchanged + len(self.changes['adopted'])}，"
+                f"上游已移除 {len(self.changes['removed'])}，无法访问 {len(self.changes['unreachable'])}")
+
+# NetCDF 经典格式（CDF-1/2/5）的数据类型：编号 -> (名称, struct格式)
+NC_TYPES = {1: ('byte', 'b'), 2: ('char', 'c'), 3: ('short', 'h'), 4: ('int', 'i'), 5: ('float', 'f'),
+            6: ('double', 'd'), 7: ('ubyte', 'B'), 8: ('ushort', 'H'), 9: ('uint', 'I'), 10: ('int64', 'q'),
+            11: ('uint64', 'Q')}
+NC_DIMENSION, NC_VARIABLE, NC_ATTRIBUTE = 0x0A, 0x0B, 0x0C
+NC_STREAMING = 0xFFFFFFFF  # 记录数未知（流式写入的文件）
+NC_ATTR_VALUES_LIMIT = 16  # 数值属性最多保存的元素个数
+
+def _json_value(value):
+    """属性值转换为可写入JSON的值（NaN/Inf转为字符串）"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+class CDFHeaderReader:
+    """按顺序解析NetCDF经典格式的文件头（buf可为mmap，只访问文件头和时间坐标的首尾值）"""
+    
+    def __init__(self, buf):
+        if len(buf) < 8 or bytes(buf[:3]) != b'CDF' or buf[3] not in (1, 2, 5):
+            raise ValueError("不是NetCDF经典格式文件")
+        self.buf = buf
+        self.version = buf[3]
+        self.pos = 4
+        self.layout = {}  # {变量名: (类型编号, 数据起始位置, 是否记录变量)}
+        self.numrecs = 0
+        self.recsize = 0  # 每条记录的字节数
+    
+    def unpack(self, fmt, count=1):
+        fmt = f'>{count}{fmt}'
+        values = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+    
+    def count(self):
+        """非负整数（CDF-5为8字节）"""
+        return self.unpack('Q' if self.version == 5 else 'I')[0]
+    
+    def padded(self, size):
+        """读取size字节，按4字节对齐跳过填充"""
+        data = bytes(self.buf[self.pos:self.pos + size])
+        if len(data) < size:
+            raise ValueError("文件头不完整")
+        self.pos += (size + 3) // 4 * 4
+        return data
+    
+    def name(self):
+        return self.padded(self.count()).decode('utf-8', 'replace')
+    
+    def list_length(self, tag):
+        """列表头：标记和元素个数，ABSENT（全零）表示空列表"""
+        found = self.unpack('I')[0]
+        length = self.count()
+        if found not in (0, tag):
+            raise ValueError("文件头格式错误")
+        return length if found else 0
+    
+    def attributes(self):
+        attrs = {}
+        for _ in range(self.list_length(NC_ATTRIBUTE)):
+            name = self.name()
+            nc_type = self.unpack('i')[0]
+            length = self.count()
+            if nc_type not in NC_TYPES:
+                raise ValueError(f"未知的数据类型: {nc_type}")
+            fmt = NC_TYPES[nc_type][1]
+            data = self.padded(length * struct.calcsize(fmt))
+            if nc_type == 2:
+                attrs[name] = data.decode('utf-8', 'replace').rstrip('\x00')
+                continue
+            shown = min(length, NC_ATTR_VALUES_LIMIT)
+            values = [_json_value(v) for v in struct.unpack_from(f'>{shown}{fmt}', data)]
+            attrs[name] = values[0] if length == 1 else values
+        return attrs
+    
+    def read(self):
+        """解析文件头，返回维度、变量和全局属性"""
+        self.numrecs = self.count()
+        dimensions = []
+        for _ in range(self.list_length(NC_DIMENSION)):
+            dimensions.append((self.name(), self.count()))
+        unlimited = [name for name, length in dimensions if length == 0]
+        numrecs = self.numrecs if self.numrecs != NC_STREAMING else None
+        global_attrs = self.attributes()
+        
+        variables = {}
+        record_sizes = []
+        for _ in range(self.list_length(NC_VARIABLE)):
+            name = self.name()
+            dimids = self.unpack('Q' if self.version == 5 else 'I', self.count())
+            attrs = self.attributes()
+            nc_type = self.unpack('i')[0]
+            vsize = self.count()
+            begin = self.unpack('I' if self.version == 1 else 'Q')[0]
+            dims = [dimensions[i][0] for i in dimids]
+            is_record = bool(dims) and dims[0] in unlimited
+            shape = [numrecs if dimensions[i][1] == 0 else dimensions[i][1] for i in dimids]
+            if is_record:
+                record_bytes = struct.calcsize(NC_TYPES[nc_type][1])
+                for length in shape[1:]:
+                    record_bytes *= length
+                record_sizes.append((vsize, record_bytes))
+            self.layout[name] = (nc_type, begin, is_record)
+            variables[name] = {'type': NC_TYPES.get(nc_type, ('unknown',))[0], 'dimensions': dims,
+                               'shape': shape, 'attributes': attrs}
+        # 只有一个记录变量时记录之间没有填充
+        if len(record_sizes) == 1:
+            self.recsize = record_sizes[0][1]
+        else:
+            self.recsize = sum(vsize for vsize, _ in record_sizes)
+        
+        return {
+            'format': f"NetCDF classic (CDF-{self.version})",
+            'dimensions': {name: (numrecs if length == 0 else length) for name, length in dimensions},
+            'unlimited': unlimited,
+            'attributes': global_attrs,
+            'variables': variables
+        }
+    
+    def value_location(self, name, index):
+        """一维变量第index个值在文件中的位置和struct格式（记录变量按记录偏移定位）"""
+        nc_type, begin, is_record = self.layout[name]
+        fmt = '>' + NC_TYPES[nc_type][1]
+        return begin + index * (self.recsize if is_record else struct.calcsize(fmt)), fmt
+    
+    def read_value(self, name, index):
+        """读取一维变量的第index个值"""
+        offset, fmt = self.value_location(name, index)
+        return struct.unpack_from(fmt, self.buf, offset)[0]
+
+def find_time_variable(variables):
+    """找出一维的时间坐标变量"""
+    for name, info in variables.items():
+        attrs = info['attributes']
+        if len(info['dimensions']) != 1 or not info['shape'][0]:
+            continue
+        if (name.lower() == 'time' or attrs.get('standard_name') == 'time' or attrs.get('axis') == 'T'
+                or ' since ' in str(attrs.get('units', ''))):
+            return name
+    return None
+
+def describe_time_range(first, last, units):
+    """把时间坐标的首尾值按units（如 "days since 1850-01-01"）换算为日期，无法换算时保留原值"""
+    result = {'first': _json_value(first), 'last': _json_value(last), 'units': units}
+    match = re.match(r'\s*(\w+?)s?\s+since\s+(\d{1,4})-(\d{1,2})-(\d{1,2})', units or '')
+    try:
+        if match:
+            unit = match.group(1).lower()
+            base = datetime.datetime(int(match.group(2)), int(match.group(3)), int(match.group(4)))
+            seconds = {'second': 1, 'sec': 1, 'minute': 60, 'min': 60, 'hour': 3600, 'hr': 3600, 'day': 86400}
+            
+            def convert(value):
+                if unit in seconds:
+                    return (base + datetime.timedelta(seconds=value * seconds[unit])).strftime('%Y-%m-%d')
+                if unit == 'month':
+                    months = base.month - 1 + int(value)
+                    return f"{base.year + months // 12:04d}-{months % 12 + 1:02d}"
+                if unit in ('year', 'yr'):
+                    return f"{base.year + int(value):04d}"
+                raise ValueError(unit)
+            
+            result['start'], result['end'] = convert(first), convert(last)
+        elif str(units).lower().rstrip('s') in ('year', 'yr', 'year a.d.'):
+            result['start'], result['end'] = f"{first:g}", f"{last:g}"
+    except (ValueError, OverflowError):
+        pass
+    return result
+
+def read_cdf_header(buf, read_value=None):
+    """解析NetCDF经典格式文件头，并读取时间坐标的首尾值
+    
+    buf只需包含完整的文件头；时间值不在buf中时传入 read_value(offset, fmt) 按位置读取
+    """
+    reader = CDFHeaderReader(buf)
+    header = reader.read()
+    name = find_time_variable(header['variables'])
+    if name and reader.layout[name][0] != 2:
+        length = header['variables'][name]['shape'][0]
+        if read_value is None:
+            first, last = reader.read_value(name, 0), reader.read_value(name, length - 1)
+        else:
+            first, last = (read_value(*reader.value_location(name, index)) for index in (0, length - 1))
+        header['time_range'] = describe_time_range(first, last, header['variables'][name]['attributes'].get('units'))
+    return header
+
+def read_hdf5_header(source):
+    """读取NetCDF-4（HDF5）文件（路径或可随机读取的文件对象）的结构和属性，需要安装h5py（只读取元数据和时间坐标的首尾值）"""
+    try:
+        import h5py
+    except ImportError:
+        raise ValueError("读取NetCDF-4文件需要安装 h5py")
+    
+    # netCDF库内部使用的属性
+    internal = {'CLASS', 'NAME', 'REFERENCE_LIST', 'DIMENSION_LIST', '_Netcdf4Dimid', '_Netcdf4Coordinates',
+                '_NCProperties', '_nc3_strict'}
+    
+    def convert(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8', 'replace')
+        if hasattr(value, 'tolist'):
+            value = value.tolist()
+        if isinstance(value, list):
+            value = [convert(v) for v in value[:NC_ATTR_VALUES_LIMIT]]
+            return value[0] if len(value) == 1 else value
+        return _json_value(value)
+    
+    def attributes(obj):
+        return {key: convert(value) for key, value in obj.attrs.items() if key not in internal}
+    
+    dimensions = {}
+    variables = {}
+    datasets = {}
+    
+    def visit(name, obj):
+        if not isinstance(obj, h5py.Dataset):
+            return
+        if obj.attrs.get('CLASS') == b'DIMENSION_SCALE':
+            dimensions[name] = obj.shape[0] if obj.shape else 0
+            # 只是维度、没有对应坐标变量的数据集
+            if str(convert(obj.attrs.get('NAME', b''))).startswith('This is a netCDF dimension but not a netCDF variable'):
+                return
+        dims = [dim[0].name.lstrip('/') if len(dim) else '' for dim in obj.dims]
+        variables[name] = {'type': str(obj.dtype), 'dimensions': dims, 'shape': list(obj.shape),
+                           'attributes': attributes(obj)}
+        datasets[name] = obj
+    
+    with h5py.File(source, 'r') as f:
+        f.visititems(visit)
+        header = {
+            'format': "NetCDF-4 (HDF5)",
+            'dimensions': dimensions,
+            'unlimited': [],
+            'attributes': attributes(f),
+            'variables': variables
+        }
+        name = find_time_variable(variables)
+        if name and datasets[name].dtype.kind in 'iuf':
+            dataset = datasets[name]
+            header['time_range'] = describe_time_range(dataset[0].item(), dataset[-1].item(),
+                                                       variables[name]['attributes'].get('units'))
+    return header
+
+def index_netcdf_file(file_path):
+    """读取一个NetCDF文件的文件头（在子进程中运行），出错时返回 {'error': 原因}"""
+    try:
+        with open(file_path, 'rb') as f:
+            magic = f.read(8)
+            if magic[:3] == b'CDF':
+                # 内存映射：只有实际访问的文件头页面会被读入
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    return read_cdf_header(buf)
+        if magic == b'\x89HDF\r\n\x1a\n':
+            return read_hdf5_header(file_path)
+        return {'error': "无法识别的文件格式"}
+    except Exception as e:
+        return {'error': str(e)}
+
+class NetCDFIndex:
+    """已下载NetCDF文件的变量/维度/属性索引 - 只读取文件头，按修改时间和大小增量更新，保存在本地JSON文件中"""
+    extensions = ('.nc', '.nc4', '.cdf')
+    
+    def __init__(self, index_file="gcb_nc_index.json"):
+        self.index_file = index_file
+        self.entries = {}  # {relative_path: {'mtime', 'size', 'format', 'dimensions', 'variables', 'attributes', ...}}
+        self.search_texts = {}  # 搜索用文本缓存 {(path, mode): 小写文本}
+        self.lock = threading.Lock()
+    
+    def load(self):
+        """加载索引文件，返回是否存在"""
+        if not os.path.exists(self.index_file):
+            return False
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f).get('files', {})
+        with self.lock:
+            self.entries = entries
+            self.search_texts.clear()
+        return True
+    
+    def save(self):
+        with self.lock:
+            data = {'files': self.entries, 'last_update': time.strftime('%Y-%m-%d %H:%M:%S')}
+            tmp_path = f"{self.index_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+    
+    def update(self, save_dir, paths, workers=None):
+        """增量更新：只重新读取新增或修改时间/大小变化的文件，删除已不存在的文件，返回统计"""
+        stats = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        stale = []
+        for path in paths:
+            if not path.lower().endswith(self.extensions):
+                continue
+            try:
+                st = os.stat(os.path.join(save_dir, path))
+            except OSError:
+                with self.lock:
+                    if self.entries.pop(path, None) is not None:
+                        stats['removed'] += 1
+                continue
+            entry = self.entries.get(path)
+            if entry and entry.get('mtime') == st.st_mtime and entry.get('size') == st.st_size:
+                stats['unchanged'] += 1
+            else:
+                stale.append((path, st))
+        
+        if stale:
+            workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                file_paths = [os.path.join(save_dir, path) for path, _ in stale]
+                for (path, st), header in zip(stale, executor.map(index_netcdf_file, file_paths, chunksize=4)):
+                    header.update(mtime=st.st_mtime, size=st.st_size)
+                    stats['failed' if 'error' in header else 'indexed'] += 1
+                    with self.lock:
+                        self.entries[path] = header
+        if stale or stats['removed']:
+            with self.lock:
+                self.search_texts.clear()
+            self.save()
+        return stats
+    
+    def search_text(self, path, mode):
+        """文件在某种搜索方式下的小写文本：variable为变量名、long_name、standard_name和单位，attribute为全局属性和维度"""
+        text = self.search_texts.get((path, mode))
+        if text is None:
+            entry = self.entries.get(path) or {}
+            parts = []
+            if mode == 'variable':
+                parts.extend(self.variable_text(name, info) for name, info in entry.get('variables', {}).items())
+            else:
+                parts.extend(f"{attr}={value}" for attr, value in entry.get('attributes', {}).items())
+                parts.extend(entry.get('dimensions', {}))
+                time_range = entry.get('time_range', {})
+                if 'start' in time_range:
+                    parts.append(f"time={time_range['start']}~{time_range['end']}")
+            text = self.search_texts[(path, mode)] = '\n'.join(parts).lower()
+        return text
+    
+    @staticmethod
+    def variable_text(name, info):
+        """变量的搜索文本：名称、long_name、standard_name和单位"""
+        attrs = info.get('attributes', {})
+        parts = [name] + [str(attrs[attr]) for attr in ('long_name', 'standard_name', 'units') if attr in attrs]
+        return '\n'.join(parts).lower()
+    
+    def matches(self, path, text, mode):
+        """文件的索引信息是否包含text（未索引的文件不匹配）"""
+        return path in self.entries and text in self.search_text(path, mode)
+
+class RangeFile(io.RawIOBase):
+    """通过HTTP Range请求按需读取远程文件的只读文件对象（按块缓存），用于预览文件而不下载整个文件"""
+    block_size = 64 * 1024  # 每次请求的字节数
+    max_blocks = 256  # 缓存的最大块数
+    
+    def __init__(self, session, url, timeout=30):
+        self.session = session
+        self.url = url
+        self.timeout = timeout
+        self.blocks = collections.OrderedDict()  # {块序号: 数据}
+        self.position = 0
+        self.size = None
+        self.etag = None  # ETag，没有时为Last-Modified
+        self.ranged = True  # 服务器是否支持Range请求
+        self.fetched = 0  # 实际下载的字节数
+        self.requests = 0
+        self._block(0)  # 第一次请求同时获取文件大小和ETag
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("无效的读取位置")
+        self.position = offset
+        return offset
+    
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index, start = divmod(self.position, self.block_size)
+        block = self._block(index)
+        count = min(len(buffer), len(block) - start)
+        buffer[:count] = block[start:start + count]
+        self.position += count
+        return count
+    
+    def _block(self, index):
+        """获取一块数据（优先使用缓存）"""
+        block = self.blocks.get(index)
+        if block is not None:
+            self.blocks.move_to_end(index)
+            return block
+        if not self.ranged:
+            raise IOError("服务器不支持Range请求，只能预览文件开头")
+        start = index * self.block_size
+        # 不接受压缩传输：压缩后的响应解码出的数据与请求的字节范围对不上
+        headers = {'Range': f'bytes={start}-{start + self.block_size - 1}', 'Accept-Encoding': 'identity'}
+        with self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            self.requests += 1
+            encoded = r.headers.get('content-encoding', 'identity').lower() not in ('', 'identity')
+            if r.status_code == 206:
+                if encoded:
+                    raise IOError("服务器返回了压缩的分段数据，无法按位置读取")
+                total = r.headers.get('content-range', '').rpartition('/')[2]
+                if total.isdigit():
+                    self.size = int(total)
+            else:
+                # 不支持Range时只读取开头一块后断开连接（压缩传输时Content-Length不是文件大小）
+                self.ranged = False
+                if r.headers.get('content-length') and not encoded:
+                    self.size = int(r.headers['content-length'])
+            self.etag = self.etag or r.headers.get('etag') or r.headers.get('last-modified')
+            data = bytearray()
+            for chunk in r.iter_content(chunk_size=16384):
+                data += chunk
+                if len(data) >= self.block_size:
+                    break
+        block = bytes(data[:self.block_size])
+        self.fetched += len(block)
+        if self.size is None:
+            if len(block) == self.block_size:
+                raise IOError("无法获取文件大小")
+            self.size = start + len(block)
+        self.blocks[index] = block
+        if len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        return block
+
+def _decode_text(data):
+    """按 UTF-8 / GBK / Latin-1 依次尝试解码"""
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode('latin-1')
+
+def preview_text(f, max_lines=30, max_bytes=1024 * 1024):
+    """读取文本/CSV文件的前max_lines行（最多读取max_bytes字节）"""
+    data = b''
+    complete = False
+    while data.count(b'\n') < max_lines and len(data) < max_bytes:
+        chunk = f.read(64 * 1024)
+        if not chunk:
+            complete = True
+            break
+        data += chunk
+    lines = data.split(b'\n')
+    if not complete and len(lines) <= max_lines:
+        lines = lines[:-1]  # 去掉被截断的最后一行
+    text = _decode_text(b'\n'.join(lines[:max_lines]))
+    return {'kind': 'text', 'lines': [line.rstrip('\r') for line in text.split('\n')]}
+
+def preview_zip(f, max_members=200):
+    """读取ZIP的中央目录，列出成员（只请求文件末尾的目录部分）"""
+    with zipfile.ZipFile(f) as archive:
+        members = archive.infolist()
+    return {
+        'kind': 'zip',
+        'count': len(members),
+        'total_size': sum(member.file_size for member in members),
+        'members': [{'name': member.filename, 'size': member.file_size, 'compressed': member.compress_size,
+                     'modified': '%04d-%02d-%02d %02d:%02d' % member.date_time[:5]}
+                    for member in members[:max_members]]
+    }
+
+def _xlsx_column(ref):
+    """单元格引用（如 "C5"）的列序号，从0开始"""
+    column = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        column = column * 26 + ord(char.upper()) - ord('A') + 1
+    return column - 1
+
+def preview_xlsx(f, max_rows=30, max_bytes=4 * 1024 * 1024):
+    """读取XLSX的工作表名称和第一个工作表的前max_rows行（只解压所需的部分）"""
+    with zipfile.ZipFile(f) as archive:
+        names = set(archive.namelist())
+        workbook = archive.read('xl/workbook.xml').decode('utf-8', 'replace')
+        sheets = re.findall(r'<sheet\b[^>]*?\bname="([^"]*)"[^>]*?\br:id="([^"]*)"', workbook)
+        # 通过关系文件找到第一个工作表对应的XML
+        sheet_path = 'xl/worksheets/sheet1.xml'
+        if sheets and 'xl/_rels/workbook.xml.rels' in names:
+            rels = archive.read('xl/_rels/workbook.xml.rels').decode('utf-8', 'replace')
+            for rel_id, target in re.findall(r'<Relationship\b[^>]*?\bId="([^"]*)"[^>]*?\bTarget="([^"]*)"', rels):
+                if rel_id == sheets[0][1]:
+                    sheet_path = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+        
+        shared = []
+        if 'xl/sharedStrings.xml' in names:
+            with archive.open('xl/sharedStrings.xml') as member:
+                data = member.read(max_bytes).decode('utf-8', 'replace')
+            for item in re.findall(r'<si>(.*?)</si>', data, re.S):
+                shared.append(html.unescape(''.join(re.findall(r'<t\b[^>]*>(.*?)</t>', item, re.S))))
+        
+        # 工作表可能很大，边解压边读取，读够max_rows行即停止
+        data = b''
+        with archive.open(sheet_path) as member:
+            while data.count(b'</row>') < max_rows and len(data) < max_bytes:
+                chunk = member.read(64 * 1024)
+                if not chunk:
+                    break
+                data += chunk
+    
+    rows = []
+    for row in re.findall(r'<row\b[^>]*>(.*?)</row>', data.decode('utf-8', 'replace'), re.S)[:max_rows]:
+        values = []
+        for attrs, inner in re.findall(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', row, re.S):
+            ref = re.search(r'\br="([A-Z]+)', attrs)
+            if ref:
+                values.extend([''] * (_xlsx_column(ref.group(1)) - len(values)))
+            cell_type = re.search(r'\bt="(\w+)"', attrs)
+            value = re.search(r'<v>(.*?)</v>', inner or '', re.S)
+            value = html.unescape(value.group(1)) if value else ''
+            if cell_type and cell_type.group(1) == 's' and value.isdigit():
+                index = int(value)
+                value = shared[index] if index < len(shared) else f"#{index}"
+            elif cell_type and cell_type.group(1) == 'inlineStr':
+                value = html.unescape(''.join(re.findall(r'<t\b[^>]*>(.*?)</t>', inner or '', re.S)))
+            values.append(value)
+        rows.append(values)
+    return {'kind': 'xlsx', 'sheets': [name for name, _ in sheets], 'sheet': sheets[0][0] if sheets else '', 'rows': rows}
+
+def preview_netcdf(f, max_header=16 * 1024 * 1024):
+    """读取NetCDF文件头（经典格式按需扩大读取范围，时间坐标只读取首尾两个值；NetCDF-4需要h5py）"""
+    def read_value(offset, fmt):
+        f.seek(offset)
+        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+    
+    magic = f.read(8)
+    if magic[:3] == b'CDF':
+        size = 64 * 1024
+        while True:
+            f.seek(0)
+            data = f.read(size)
+            try:
+                header = read_cdf_header(data, read_value)
+                break
+            except (struct.error, ValueError):
+                # 文件头比已读取的部分长
+                if len(data) < size or size >= max_header:
+                    raise
+                size *= 4
+    elif magic == b'\x89HDF\r\n\x1a\n':
+        f.seek(0)
+        header = read_hdf5_header(f)
+    else:
+        raise ValueError("无法识别的NetCDF文件格式")
+    return dict(header, kind='netcdf')
+
+# 支持远程预览的文件类型：扩展名 -> 预览函数
+PREVIEW_TYPES = {
+    ('.csv', '.txt', '.dat', '.md'): preview_text,
+    ('.nc', '.nc4', '.cdf'): preview_netcdf,
+    ('.zip',): preview_zip,
+    ('.xlsx',): preview_xlsx,
+}
+
+def can_preview(path):
+    return any(path.lower().endswith(extensions) for extensions in PREVIEW_TYPES)
+
+def preview_remote_file(session, url):
+    """按文件类型只读取预览所需的部分：文本/CSV的前几行、NetCDF文件头、ZIP/XLSX的中央目录"""
+    name = unquote(urlparse(url).path).lower()
+    for extensions, preview_func in PREVIEW_TYPES.items():
+        if name.endswith(extensions):
+            break
+    else:
+        raise ValueError("不支持预览该类型的文件")
+    start = time.time()
+    raw = RangeFile(session, url)
+    preview = preview_func(io.BufferedReader(raw, buffer_size=RangeFile.block_size))
+    preview.update(size=raw.size, etag=raw.etag, fetched=raw.fetched, requests=raw.requests,
+                   elapsed=round(time.time() - start, 3))
+    return preview
+
+def format_preview(preview):
+    """把预览结果整理为显示用的文本（NetCDF按 ncdump -h 的格式）"""
+    kind = preview['kind']
+    lines = []
+    if kind == 'text':
+        lines = preview['lines']
+    elif kind == 'xlsx':
+        lines.append(f"工作表: {', '.join(preview['sheets'])}")
+        lines.append(f"[{preview['sheet']}]")
+        lines.extend('\t'.join(row) for row in preview['rows'])
+    elif kind == 'zip':
+        lines.append(f"共 {preview['count']} 个文件，解压后 {format_size(preview['total_size'])}")
+        for member in preview['members']:
+            lines.append(f"{member['modified']}  {format_size(member['size']):>10}  {member['name']}")
+        if preview['count'] > len(preview['members']):
+            lines.append(f"... 还有 {preview['count'] - len(preview['members'])} 个文件")
+    elif kind == 'netcdf':
+        def value_text(value):
+            if isinstance(value, str):
+                return '"' + value.replace('\n', '\\n') + '"'
+            if isinstance(value, list):
+                return ', '.join(str(v) for v in value)
+            return str(value)
+        
+        lines.append(f"// {preview['format']}")
+        lines.append("dimensions:")
+        for name, length in preview['dimensions'].items():
+            unlimited = name in preview.get('unlimited', [])
+            lines.append(f"\t{name} = {'UNLIMITED ; // (' + str(length) + ' currently)' if unlimited else str(length) + ' ;'}")
+        lines.append("variables:")
+        for name, info in preview['variables'].items():
+            lines.append(f"\t{info['type']} {name}({', '.join(info['dimensions'])}) ;")
+            for key, value in info['attributes'].items():
+                lines.append(f"\t\t{name}:{key} = {value_text(value)} ;")
+        lines.append("")
+        lines.append("// global attributes:")
+        for key, value in preview['attributes'].items():
+            lines.append(f"\t\t:{key} = {value_text(value)} ;")
+        time_range = preview.get('time_range')
+        if time_range:
+            lines.append("")
+            lines.append(f"// 时间范围: {time_range.get('start', time_range['first'])} ~ "
+                         f"{time_range.get('end', time_range['last'])} ({time_range['units']})")
+    return '\n'.join(lines)
+
+class PreviewCache:
+    """远程预览结果缓存 - 按 URL + ETag 保存，文件未变化时重复预览不再请求网络"""
+    
+    def __init__(self, cache_file="gcb_preview_cache.json", max_entries=500):
+        self.cache_file = cache_file
+        self.max_entries = max_entries  # 超过后丢弃最早的结果
+        self.entries = collections.OrderedDict()  # {url: {'etag', 'preview', 'time'}}
+        self.loaded = False
+        self.lock = threading.Lock()
+    
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self.entries.update(json.load(f).get('previews', {}))
+    
+    def get(self, url, etag):
+        """ETag一致时返回缓存的预览"""
+        self.load()
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and etag and entry['etag'] == etag:
+                return entry['preview']
+        return None
+    
+    def put(self, url, etag, preview):
+        """保存预览结果（没有ETag/Last-Modified时无法判断文件是否变化，不缓存）"""
+        if not etag:
+            return
+        self.load()
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = {'etag': etag, 'preview': preview, 'time': time.time()}
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            data = {'previews': self.entries}
+            tmp_path = f"{self.cache_file}.{NODE_ID}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_file)
+
+def get_preview(session, cache, url, etag=None):
+    """获取远程文件预览：已知ETag（扫描或探测大小时获取）且已缓存时直接返回，返回 (预览, 是否来自缓存)"""
+    if not etag:
+        metadata = fetch_file_metadata(session, url)
+        if metadata:
+            etag = metadata.get('etag') or metadata.get('last_modified')
+    cached = cache.get(url, etag)
+    if cached is not None:
+        return cached, True
+    preview = preview_remote_file(session, url)
+    cache.put(url, etag or preview['etag'], preview)
+    return preview, False
 
 class GCBDownloader:
     def __init__(self, root):
@@ -41,26 +4066,68 @@ class GCBDownloader:
         self.root.title("GCB 数据下载器")
         self.root.geometry("1200x850")
         
-        self.driver = None
         self.all_files = {}  # {url: {'path': relative_path, 'size': size_str}}
-        self.downloaded_files = set()  # 已下载完成的文件路径
-        self.failed_files = set()  # 下载失败的文件路径
         self.download_queue = []
         self.is_scanning = False
         self.is_downloading = False
-        self.stop_download = False
-        self.cache_file = "gcb_file_cache.json"  # 缓存文件名
+        self.cache_file = "gcb_file_cache.bin"  # 缓存文件名（二进制格式）
+        self.legacy_cache_file = "gcb_file_cache.json"  # 旧版JSON缓存（用于迁移）
+        self.cache_load_batch = 500  # 加载缓存时每批插入树的条目数
+        self.cache_load_generation = 0  # 缓存加载批次号，用于丢弃过期的加载结果
+        self.is_loading_cache = False
+        self.cache_max_age = 24 * 3600  # 缓存超过该时长（秒）时，启动后自动后台刷新
+        self.catalog_diff = {'new': set(), 'changed': set(), 'removed': {}}  # 后台刷新发现的差异
         self.downloaded_record_file = "gcb_downloaded_record.json"  # 已下载记录文件
         self.failed_record_file = "gcb_failed_record.json"  # 下载失败记录文件
         self.show_all_files = True  # 显示全部/仅未下载
         self.max_retries = 3  # 最大重试次数
         self.retry_delay = 1  # 重试间隔（秒）
+        self.driver_cache_file = "gcb_driver_cache.json"  # ChromeDriver路径缓存文件
+        self.driver_check_interval = 24 * 3600  # ChromeDriver版本重新校验间隔（秒）
+        self.mirror_file = "gcb_mirrors.json"  # 镜像源配置文件
+        self.mirror_urls = []  # 备用镜像地址（目录结构与主网址相同）
+        self.mirror_pool = None
+        self.volume_file = "gcb_volumes.json"  # 多卷存放配置文件
+        self.volume_config = {'volumes': [], 'policy': 'free_space', 'pins': {}}  # 存储卷、存放策略和按文件夹固定的卷
+        self.size_probe_workers = 16  # 后台获取文件大小的线程数
+        self.size_prober = None
+        self.probe_results = []  # 待合并到界面的大小探测结果
+        self.probe_results_lock = threading.Lock()
+        self.probe_dirty = False  # 探测结果尚未写入缓存
+        # 下载记录和下载引擎与后台服务模式共用
+        self.records = DownloadRecords(self.downloaded_record_file, self.failed_record_file)
+        # 界面线程使用的记录副本：下载线程只修改self.records，界面通过root.after更新副本
+        self.downloaded_files = set()  # 已下载完成的文件路径
+        self.failed_files = set()  # 下载失败的文件路径
+        self.engine = DownloadEngine(self.records, max_workers=5, max_retries=self.max_retries,
+                                     retry_delay=self.retry_delay)
+        self.current_job = None  # 当前界面提交的下载批次
+        self.queue_state = PersistentQueue("gcb_queue_state.json")  # 界面下载批次的持久化队列，崩溃或关闭后可继续
+        self.nc_index = NetCDFIndex("gcb_nc_index.json")  # 已下载NetCDF文件的变量/属性索引
+        self.nc_indexing = False
+        self.dedupe_index = DedupeIndex("gcb_dedupe_index.json")  # 跨版本去重索引（勾选“去重”时使用）
+        self.preview_cache = PreviewCache("gcb_preview_cache.json")  # 远程预览结果缓存
+        self.log_file = "gcb_log.jsonl"  # 结构化日志文件（按大小轮转）
+        self.log_max_lines = 2000  # 日志窗口保留的最大行数
+        self.log_buffer = collections.deque(maxlen=self.log_max_lines)  # 日志环形缓冲 (时间, 级别, 内容)
+        self.log_pending = []  # 尚未显示到日志窗口的条目
+        self.log_flush_scheduled = False
+        self.logger = setup_structured_log(self.log_file)
         
         self.setup_ui()
+        self.load_mirror_config()
+        self.load_volume_config()
         # 先加载记录（不刷新UI），再加载缓存，最后统一刷新一次
         self.load_downloaded_record(refresh_ui=False)
         self.load_failed_record(refresh_ui=False)
         self.load_cache()  # load_cache会构建树，已包含状态信息
+        self.root.after_idle(self.report_startup_time)
+        self.root.after(500, self.offer_queue_resume)
+        
+    def report_startup_time(self):
+        """记录窗口就绪耗时"""
+        elapsed = time.perf_counter() - APP_START_TIME
+        self.log(f"窗口就绪耗时: {elapsed:.2f} 秒")
         
     def setup_ui(self):
         """设置界面"""
@@ -76,12 +4143,21 @@ class GCBDownloader:
         self.scan_btn = ttk.Button(top_frame, text="扫描文件", command=self.start_scan)
         self.scan_btn.pack(side=LEFT, padx=5)
         
+        self.refresh_btn = ttk.Button(top_frame, text="后台刷新", command=self.start_background_refresh)
+        self.refresh_btn.pack(side=LEFT, padx=2)
+        
         self.save_cache_btn = ttk.Button(top_frame, text="保存缓存", command=self.save_cache)
         self.save_cache_btn.pack(side=LEFT, padx=2)
         
         self.load_cache_btn = ttk.Button(top_frame, text="加载缓存", command=self.load_cache)
         self.load_cache_btn.pack(side=LEFT, padx=2)
         
+        self.export_json_btn = ttk.Button(top_frame, text="导出JSON", command=self.export_cache_json)
+        self.export_json_btn.pack(side=LEFT, padx=2)
+        
+        ttk.Button(top_frame, text="镜像源", command=self.open_mirror_dialog).pack(side=LEFT, padx=2)
+        ttk.Button(top_frame, text="存储卷", command=self.open_volume_dialog).pack(side=LEFT, padx=2)
+        
         ttk.Label(top_frame, text="保存目录:").pack(side=LEFT, padx=(20,0))
         self.save_dir_entry = ttk.Entry(top_frame, width=30)
         self.save_dir_entry.insert(0, "GCB_Data")
@@ -94,6 +4170,11 @@ class GCBDownloader:
         filter_frame.pack(fill=X)
         
         ttk.Label(filter_frame, text="筛选:").pack(side=LEFT)
+        self.search_mode_var = StringVar(value="文件名")
+        search_mode_combo = ttk.Combobox(filter_frame, textvariable=self.search_mode_var, width=6,
+                                         values=list(self.search_modes), state="readonly")
+        search_mode_combo.pack(side=LEFT, padx=(5, 0))
+        search_mode_combo.bind('<<ComboboxSelected>>', self.on_search_mode_change)
         self.filter_entry = ttk.Entry(filter_frame, width=30)
         self.filter_entry.pack(side=LEFT, padx=5)
         self.filter_entry.bind('<KeyRelease>', self.apply_filter)
@@ -133,6 +4214,7 @@ class GCBDownloader:
         ttk.Button(tree_btn_frame, text="取消全选", command=self.deselect_all).pack(side=LEFT, padx=2)
         ttk.Button(tree_btn_frame, text="反选", command=self.invert_selection).pack(side=LEFT, padx=2)
         ttk.Button(tree_btn_frame, text="排除已下载", command=self.exclude_downloaded).pack(side=LEFT, padx=2)
+        ttk.Button(tree_btn_frame, text="取消筛选结果", command=self.deselect_filtered).pack(side=LEFT, padx=2)
         ttk.Separator(tree_btn_frame, orient=VERTICAL).pack(side=LEFT, padx=5, fill=Y)
         ttk.Button(tree_btn_frame, text="选中文件夹", command=self.select_folder).pack(side=LEFT, padx=2)
         ttk.Button(tree_btn_frame, text="取消选中文件夹", command=self.deselect_folder).pack(side=LEFT, padx=2)
@@ -149,7 +4231,7 @@ class GCBDownloader:
         self.tree.heading('size', text='大小')
         self.tree.heading('selected', text='选中')
         self.tree.column('#0', width=400)
-        self.tree.column('size', width=80, anchor=CENTER)
+        self.tree.column('size', width=180, anchor=CENTER)
         self.tree.column('selected', width=50, anchor=CENTER)
         
         tree_scroll_y = ttk.Scrollbar(tree_container, orient=VERTICAL, command=self.tree.yview)
@@ -166,16 +4248,29 @@ class GCBDownloader:
         self.tree.tag_configure('downloaded', foreground='#0066CC')
         self.tree.tag_configure('failed', foreground='#CC0000')
         self.tree.tag_configure('file', foreground='black')
+        # 后台刷新差异：新增绿色底，变化黄色底，删除灰色
+        self.tree.tag_configure('new', background='#E6FFE6')
+        self.tree.tag_configure('changed', background='#FFF5CC')
+        self.tree.tag_configure('removed', foreground='#999999')
         
         self.tree.bind('<Double-1>', self.toggle_item)
         self.tree.bind('<space>', self.toggle_item)
         self.tree.bind('<Button-3>', self.show_context_menu)  # 右键菜单
+        self.tree.bind('<<TreeviewOpen>>', self.on_tree_open)
+        self.tree.bind('<<TreeviewClose>>', self.on_tree_close)
         
         # 创建右键菜单
         self.context_menu = Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="选中此文件夹下所有文件", command=self.select_folder)
         self.context_menu.add_command(label="取消选中此文件夹下所有文件", command=self.deselect_folder)
         self.context_menu.add_separator()
+        self.context_menu.add_command(label="预览", command=self.preview_focused)
+        self.context_menu.add_separator()
+        self.context_menu.add_command(label="优先下载", command=self.prioritize_focused)
+        self.context_menu.add_command(label="暂停下载", command=lambda: self.control_focused(self.engine.pause_task, "暂停"))
+        self.context_menu.add_command(label="继续下载", command=lambda: self.control_focused(self.engine.resume_task, "继续"))
+        self.context_menu.add_command(label="取消下载", command=lambda: self.control_focused(self.engine.cancel_task, "取消"))
+        self.context_menu.add_separator()
         self.context_menu.add_command(label="展开所有", command=self.expand_all)
         self.context_menu.add_command(label="折叠所有", command=self.collapse_all)
         
@@ -201,6 +4296,18 @@ class GCBDownloader:
         self.parallel_combo.pack(side=LEFT)
         self.parallel_combo.bind('<<ComboboxSelected>>', self.on_parallel_change)
         
+        ttk.Label(ctrl_row1, text="下载后:").pack(side=LEFT, padx=(20, 5))
+        self.extract_var = BooleanVar(value=False)
+        ttk.Checkbutton(ctrl_row1, text="解压ZIP", variable=self.extract_var).pack(side=LEFT, padx=2)
+        self.checksum_var = BooleanVar(value=False)
+        ttk.Checkbutton(ctrl_row1, text="计算校验和", variable=self.checksum_var).pack(side=LEFT, padx=2)
+        self.dedupe_var = BooleanVar(value=True)
+        ttk.Checkbutton(ctrl_row1, text="去重", variable=self.dedupe_var).pack(side=LEFT, padx=2)
+        self.compress_transfer_var = BooleanVar(value=True)
+        ttk.Checkbutton(ctrl_row1, text="压缩传输", variable=self.compress_transfer_var).pack(side=LEFT, padx=2)
+        self.store_gz_var = BooleanVar(value=False)
+        ttk.Checkbutton(ctrl_row1, text="CSV压缩保存", variable=self.store_gz_var).pack(side=LEFT, padx=2)
+        
         # 第二行：按钮
         btn_frame = ttk.Frame(download_frame)
         btn_frame.pack(fill=X, pady=5)
@@ -211,6 +4318,15 @@ class GCBDownloader:
         self.stop_btn = ttk.Button(btn_frame, text="停止下载", command=self.stop_download_func, state=DISABLED)
         self.stop_btn.pack(side=LEFT, padx=2)
         
+        self.pause_queue_btn = ttk.Button(btn_frame, text="暂停队列", command=self.toggle_queue_pause, state=DISABLED)
+        self.pause_queue_btn.pack(side=LEFT, padx=2)
+        
+        ttk.Separator(btn_frame, orient=VERTICAL).pack(side=LEFT, padx=5, fill=Y)
+        self.sync_btn = ttk.Button(btn_frame, text="同步", command=self.start_sync)
+        self.sync_btn.pack(side=LEFT, padx=2)
+        self.prune_var = BooleanVar(value=False)
+        ttk.Checkbutton(btn_frame, text="删除上游已移除的文件", variable=self.prune_var).pack(side=LEFT, padx=2)
+        
         # 总体进度
         ttk.Label(download_frame, text="总体进度:").pack(anchor=W, pady=(5,0))
         self.progress_var = DoubleVar()
@@ -228,27 +4344,103 @@ class GCBDownloader:
         
         # 初始化任务进度条列表
         self.task_widgets = []  # [(frame, progress_var, progress_bar, name_label, detail_label, speed_label), ...]
+        self.task_buttons = []  # [(pause_btn, cancel_btn), ...]，与task_widgets一一对应
+        self.slot_paths = {}  # {槽位: 正在下载的文件}
         self.create_task_progress_bars(1)  # 默认1个
         
-        # 日志区域
-        log_frame = ttk.LabelFrame(right_frame, text="日志", padding="5")
-        log_frame.pack(fill=BOTH, expand=True)
+        # 日志/预览区域
+        self.side_notebook = ttk.Notebook(right_frame)
+        self.side_notebook.pack(fill=BOTH, expand=True)
+        log_frame = ttk.Frame(self.side_notebook, padding="5")
+        self.side_notebook.add(log_frame, text="日志")
+        
+        log_filter_frame = ttk.Frame(log_frame)
+        log_filter_frame.pack(fill=X, pady=(0, 2))
+        ttk.Label(log_filter_frame, text="级别:").pack(side=LEFT)
+        self.log_level_var = StringVar(value="全部")
+        log_level_combo = ttk.Combobox(log_filter_frame, textvariable=self.log_level_var, width=6,
+                                       values=list(self.log_level_names), state="readonly")
+        log_level_combo.pack(side=LEFT, padx=5)
+        log_level_combo.bind("<<ComboboxSelected>>", lambda e: self.rebuild_log_view())
         
         self.log_text = ScrolledText(log_frame, height=20, width=40)
         self.log_text.pack(fill=BOTH, expand=True)
+        self.log_text.tag_config('WARNING', foreground='#b36b00')
+        self.log_text.tag_config('ERROR', foreground='red')
+        
+        self.preview_frame = ttk.Frame(self.side_notebook, padding="5")
+        self.side_notebook.add(self.preview_frame, text="预览")
+        self.preview_info_var = StringVar(value="在文件列表中右键文件选择“预览”")
+        ttk.Label(self.preview_frame, textvariable=self.preview_info_var, anchor=W).pack(fill=X, pady=(0, 2))
+        self.preview_text = ScrolledText(self.preview_frame, height=20, width=40, wrap=NONE)
+        self.preview_text.pack(fill=BOTH, expand=True)
+        self.preview_text.config(state=DISABLED)
         
         # 状态栏
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(fill=X, side=BOTTOM, padx=10, pady=5)
+        
         self.status_var = StringVar(value="就绪")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=SUNKEN, anchor=W)
-        status_bar.pack(fill=X, side=BOTTOM, padx=10, pady=5)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=SUNKEN, anchor=W)
+        status_bar.pack(fill=X, side=LEFT, expand=True)
         
-        # 存储选中状态
-        self.selected_items = set()
+        # 缓存加载进度（加载期间才显示）
+        self.load_progress_var = DoubleVar()
+        self.load_progress_bar = ttk.Progressbar(status_frame, variable=self.load_progress_var, maximum=100, length=200)
         
-    def log(self, message):
-        """添加日志"""
-        self.log_text.insert(END, f"{time.strftime('%H:%M:%S')} - {message}\n")
-        self.log_text.see(END)
+        # 存储选中状态（独立于Treeview）
+        self.path_trie = PathTrie()  # 按文件夹汇总大小和数量
+        self.path_to_url = {}  # {relative_path: url}
+        self.selection = SelectionModel(on_change=self.on_selection_change)
+        self.open_folders = set()  # 当前展开的文件夹节点
+        self.stale_marks = set()  # 位于折叠文件夹内、勾选标记尚未刷新的行
+        self.stale_folders = set()  # 位于折叠文件夹内、大小尚未刷新的文件夹行
+        
+    # 日志窗口级别筛选 -> 最低显示级别
+    log_level_names = {"全部": logging.DEBUG, "信息": logging.INFO, "警告": logging.WARNING, "错误": logging.ERROR}
+    # 筛选方式：按文件名，或按已下载NetCDF文件的变量（名称、long_name、standard_name、单位）/全局属性、维度和时间范围
+    search_modes = {"文件名": None, "变量": 'variable', "属性": 'attribute'}
+    
+    def log(self, message, level=logging.INFO, **fields):
+        """添加日志：写入环形缓冲和结构化日志文件，日志窗口每100毫秒批量刷新一次"""
+        self.logger.log(level, message, extra={'fields': fields})
+        self.show_log(message, level)
+    
+    def show_log(self, message, level=logging.INFO):
+        """只显示在日志窗口（对应的结构化记录已由下载事件写入）"""
+        entry = (time.strftime('%H:%M:%S'), level, message)
+        self.log_buffer.append(entry)
+        self.log_pending.append(entry)
+        if not self.log_flush_scheduled:
+            self.log_flush_scheduled = True
+            self.root.after(100, self.flush_log_view)
+    
+    def format_log_entry(self, entry):
+        timestamp, level, message = entry
+        return f"{timestamp} - {message}\n", logging.getLevelName(level) if level >= logging.WARNING else ()
+    
+    def flush_log_view(self):
+        """把新日志批量插入日志窗口，超出最大行数时删除最早的行"""
+        self.log_flush_scheduled = False
+        pending, self.log_pending = self.log_pending[-self.log_max_lines:], []
+        min_level = self.log_level_names.get(self.log_level_var.get(), logging.DEBUG)
+        at_bottom = self.log_text.yview()[1] >= 0.999
+        for entry in pending:
+            if entry[1] >= min_level:
+                self.log_text.insert(END, *self.format_log_entry(entry))
+        
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.log_max_lines
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+        # 用户向上翻看时不自动滚动
+        if at_bottom:
+            self.log_text.see(END)
+    
+    def rebuild_log_view(self):
+        """切换级别筛选后从环形缓冲重建日志窗口"""
+        self.log_text.delete('1.0', END)
+        self.log_pending = list(self.log_buffer)
+        self.flush_log_view()
     
     def on_parallel_change(self, event=None):
         """并行数改变时更新进度条数量"""
@@ -262,6 +4454,8 @@ class GCBDownloader:
         for widget_tuple in self.task_widgets:
             widget_tuple[0].destroy()
         self.task_widgets.clear()
+        self.task_buttons.clear()
+        self.slot_paths.clear()
         
         # 创建新的进度条
         for i in range(num):
@@ -285,7 +4479,18 @@ class GCBDownloader:
             speed_label = ttk.Label(frame, text="", font=('TkDefaultFont', 8))
             speed_label.pack(anchor=W)
             
+            # 单个文件的暂停/继续和取消
+            control_frame = ttk.Frame(frame)
+            control_frame.pack(anchor=W)
+            pause_btn = ttk.Button(control_frame, text="暂停", width=6, state=DISABLED,
+                                   command=lambda slot=i: self.toggle_task_pause(slot))
+            pause_btn.pack(side=LEFT)
+            cancel_btn = ttk.Button(control_frame, text="取消", width=6, state=DISABLED,
+                                    command=lambda slot=i: self.cancel_task(slot))
+            cancel_btn.pack(side=LEFT, padx=2)
+            
             self.task_widgets.append((frame, progress_var, progress_bar, name_label, detail_label, speed_label))
+            self.task_buttons.append((pause_btn, cancel_btn))
         
     def browse_save_dir(self):
         """选择保存目录"""
@@ -294,175 +4499,284 @@ class GCBDownloader:
             self.save_dir_entry.delete(0, END)
             self.save_dir_entry.insert(0, dir_path)
     
-    def save_cache(self):
-        """保存扫描结果到缓存文件"""
+    def get_cache_header(self):
+        """构建缓存头信息"""
+        return {
+            'url': self.url_entry.get(),
+            'scan_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'scan_timestamp': time.time()
+        }
+    
+    def save_cache(self, notify=True):
+        """保存扫描结果到缓存文件（后台线程写入）"""
         if not self.all_files:
-            messagebox.showwarning("警告", "没有可保存的扫描结果！")
+            if notify:
+                messagebox.showwarning("警告", "没有可保存的扫描结果！")
             return
         
-        cache_data = {
-            'url': self.url_entry.get(),
-            'files': self.all_files,
-            'scan_time': time.strftime('%Y-%m-%d %H:%M:%S')
-        }
+        # 在主线程中取快照，写入放到后台线程
+        header = self.get_cache_header()
+        files = {url: dict(info) for url, info in self.all_files.items()}
+        
+        def write():
+            try:
+                write_binary_cache(self.cache_file, header, files)
+                self.root.after(0, lambda: self.log(f"缓存已保存到 {self.cache_file}"))
+                if notify:
+                    self.root.after(0, lambda: messagebox.showinfo("成功", f"扫描结果已保存到 {self.cache_file}"))
+            except Exception as e:
+                self.root.after(0, lambda e=e: self.log(f"保存缓存失败: {e}", logging.ERROR))
+                if notify:
+                    self.root.after(0, lambda e=e: messagebox.showerror("错误", f"保存缓存失败: {e}"))
+        
+        threading.Thread(target=write, daemon=True).start()
+    
+    def export_cache_json(self):
+        """导出扫描结果为JSON"""
+        if not self.all_files:
+            messagebox.showwarning("警告", "没有可导出的扫描结果！")
+            return
+        
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", initialfile=self.legacy_cache_file,
+                                                 filetypes=[("JSON", "*.json")])
+        if not file_path:
+            return
         
+        cache_data = dict(self.get_cache_header(), files=self.all_files)
         try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
+            with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(cache_data, f, ensure_ascii=False, indent=2)
-            self.log(f"缓存已保存到 {self.cache_file}")
-            messagebox.showinfo("成功", f"扫描结果已保存到 {self.cache_file}")
+            self.log(f"扫描结果已导出到 {file_path}")
         except Exception as e:
-            self.log(f"保存缓存失败: {e}")
-            messagebox.showerror("错误", f"保存缓存失败: {e}")
+            self.log(f"导出JSON失败: {e}", logging.ERROR)
+            messagebox.showerror("错误", f"导出JSON失败: {e}")
+    
+    def iter_cache_entries(self):
+        """读取缓存条目，二进制缓存不存在时回退到旧版JSON缓存"""
+        if os.path.exists(self.cache_file):
+            yield from iter_binary_cache(self.cache_file)
+            return
+        
+        with open(self.legacy_cache_file, 'r', encoding='utf-8') as f:
+            cache_data = json.load(f)
+        files = cache_data.pop('files', {})
+        yield dict(cache_data, count=len(files), legacy=True)
+        yield from files.items()
     
     def load_cache(self):
-        """从缓存文件加载扫描结果"""
-        if not os.path.exists(self.cache_file):
+        """从缓存文件加载扫描结果（后台线程读取，分批插入树）"""
+        if not os.path.exists(self.cache_file) and not os.path.exists(self.legacy_cache_file):
             self.log("没有找到缓存文件")
             return False
         
-        try:
-            with open(self.cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            
-            self.all_files = cache_data.get('files', {})
-            cached_url = cache_data.get('url', '')
-            scan_time = cache_data.get('scan_time', '未知')
-            
-            # 清除路径缓存
-            if hasattr(self, '_path_to_url_cache'):
-                del self._path_to_url_cache
-            
-            if cached_url:
-                self.url_entry.delete(0, END)
-                self.url_entry.insert(0, cached_url)
-            
-            # 清空并重建树
-            self.tree.delete(*self.tree.get_children())
-            self.selected_items.clear()
-            
-            for url, info in self.all_files.items():
-                self.add_to_tree(info['path'], url)
-            
-            self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
-            self.log(f"已加载缓存 (扫描时间: {scan_time})，共 {len(self.all_files)} 个文件")
-            self.status_var.set(f"已加载缓存，共 {len(self.all_files)} 个文件")
-            self.update_downloaded_count()
-            return True
+        self.cache_load_generation += 1
+        generation = self.cache_load_generation
+        batches = queue.Queue()
+        
+        # 清空并重建树
+        self.is_loading_cache = True
+        self.all_files = {}
+        self.catalog_diff = {'new': set(), 'changed': set(), 'removed': {}}
+        self.clear_tree()
+        self.selection.clear()
+        self.selection.set_catalog({})
+        self.path_trie.clear()
+        self.path_to_url = {}
+        if self.size_prober:
+            self.size_prober.cancel_all()
+        self.update_selected_count()
+        
+        self.load_progress_var.set(0)
+        self.load_progress_bar.pack(side=RIGHT, padx=(5, 0))
+        self.status_var.set("正在加载缓存...")
+        
+        def reader():
+            try:
+                entries = self.iter_cache_entries()
+                batches.put(('header', next(entries)))
+                batch = []
+                for entry in entries:
+                    if generation != self.cache_load_generation:
+                        return
+                    batch.append(entry)
+                    if len(batch) >= self.cache_load_batch:
+                        batches.put(('entries', batch))
+                        batch = []
+                batches.put(('entries', batch))
+                batches.put(('done', None))
+            except Exception as e:
+                batches.put(('error', e))
+        
+        state = {'header': {}, 'loaded': 0}
+        
+        def pump():
+            # 每次只处理一批，保证窗口在加载期间可以响应
+            if generation != self.cache_load_generation:
+                return
+            try:
+                kind, payload = batches.get_nowait()
+            except queue.Empty:
+                self.root.after(20, pump)
+                return
             
-        except Exception as e:
-            self.log(f"加载缓存失败: {e}")
-            return False
+            if kind == 'header':
+                state['header'] = payload
+                cached_url = payload.get('url', '')
+                if cached_url:
+                    self.url_entry.delete(0, END)
+                    self.url_entry.insert(0, cached_url)
+            elif kind == 'entries':
+                for url, info in payload:
+                    self.all_files[url] = info
+                    path, size_bytes = info['path'], info.get('size_bytes', 0)
+                    self.selection.set_size(path, size_bytes)
+                    self.path_trie.add_file(path, size_bytes, path in self.downloaded_files)
+                    self.path_to_url[path] = url
+                    self.add_to_tree(path, url)
+                state['loaded'] += len(payload)
+                total = state['header'].get('count', 0)
+                if total:
+                    self.load_progress_var.set(state['loaded'] / total * 100)
+                self.status_var.set(f"正在加载缓存: {state['loaded']}/{total}")
+            elif kind == 'error':
+                self.is_loading_cache = False
+                self.load_progress_bar.pack_forget()
+                self.log(f"加载缓存失败: {payload}", logging.ERROR)
+                self.status_var.set("加载缓存失败")
+                return
+            elif kind == 'done':
+                self.on_cache_loaded(state['header'])
+                return
+            self.root.after(1, pump)
+        
+        threading.Thread(target=reader, daemon=True).start()
+        self.root.after(1, pump)
+        return True
+    
+    def on_cache_loaded(self, header):
+        """缓存加载完成"""
+        self.is_loading_cache = False
+        self.load_progress_bar.pack_forget()
+        # 文件夹行在流式加载过程中插入，此时汇总值才完整
+        self.refresh_all_folder_sizes()
+        scan_time = header.get('scan_time', '未知')
+        
+        # 加载期间输入的筛选条件在此统一生效
+        if self.filter_entry.get() or self.ext_var.get() != '全部' or not self.show_all_files:
+            self.apply_filter()
+        
+        self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
+        self.log(f"已加载缓存 (扫描时间: {scan_time})，共 {len(self.all_files)} 个文件")
+        self.status_var.set(f"已加载缓存，共 {len(self.all_files)} 个文件")
+        self.update_downloaded_count()
+        
+        # 旧版JSON缓存迁移为二进制格式
+        if header.get('legacy') and self.all_files:
+            self.save_cache(notify=False)
+        
+        # 缓存中尚未获取大小的文件在后台继续获取
+        if any(self.needs_size_probe(info) for info in self.all_files.values()):
+            self.request_catalog_probes()
+        
+        # 缓存过旧时，先显示缓存内容，再在后台刷新
+        age = self.get_cache_age(header)
+        if age is not None and age > self.cache_max_age and not self.is_scanning:
+            self.log(f"缓存已有 {age / 3600:.1f} 小时，自动开始后台刷新")
+            self.start_scan(background=True)
+    
+    def get_cache_age(self, header):
+        """计算缓存距今的秒数，无法确定时返回None"""
+        scan_timestamp = header.get('scan_timestamp')
+        if scan_timestamp is None:
+            # 旧版缓存只有文本时间
+            try:
+                scan_timestamp = time.mktime(time.strptime(header.get('scan_time', ''), '%Y-%m-%d %H:%M:%S'))
+            except ValueError:
+                return None
+        return time.time() - scan_timestamp
     
     def load_downloaded_record(self, refresh_ui=True):
         """加载已下载记录"""
-        if not os.path.exists(self.downloaded_record_file):
-            return
-        
         try:
-            with open(self.downloaded_record_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            self.downloaded_files = set(data.get('downloaded', []))
+            if not self.records.load_downloaded():
+                return
+            self.downloaded_files, self.failed_files = self.records.snapshot()
             self.log(f"已加载下载记录，{len(self.downloaded_files)} 个文件已下载")
             self.update_downloaded_count()
             # 刷新树形视图以显示已下载标记
             if refresh_ui:
                 self.apply_filter()
         except Exception as e:
-            self.log(f"加载下载记录失败: {e}")
+            self.log(f"加载下载记录失败: {e}", logging.ERROR)
     
     def save_downloaded_record(self):
         """保存已下载记录"""
         try:
-            data = {
-                'downloaded': list(self.downloaded_files),
-                'last_update': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            with open(self.downloaded_record_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.records.save_downloaded()
         except Exception as e:
-            self.log(f"保存下载记录失败: {e}")
+            self.log(f"保存下载记录失败: {e}", logging.ERROR)
     
     def load_failed_record(self, refresh_ui=True):
         """加载下载失败记录"""
-        if not os.path.exists(self.failed_record_file):
-            return
-        
         try:
-            with open(self.failed_record_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            self.failed_files = set(data.get('failed', []))
+            if not self.records.load_failed():
+                return
+            self.downloaded_files, self.failed_files = self.records.snapshot()
             self.log(f"已加载失败记录，{len(self.failed_files)} 个文件下载失败")
             self.update_failed_count()
             if refresh_ui:
                 self.apply_filter()
         except Exception as e:
-            self.log(f"加载失败记录失败: {e}")
+            self.log(f"加载失败记录失败: {e}", logging.ERROR)
     
     def save_failed_record(self):
         """保存下载失败记录"""
         try:
-            data = {
-                'failed': list(self.failed_files),
-                'last_update': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            with open(self.failed_record_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.records.save_failed()
         except Exception as e:
-            self.log(f"保存失败记录失败: {e}")
+            self.log(f"保存失败记录失败: {e}", logging.ERROR)
     
-    def mark_as_failed(self, relative_path):
-        """标记文件为下载失败"""
+    def on_file_failed(self, relative_path):
+        """文件下载失败后更新界面（记录已由下载引擎保存）"""
         self.failed_files.add(relative_path)
-        # 确保不在成功列表中
         self.downloaded_files.discard(relative_path)
-        self.save_failed_record()
-        self.save_downloaded_record()
-        
-        # 使用root.after确保UI更新在主线程执行
-        def update_ui():
-            self.update_failed_count()
-            self.update_downloaded_count()
-            # 更新树形视图中的显示 - 红色
-            if self.tree.exists(relative_path):
-                current_tags = list(self.tree.item(relative_path, 'tags'))
-                # 移除downloaded标签，添加failed标签
-                if 'downloaded' in current_tags:
-                    current_tags.remove('downloaded')
-                if 'failed' not in current_tags:
-                    current_tags.append('failed')
-                self.tree.item(relative_path, tags=tuple(current_tags))
-                # 强制刷新显示
-                self.tree.update_idletasks()
-        
-        self.root.after(0, update_ui)
-    
-    def mark_as_downloaded(self, relative_path):
-        """标记文件为已下载"""
+        self.update_failed_count()
+        self.update_downloaded_count()
+        # 更新树形视图中的显示 - 红色
+        if self.tree.exists(relative_path):
+            current_tags = list(self.tree.item(relative_path, 'tags'))
+            # 移除downloaded标签，添加failed标签
+            if 'downloaded' in current_tags:
+                current_tags.remove('downloaded')
+            if 'failed' not in current_tags:
+                current_tags.append('failed')
+            self.tree.item(relative_path, tags=tuple(current_tags))
+        self.path_trie.set_downloaded(relative_path, False)
+        self.push_folder_sizes(self.get_ancestor_folders([relative_path]))
+    
+    def on_file_downloaded(self, relative_path):
+        """文件下载完成后更新界面（记录已由下载引擎保存）"""
         self.downloaded_files.add(relative_path)
-        # 从失败列表中移除
-        if relative_path in self.failed_files:
-            self.failed_files.discard(relative_path)
-            self.save_failed_record()
-        self.save_downloaded_record()
-        
-        # 使用root.after确保UI更新在主线程执行
-        def update_ui():
-            self.update_failed_count()
-            self.update_downloaded_count()
-            # 更新树形视图中的显示 - 蓝色
-            if self.tree.exists(relative_path):
-                current_tags = list(self.tree.item(relative_path, 'tags'))
-                # 移除failed标签，添加downloaded标签
-                if 'failed' in current_tags:
-                    current_tags.remove('failed')
-                if 'downloaded' not in current_tags:
-                    current_tags.append('downloaded')
-                self.tree.item(relative_path, tags=tuple(current_tags))
-                # 强制刷新显示
-                self.tree.update_idletasks()
-        
-        self.root.after(0, update_ui)
+        self.failed_files.discard(relative_path)
+        self.update_failed_count()
+        self.update_downloaded_count()
+        # 更新树形视图中的显示 - 蓝色
+        if self.tree.exists(relative_path):
+            current_tags = list(self.tree.item(relative_path, 'tags'))
+            # 移除failed标签，添加downloaded标签
+            if 'failed' in current_tags:
+                current_tags.remove('failed')
+            if 'downloaded' not in current_tags:
+                current_tags.append('downloaded')
+            self.tree.item(relative_path, tags=tuple(current_tags))
+        self.path_trie.set_downloaded(relative_path, True)
+        self.push_folder_sizes(self.get_ancestor_folders([relative_path]))
+    
+    def refresh_record_copies(self):
+        """批次结束后从下载记录重新复制（包含同步删除的文件和其它节点合并进来的记录）"""
+        self.downloaded_files, self.failed_files = self.records.snapshot()
+        self.update_failed_count()
+        self.update_downloaded_count()
     
     def update_failed_count(self):
         """更新失败计数"""
@@ -492,75 +4806,62 @@ class GCBDownloader:
             self.context_menu.post(event.x_root, event.y_root)
     
     def get_all_children_files(self, item):
-        """获取某个节点下的所有文件（递归）"""
-        files = []
-        children = self.tree.get_children(item)
-        
-        if not children:
-            # 如果没有子节点，检查是否是文件
-            tags = self.tree.item(item, 'tags')
-            if 'file' in tags:
-                files.append(item)
-        else:
-            # 递归获取所有子节点的文件
-            for child in children:
-                files.extend(self.get_all_children_files(child))
-        
-        return files
+        """获取某个节点下符合当前筛选条件的所有文件（在前缀树中遍历子树）"""
+        return [path for path in self.path_trie.files_under(item) if self.matches_filter(path)]
     
-    def select_folder(self):
-        """选中当前文件夹下的所有文件"""
+    def get_focused_files(self):
+        """获取当前焦点节点下的所有文件，未选择节点时返回None"""
         item = self.tree.focus()
         if not item:
             messagebox.showwarning("警告", "请先选择一个文件夹！")
-            return
-        
-        files = self.get_all_children_files(item)
+            return None
         
-        # 如果当前选中的就是文件，也加入
-        tags = self.tree.item(item, 'tags')
-        if 'file' in tags:
-            files.append(item)
-        
-        for file_item in files:
-            self.selected_items.add(file_item)
-            if self.tree.exists(file_item):
-                self.tree.set(file_item, 'selected', '☑')
+        # 如果当前选中的就是文件，直接返回该文件
+        if item in self.path_trie.files:
+            return [item]
+        return self.get_all_children_files(item)
+    
+    def select_folder(self):
+        """选中当前文件夹下的所有文件"""
+        files = self.get_focused_files()
+        if files is None:
+            return
         
+        changed = self.selection.select(files)
+        self.push_selection_marks(changed)
         self.update_selected_count()
-        self.log(f"已选中 {len(files)} 个文件")
+        self.log_folder_selection(f"已选中 {len(files)} 个文件")
     
     def deselect_folder(self):
         """取消选中当前文件夹下的所有文件"""
-        item = self.tree.focus()
-        if not item:
-            messagebox.showwarning("警告", "请先选择一个文件夹！")
+        files = self.get_focused_files()
+        if files is None:
             return
         
-        files = self.get_all_children_files(item)
-        
-        # 如果当前选中的就是文件，也处理
-        tags = self.tree.item(item, 'tags')
-        if 'file' in tags:
-            files.append(item)
-        
-        for file_item in files:
-            self.selected_items.discard(file_item)
-            if self.tree.exists(file_item):
-                self.tree.set(file_item, 'selected', '☐')
-        
+        changed = self.selection.deselect(files)
+        self.push_selection_marks(changed)
         self.update_selected_count()
-        self.log(f"已取消选中 {len(files)} 个文件")
+        self.log_folder_selection(f"已取消选中 {len(files)} 个文件")
+    
+    def log_folder_selection(self, message):
+        """记录文件夹选择结果，附带文件夹的已选/总大小"""
+        node = self.path_trie.get_folder(self.tree.focus())
+        if node is not None:
+            message += f" (此文件夹已选 {format_size(node.selected_bytes)} / {format_size(node.total_bytes)})"
+        self.log(message)
     
     def expand_all(self):
         """展开所有节点"""
         def expand_recursive(item):
             self.tree.item(item, open=True)
+            self.open_folders.add(item)
             for child in self.tree.get_children(item):
                 expand_recursive(child)
         
         for item in self.tree.get_children():
             expand_recursive(item)
+        self.flush_stale_marks('')
+        self.flush_stale_folders('')
     
     def collapse_all(self):
         """折叠所有节点"""
@@ -571,245 +4872,610 @@ class GCBDownloader:
         
         for item in self.tree.get_children():
             collapse_recursive(item)
+        self.open_folders.clear()
+    
+    def on_tree_open(self, event=None):
+        """展开文件夹时，刷新其中尚未更新的勾选标记"""
+        item = self.tree.focus()
+        if item:
+            self.open_folders.add(item)
+            self.flush_stale_marks(item)
+            self.flush_stale_folders(item)
+            visible = [path for path in self.path_trie.files_under(item) if self.is_row_visible(path)]
+            self.request_size_probes(visible, SizeProber.PRIORITY_VISIBLE)
+    
+    def on_tree_close(self, event=None):
+        """折叠文件夹：其中未选中文件的探测降为后台优先级"""
+        item = self.tree.focus()
+        if item:
+            self.open_folders.discard(item)
+            if self.size_prober:
+                urls = [self.path_to_url[path] for path in self.path_trie.files_under(item)
+                        if path not in self.selection and path in self.path_to_url]
+                self.size_prober.demote(urls, SizeProber.PRIORITY_BACKGROUND)
+    
+    def clear_tree(self):
+        """清空树形视图及其显示状态"""
+        self.tree.delete(*self.tree.get_children())
+        self.open_folders.clear()
+        self.stale_marks.clear()
+        self.stale_folders.clear()
+    
+    def is_row_visible(self, path):
+        """检查行是否可见（所有上级文件夹均已展开），不访问Tk"""
+        parent = path.rpartition('/')[0]
+        while parent:
+            if parent not in self.open_folders:
+                return False
+            parent = parent.rpartition('/')[0]
+        return True
+    
+    def push_selection_marks(self, paths):
+        """把选中状态同步到Treeview - 只更新可见的行，其余行在展开时再刷新"""
+        for path in paths:
+            if not self.is_row_visible(path):
+                self.stale_marks.add(path)
+                continue
+            self.stale_marks.discard(path)
+            try:
+                self.tree.set(path, 'selected', '☑' if path in self.selection else '☐')
+            except TclError:
+                pass  # 当前筛选条件下未显示
+    
+    def flush_stale_marks(self, folder):
+        """刷新某个文件夹下已变为可见的勾选标记"""
+        prefix = folder + '/' if folder else ''
+        pending = [path for path in self.stale_marks if path.startswith(prefix) and self.is_row_visible(path)]
+        self.push_selection_marks(pending)
+    
+    def get_ancestor_folders(self, paths):
+        """获取一组文件的所有上级文件夹"""
+        folders = set()
+        for path in paths:
+            parent = path.rpartition('/')[0]
+            while parent and parent not in folders:
+                folders.add(parent)
+                parent = parent.rpartition('/')[0]
+        return folders
+    
+    def push_folder_sizes(self, folders):
+        """把文件夹汇总大小同步到Treeview - 只更新可见的行"""
+        for folder in folders:
+            if not self.is_row_visible(folder):
+                self.stale_folders.add(folder)
+                continue
+            self.stale_folders.discard(folder)
+            node = self.path_trie.get_folder(folder)
+            if node is None:
+                continue
+            try:
+                self.tree.set(folder, 'size', format_folder_size(node))
+            except TclError:
+                pass  # 当前筛选条件下未显示
+    
+    def flush_stale_folders(self, folder):
+        """刷新某个文件夹下已变为可见的文件夹大小"""
+        prefix = folder + '/' if folder else ''
+        pending = [path for path in self.stale_folders if path.startswith(prefix) and self.is_row_visible(path)]
+        self.push_folder_sizes(pending)
+    
+    def refresh_all_folder_sizes(self):
+        """刷新全部文件夹的大小显示"""
+        self.push_folder_sizes([folder for folder, _ in self.path_trie.iter_folders()])
+    
+    def sync_catalog_models(self):
+        """根据当前文件列表重建选中模型和前缀树"""
+        self.selection.set_catalog({info['path']: info.get('size_bytes', 0) for info in self.all_files.values()})
+        self.path_trie.clear()
+        self.path_to_url = {info['path']: url for url, info in self.all_files.items()}
+        for info in self.all_files.values():
+            path = info['path']
+            self.path_trie.add_file(path, info.get('size_bytes', 0), path in self.downloaded_files, path in self.selection)
+        self.refresh_all_folder_sizes()
+    
+    def get_filtered_paths(self):
+        """获取符合当前筛选条件的全部文件"""
+        return [info['path'] for info in self.all_files.values() if self.matches_filter(info['path'])]
             
-    def start_scan(self):
-        """开始扫描"""
+    def load_mirror_config(self):
+        """加载镜像源配置"""
+        if not os.path.exists(self.mirror_file):
+            return
+        try:
+            with open(self.mirror_file, 'r', encoding='utf-8') as f:
+                self.mirror_urls = json.load(f).get('mirrors', [])
+            if self.mirror_urls:
+                self.log(f"已加载 {len(self.mirror_urls)} 个备用镜像")
+        except Exception as e:
+            self.log(f"加载镜像配置失败: {e}", logging.ERROR)
+    
+    def save_mirror_config(self):
+        """保存镜像源配置"""
+        try:
+            data = {
+                'mirrors': self.mirror_urls,
+                'last_update': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            with open(self.mirror_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            self.log(f"保存镜像配置失败: {e}", logging.ERROR)
+    
+    def get_mirror_pool(self):
+        """获取镜像池，主网址或镜像列表变化时重建（保留未变化时的测速结果）"""
+        primary = self.url_entry.get()
+        pool = self.mirror_pool
+        if pool is None or pool.primary != primary or pool.configured != self.mirror_urls:
+            self.mirror_pool = MirrorPool(primary, self.mirror_urls)
+        return self.mirror_pool
+    
+    def probe_mirrors(self, pool, sample_url):
+        """测速所有镜像并记录结果（后台线程调用）"""
+        pool.probe(self.get_http_session(), sample_url)
+        for mirror in pool.mirrors:
+            self.root.after(0, lambda d=mirror.describe(): self.log(f"镜像测速: {d}"))
+    
+    def open_mirror_dialog(self):
+        """镜像源设置窗口"""
+        dialog = Toplevel(self.root)
+        dialog.title("镜像源设置")
+        dialog.geometry("700x420")
+        
+        ttk.Label(dialog, text=f"主网址: {self.url_entry.get()}").pack(anchor=W, padx=10, pady=(10, 0))
+        ttk.Label(dialog, text="备用镜像（每行一个，目录结构需与主网址相同）:").pack(anchor=W, padx=10, pady=(5, 0))
+        
+        mirror_text = Text(dialog, height=8)
+        mirror_text.pack(fill=X, padx=10, pady=5)
+        mirror_text.insert('1.0', '\n'.join(self.mirror_urls))
+        
+        ttk.Label(dialog, text="测速结果:").pack(anchor=W, padx=10)
+        result_text = ScrolledText(dialog, height=8)
+        result_text.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        
+        def save():
+            self.mirror_urls = [line.strip() for line in mirror_text.get('1.0', END).splitlines() if line.strip()]
+            self.save_mirror_config()
+            self.log(f"已保存 {len(self.mirror_urls)} 个备用镜像")
+        
+        def show_results(pool):
+            result_text.delete('1.0', END)
+            for mirror in pool.mirrors:
+                result_text.insert(END, mirror.describe() + '\n')
+        
+        def probe():
+            save()
+            if not self.all_files:
+                messagebox.showwarning("警告", "请先扫描或加载缓存，测速需要一个样本文件！", parent=dialog)
+                return
+            pool = self.get_mirror_pool()
+            sample_url = next(iter(self.all_files))
+            result_text.delete('1.0', END)
+            result_text.insert(END, "正在测速...\n")
+            
+            def run():
+                self.probe_mirrors(pool, sample_url)
+                self.root.after(0, lambda: show_results(pool))
+            threading.Thread(target=run, daemon=True).start()
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=X, padx=10, pady=(0, 10))
+        ttk.Button(btn_frame, text="测速", command=probe).pack(side=LEFT, padx=2)
+        ttk.Button(btn_frame, text="保存", command=save).pack(side=LEFT, padx=2)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=RIGHT, padx=2)
+    
+    def load_volume_config(self):
+        """加载多卷存放配置"""
+        if not os.path.exists(self.volume_file):
+            return
+        try:
+            with open(self.volume_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.volume_config = {key: data.get(key, default) for key, default in
+                                  (('volumes', []), ('policy', 'free_space'), ('pins', {}))}
+            if self.volume_config['volumes']:
+                self.log(f"已加载 {len(self.volume_config['volumes'])} 个存储卷")
+        except Exception as e:
+            self.log(f"加载存储卷配置失败: {e}", logging.ERROR)
+    
+    def save_volume_config(self):
+        """保存多卷存放配置"""
+        try:
+            data = dict(self.volume_config, last_update=time.strftime('%Y-%m-%d %H:%M:%S'))
+            with open(self.volume_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            self.log(f"保存存储卷配置失败: {e}", logging.ERROR)
+    
+    def get_placement(self, save_dir):
+        """按存储卷配置创建VolumePlacement，没有配置存储卷时返回None（文件直接保存在下载目录中）"""
+        config = self.volume_config
+        if not config['volumes'] and not config['pins']:
+            return None
+        return VolumePlacement(save_dir, config['volumes'], config['policy'], config['pins'])
+    
+    def confirm_free_space(self, save_dir, sizes, placement, action):
+        """下载前检查剩余空间，不足时询问是否仍然开始；返回是否继续"""
+        try:
+            short = preflight_space(save_dir, sizes, placement)
+        except OSError as e:
+            self.log(f"检查剩余空间失败: {e}", logging.WARNING)
+            return True
+        if not short:
+            return True
+        shortage = describe_space_shortage(short)
+        self.log(f"剩余空间不足: {shortage}", logging.WARNING)
+        message = "下载所选文件所需的空间超过了剩余空间：\n" + "\n".join(
+            f"{path}: 需要 {format_size(size)}，剩余 {format_size(available)}" for path, size, available in short)
+        return messagebox.askyesno("空间不足", f"{message}\n\n是否仍然{action}？")
+    
+    def open_volume_dialog(self):
+        """存储卷设置窗口"""
+        dialog = Toplevel(self.root)
+        dialog.title("存储卷设置")
+        dialog.geometry("700x480")
+        
+        ttk.Label(dialog, text="存储卷（每行一个目录，留空表示全部保存在下载目录中）:").pack(anchor=W, padx=10, pady=(10, 0))
+        volume_text = Text(dialog, height=5)
+        volume_text.pack(fill=X, padx=10, pady=5)
+        volume_text.insert('1.0', '\n'.join(self.volume_config['volumes']))
+        
+        policy_frame = ttk.Frame(dialog)
+        policy_frame.pack(fill=X, padx=10)
+        ttk.Label(policy_frame, text="存放策略:").pack(side=LEFT)
+        policies = {name: policy for policy, name in VolumePlacement.policy_names.items()}
+        policy_var = StringVar(value=VolumePlacement.policy_names.get(self.volume_config['policy'], "剩余空间优先"))
+        ttk.Combobox(policy_frame, textvariable=policy_var, values=list(policies), state="readonly",
+                     width=14).pack(side=LEFT, padx=5)
+        
+        ttk.Label(dialog, text="按文件夹固定（每行一个“顶层文件夹 = 存储卷目录”，仅“按文件夹固定”策略使用）:").pack(
+            anchor=W, padx=10, pady=(5, 0))
+        pin_text = Text(dialog, height=4)
+        pin_text.pack(fill=X, padx=10, pady=5)
+        pin_text.insert('1.0', '\n'.join(f"{folder} = {volume}" for folder, volume in self.volume_config['pins'].items()))
+        
+        ttk.Label(dialog, text="各卷空间:").pack(anchor=W, padx=10)
+        result_text = ScrolledText(dialog, height=6)
+        result_text.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        
+        def save():
+            pins = {}
+            for line in pin_text.get('1.0', END).splitlines():
+                folder, sep, volume = line.partition('=')
+                if sep and folder.strip() and volume.strip():
+                    pins[folder.strip().strip('/\\')] = volume.strip()
+            self.volume_config = {
+                'volumes': [line.strip() for line in volume_text.get('1.0', END).splitlines() if line.strip()],
+                'policy': policies[policy_var.get()],
+                'pins': pins
+            }
+            self.save_volume_config()
+            self.log(f"已保存 {len(self.volume_config['volumes'])} 个存储卷（{policy_var.get()}）")
+        
+        def check():
+            save()
+            save_dir = self.save_dir_entry.get()
+            sizes = {info['path']: info.get('size_bytes') or 0 for info in self.all_files.values()
+                     if info['path'] in self.selection and not find_stored_file(os.path.join(save_dir, info['path']))}
+            result_text.delete('1.0', END)
+            try:
+                placement = self.get_placement(save_dir)
+                needed = placement.plan(sizes) if placement else {os.path.abspath(save_dir): sum(sizes.values())}
+                for path, size in needed.items():
+                    result_text.insert(END, f"{path}: 剩余 {format_size(free_space(path))}，"
+                                            f"所选文件需要 {format_size(size)}\n")
+                short = preflight_space(save_dir, sizes, placement)
+            except (OSError, ValueError) as e:
+                result_text.insert(END, f"检查失败: {e}\n")
+                return
+            result_text.insert(END, f"空间不足: {describe_space_shortage(short)}\n" if short else "空间充足\n")
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=X, padx=10, pady=(0, 10))
+        ttk.Button(btn_frame, text="检查空间", command=check).pack(side=LEFT, padx=2)
+        ttk.Button(btn_frame, text="保存", command=save).pack(side=LEFT, padx=2)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=RIGHT, padx=2)
+    
+    def start_scan(self, background=False):
+        """开始扫描（background=True 时保留当前列表，扫描完成后按差异合并）"""
         if self.is_scanning:
             return
+        if background and self.is_loading_cache:
+            self.log("缓存正在加载，请稍后再刷新")
+            return
         self.is_scanning = True
+        self.scan_start_time = time.perf_counter()
         self.scan_btn.config(state=DISABLED)
-        self.all_files.clear()
-        self.selected_items.clear()
-        self.tree.delete(*self.tree.get_children())
-        self.log("开始扫描文件...")
+        self.refresh_btn.config(state=DISABLED)
+        
+        if background:
+            self.log("开始后台刷新文件列表...")
+        else:
+            # 终止尚未完成的缓存加载
+            self.cache_load_generation += 1
+            self.is_loading_cache = False
+            self.load_progress_bar.pack_forget()
+            self.all_files.clear()
+            self.selection.clear()
+            self.selection.set_catalog({})
+            self.path_trie.clear()
+            self.path_to_url = {}
+            if self.size_prober:
+                self.size_prober.cancel_all()
+            self.update_selected_count()
+            self.catalog_diff = {'new': set(), 'changed': set(), 'removed': {}}
+            self.clear_tree()
+            self.log("开始扫描文件...")
         
-        thread = threading.Thread(target=self.scan_files, daemon=True)
+        thread = threading.Thread(target=self.scan_files, args=(background,), daemon=True)
         thread.start()
+    
+    def start_background_refresh(self):
+        """后台刷新：保留当前列表，扫描完成后合并差异"""
+        self.start_scan(background=True)
         
-    def scan_files(self):
-        """扫描文件（后台线程）- 使用多线程加速"""
-        target_url = self.url_entry.get()
+    def get_size_prober(self):
+        """获取后台大小探测服务（首次使用时创建，使用独立的连接池）"""
+        if self.size_prober is None:
+            session = create_http_session(self.size_probe_workers)
+            self.size_prober = SizeProber(lambda url: fetch_file_metadata(session, url),
+                                          self.on_probe_result, self.size_probe_workers)
+            self.root.after(200, self.flush_probe_results)
+        return self.size_prober
+    
+    def needs_size_probe(self, info):
+        """文件大小是否尚未获取"""
+        return info.get('size') in ('待获取', '获取中...')
+    
+    def request_size_probes(self, paths, priority):
+        """为尚未获取大小的文件提交探测请求"""
+        urls = []
+        for path in paths:
+            url = self.path_to_url.get(path)
+            if url and self.needs_size_probe(self.all_files[url]):
+                urls.append(url)
+        if urls:
+            self.get_size_prober().submit(urls, priority)
+    
+    def request_catalog_probes(self, refresh=False):
+        """按优先级为整个目录提交探测：选中的最先，展开文件夹中可见的其次，其余在后台"""
+        prober = self.get_size_prober()
+        if refresh:
+            # 后台刷新时重新获取全部文件的元数据，用于发现变化
+            prober.submit(list(self.all_files), SizeProber.PRIORITY_BACKGROUND)
+        self.request_size_probes(self.selection, SizeProber.PRIORITY_SELECTED)
+        visible = [info['path'] for info in self.all_files.values() if self.is_row_visible(info['path'])]
+        self.request_size_probes(visible, SizeProber.PRIORITY_VISIBLE)
+        self.request_size_probes([info['path'] for info in self.all_files.values()], SizeProber.PRIORITY_BACKGROUND)
+    
+    def on_probe_result(self, url, result):
+        """探测结果回调（工作线程），先缓存，由主线程批量合并"""
+        with self.probe_results_lock:
+            self.probe_results.append((url, result))
+    
+    def flush_probe_results(self):
+        """把探测结果批量合并到文件列表和界面（主线程定时执行）"""
+        with self.probe_results_lock:
+            results, self.probe_results = self.probe_results, []
         
-        try:
-            options = webdriver.ChromeOptions()
-            options.add_argument('--headless')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument('--disable-gpu')
-            options.page_load_strategy = 'eager'  # 加速页面加载
-            
-            self.root.after(0, lambda: self.status_var.set("正在启动浏览器..."))
-            self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        changed_folders = set()
+        for url, result in results:
+            info = self.all_files.get(url)
+            if info is None:
+                continue
+            path = info['path']
+            old_size = info.get('size_bytes', 0)
+            previous = {key: info.get(key) for key in ('size_bytes', 'etag', 'last_modified')}
+            if result is None:
+                # 获取失败（可能只是暂时的）：保留已知的大小和ETag，之前也不知道时才显示为未知
+                if old_size:
+                    continue
+                info['size'] = '未知'
+                size_bytes = 0
+            else:
+                size_bytes = result['size_bytes']
+                info['size'] = format_size(size_bytes) if size_bytes else '未知'
+                info['etag'] = result['etag']
+                info['last_modified'] = result['last_modified']
+            info['size_bytes'] = size_bytes
             
-            self.root.after(0, lambda: self.status_var.set(f"正在访问: {target_url}"))
-            self.driver.get(target_url)
-            time.sleep(3)
+            # 与之前探测到的ETag（其次修改时间，最后大小）不同，说明远端文件有变化（如同样大小的修正版本）
+            if (result is not None and old_size and size_bytes and path not in self.catalog_diff['new']
+                    and SyncRunner.is_changed(previous, result)):
+                self.catalog_diff['changed'].add(path)
+                if self.tree.exists(path):
+                    self.tree.item(path, tags=self.get_file_tags(path, url))
             
-            # 尝试展开文件树
-            self.root.after(0, lambda: self.status_var.set("正在展开文件树..."))
+            self.selection.set_size(path, size_bytes)
+            self.path_trie.set_size(path, size_bytes)
+            changed_folders.update(self.get_ancestor_folders([path]))
             try:
-                expand_script = """
-                if (typeof $ !== 'undefined' && $.jstree) {
-                    $('.jstree').jstree('open_all');
-                }
-                if (typeof $ !== 'undefined' && $.ui && $.ui.fancytree) {
-                    $.ui.fancytree.getTree().expandAll();
-                }
-                document.querySelectorAll('.jstree-closed, .fancytree-expander').forEach(el => el.click());
-                """
-                self.driver.execute_script(expand_script)
-                time.sleep(2)
-            except:
-                pass
-            
-            target_extensions = ('.nc', '.xlsx', '.xls', '.csv', '.zip', '.pdf')
-            found_urls = set()
-            stable_count = 0
-            
-            self.root.after(0, lambda: self.status_var.set("正在收集文件链接..."))
-            
-            # 快速收集所有链接
-            while stable_count < 2:
-                elems = self.driver.find_elements(By.TAG_NAME, "a")
-                new_count = 0
-                
-                # 批量获取href属性
-                hrefs = self.driver.execute_script("""
-                    var links = document.querySelectorAll('a');
-                    var hrefs = [];
-                    for (var i = 0; i < links.length; i++) {
-                        if (links[i].href) hrefs.push(links[i].href);
-                    }
-                    return hrefs;
-                """)
-                
-                for href in hrefs:
-                    if href and href not in found_urls and href.lower().endswith(target_extensions):
-                        found_urls.add(href)
-                        new_count += 1
-                
-                if new_count == 0:
-                    stable_count += 1
-                else:
-                    stable_count = 0
-                    
-                self.root.after(0, lambda c=len(found_urls): self.status_var.set(f"已发现 {c} 个文件链接..."))
-                
-                try:
-                    self.driver.execute_script("window.scrollBy(0, 1000);")
-                    self.driver.execute_script("""
-                        document.querySelectorAll('.jstree-closed').forEach(el => {
-                            var icon = el.querySelector('.jstree-icon');
-                            if (icon) icon.click();
-                        });
-                    """)
-                except:
-                    pass
-                time.sleep(0.5)
-            
-            # 关闭浏览器，释放资源
-            if self.driver:
-                self.driver.quit()
-                self.driver = None
+                self.tree.set(path, 'size', info['size'])
+            except TclError:
+                pass  # 当前筛选条件下未显示
+        
+        if results:
+            self.probe_dirty = True
+            self.push_folder_sizes(changed_folders)
+            self.update_selected_count()
+        
+        pending = self.size_prober.pending_count()
+        if pending:
+            self.status_var.set(f"正在后台获取文件大小，剩余 {pending} 个")
+        elif self.probe_dirty and not self.is_scanning:
+            self.probe_dirty = False
+            self.status_var.set(f"文件大小获取完成，共 {len(self.all_files)} 个文件")
+            self.save_cache(notify=False)
+        self.root.after(200, self.flush_probe_results)
+    
+    def on_selection_change(self, paths, selected):
+        """选中状态变化：更新前缀树，新选中的文件优先获取大小"""
+        self.path_trie.set_selected(paths, selected)
+        if selected:
+            self.request_size_probes(paths, SizeProber.PRIORITY_SELECTED)
+    
+    def scan_files(self, background=False):
+        """扫描文件（后台线程）- 使用多线程加速"""
+        target_url = self.url_entry.get()
+        
+        try:
+            found_urls = collect_file_links(
+                target_url, self.driver_cache_file, self.driver_check_interval,
+                status=lambda text: self.root.after(0, lambda: self.status_var.set(text)),
+                log=lambda message: self.root.after(0, lambda: self.log(message)),
+                started_at=self.scan_start_time)
             
             self.root.after(0, lambda c=len(found_urls): self.status_var.set(f"正在处理 {c} 个文件..."))
-            self.root.after(0, lambda c=len(found_urls): self.log(f"发现 {c} 个文件链接，正在获取文件大小..."))
-            
-            # 先快速处理路径，不获取大小
-            for href in found_urls:
-                relative_path = self.get_relative_path(href, target_url)
-                if not relative_path:
-                    relative_path = unquote(href.split("/")[-1])
-                self.all_files[href] = {'path': relative_path, 'size': '获取中...', 'size_bytes': 0}
-            
-            # 先显示文件列表
-            def add_all_to_tree_initial():
-                for url, info in self.all_files.items():
-                    self.add_to_tree(info['path'], url)
-                self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
-            
-            self.root.after(0, add_all_to_tree_initial)
-            
-            # 使用更多线程并行获取文件大小（使用Session复用连接）
-            session = requests.Session()
-            session.headers.update({"User-Agent": "Mozilla/5.0"})
-            adapter = requests.adapters.HTTPAdapter(pool_connections=50, pool_maxsize=50)
-            session.mount('http://', adapter)
-            session.mount('https://', adapter)
-            
-            processed_count = [0]  # 使用列表以便在闭包中修改
-            total_count = len(found_urls)
-            lock = threading.Lock()
-            
-            def get_file_size(href):
-                file_size = 0
-                size_str = '未知'
-                try:
-                    response = session.head(href, timeout=5, allow_redirects=True)
-                    if response.status_code == 200:
-                        content_length = response.headers.get('content-length')
-                        if content_length:
-                            file_size = int(content_length)
-                            size_str = format_size(file_size)
-                    elif response.status_code == 405:  # HEAD不支持，尝试GET
-                        response = session.get(href, timeout=5, stream=True, allow_redirects=True)
-                        content_length = response.headers.get('content-length')
-                        if content_length:
-                            file_size = int(content_length)
-                            size_str = format_size(file_size)
-                        response.close()
-                except:
-                    pass
-                
-                # 更新进度
-                with lock:
-                    processed_count[0] += 1
-                    if processed_count[0] % 20 == 0 or processed_count[0] == total_count:
-                        p, t = processed_count[0], total_count
-                        self.root.after(0, lambda p=p, t=t: self.status_var.set(f"获取文件大小: {p}/{t}"))
-                
-                return href, file_size, size_str
-            
-            # 使用更多线程并行处理 (32-64个线程大幅加速)
-            with ThreadPoolExecutor(max_workers=50) as executor:
-                futures = [executor.submit(get_file_size, url) for url in found_urls]
-                
-                for future in as_completed(futures):
-                    try:
-                        href, file_size, size_str = future.result()
-                        if href in self.all_files:
-                            self.all_files[href]['size'] = size_str
-                            self.all_files[href]['size_bytes'] = file_size
-                    except:
-                        continue
-            
-            session.close()
-            
-            # 刷新树形视图显示文件大小
-            self.root.after(0, lambda: self.status_var.set("正在更新文件列表..."))
-            
-            def refresh_tree():
-                self.apply_filter()
-                self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
+            self.root.after(0, lambda c=len(found_urls): self.log(f"发现 {c} 个文件链接，文件大小将在后台获取"))
             
-            self.root.after(0, refresh_tree)
+            # 先快速处理路径，大小由后台探测服务按需获取
+            catalog = build_catalog(found_urls, target_url)
             
-            self.root.after(0, lambda: self.log(f"扫描完成，共发现 {len(self.all_files)} 个文件"))
-            self.root.after(0, lambda: self.status_var.set(f"扫描完成，共 {len(self.all_files)} 个文件"))
+            if background:
+                # 后台刷新：在主线程中按差异合并，不重建树
+                self.root.after(0, lambda: self.merge_catalog(catalog))
+                return
             
-            # 自动保存缓存
-            self.root.after(0, self.save_cache)
+            def show_catalog():
+                self.all_files.update(catalog)
+                self.sync_catalog_models()
+                for url, info in self.all_files.items():
+                    self.add_to_tree(info['path'], url)
+                self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
+                self.log(f"扫描完成，共发现 {len(self.all_files)} 个文件")
+                self.status_var.set(f"扫描完成，共 {len(self.all_files)} 个文件")
+                self.request_catalog_probes()
+                # 自动保存缓存（后台写入，不弹窗）
+                self.save_cache(notify=False)
+            
+            self.root.after(0, show_catalog)
             
         except Exception as e:
-            self.root.after(0, lambda: self.log(f"扫描出错: {e}"))
-            self.root.after(0, lambda: messagebox.showerror("错误", f"扫描出错: {e}"))
+            self.root.after(0, lambda e=e: self.log(f"扫描出错: {e}", logging.ERROR))
+            if not background:
+                self.root.after(0, lambda e=e: messagebox.showerror("错误", f"扫描出错: {e}"))
         finally:
-            if self.driver:
-                self.driver.quit()
-                self.driver = None
             self.is_scanning = False
             self.root.after(0, lambda: self.scan_btn.config(state=NORMAL))
+            self.root.after(0, lambda: self.refresh_btn.config(state=NORMAL))
+    
+    def merge_catalog(self, catalog):
+        """将后台扫描结果按差异合并到当前列表（保留选中状态和展开状态）"""
+        old_by_path = {info['path']: (url, info) for url, info in self.all_files.items()}
+        new_by_path = {info['path']: (url, info) for url, info in catalog.items()}
+        
+        # 地址变化，或扫描结果已带有与之前不同的ETag/修改时间/大小时，标记为变化
+        changed = set()
+        for path, (url, info) in new_by_path.items():
+            if path not in old_by_path:
+                continue
+            old_url, old_info = old_by_path[path]
+            if old_url != url or (old_info.get('size_bytes') and info.get('size_bytes')
+                                  and SyncRunner.is_changed(old_info, info)):
+                changed.add(path)
+        
+        # 沿用已知的大小等元数据，其余变化由之后的后台探测按ETag等判断
+        for path, (url, info) in new_by_path.items():
+            if path in old_by_path:
+                old_info = old_by_path[path][1]
+                keys = ('etag', 'last_modified') if info.get('size_bytes') else ('size', 'size_bytes', 'etag', 'last_modified')
+                for key in keys:
+                    if key in old_info and not info.get(key):
+                        info[key] = old_info[key]
+        
+        added = set(new_by_path) - set(old_by_path)
+        removed = set(old_by_path) - set(new_by_path)
+        
+        self.all_files = catalog
+        self.sync_catalog_models()
+        
+        # 保存差异，重建树时仍保留高亮
+        self.catalog_diff['new'] = (self.catalog_diff['new'] | added) - removed
+        self.catalog_diff['changed'] = (self.catalog_diff['changed'] | changed) - removed
+        for path in removed:
+            self.catalog_diff['removed'][path] = old_by_path[path][0]
+        for path in added:
+            self.catalog_diff['removed'].pop(path, None)
+        
+        # 只更新有变化的节点，不重建树
+        for path in removed:
+            self.stale_marks.discard(path)
+            if self.tree.exists(path):
+                self.tree.item(path, tags=('removed',), values=('已删除', ''))
+        
+        for path, (url, info) in new_by_path.items():
+            if path in added:
+                if self.matches_filter(path):
+                    self.add_to_tree(path, url)
+                continue
+            if not self.tree.exists(path):
+                continue
+            self.tree.set(path, 'size', info.get('size', ''))
+            if path in changed:
+                self.tree.item(path, tags=self.get_file_tags(path, url))
+        
+        self.update_selected_count()
+        self.file_count_label.config(text=f"共 {len(self.all_files)} 个文件")
+        self.log(f"后台刷新完成: 新增 {len(added)} 个，删除 {len(removed)} 个，变化 {len(changed)} 个，其余文件的内容变化（ETag/修改时间/大小）将在后台核对")
+        self.status_var.set(f"刷新完成，共 {len(self.all_files)} 个文件 (新增 {len(added)}, 删除 {len(removed)}, 变化 {len(changed)})")
+        self.save_cache(notify=False)
+        self.request_catalog_probes(refresh=True)
     
     def get_relative_path(self, url, base_url):
         """从URL中提取相对路径"""
-        parsed = urlparse(url)
-        path = unquote(parsed.path)
-        base_parsed = urlparse(base_url)
-        base_path = base_parsed.path.rstrip('/')
+        return get_relative_path(url, base_url)
+    
+    def get_file_tags(self, relative_path, url):
+        """计算文件节点的标签（状态 + 刷新差异）"""
+        tags = ['file', url]
+        if relative_path in self.downloaded_files:
+            tags.append('downloaded')
+        elif relative_path in self.failed_files:
+            tags.append('failed')
         
-        if path.startswith(base_path):
-            path = path[len(base_path):]
-        return path.lstrip('/')
+        if relative_path in self.catalog_diff['new']:
+            tags.append('new')
+        elif relative_path in self.catalog_diff['changed']:
+            tags.append('changed')
+        return tuple(tags)
     
-    def add_to_tree(self, relative_path, url):
-        """添加文件到树形视图"""
+    def ensure_parent_folders(self, relative_path):
+        """确保文件的上级文件夹节点存在，返回父节点ID"""
         parts = relative_path.split('/')
         parent = ''
         
         for i, part in enumerate(parts[:-1]):
             item_id = '/'.join(parts[:i+1])
             if not self.tree.exists(item_id):
-                self.tree.insert(parent, END, item_id, text=part, open=True)
+                node = self.path_trie.get_folder(item_id)
+                size_str = format_folder_size(node) if node else ''
+                self.tree.insert(parent, END, item_id, text=part, values=(size_str, ''), open=True)
+                self.open_folders.add(item_id)
             parent = item_id
+        return parent
+    
+    def add_to_tree(self, relative_path, url):
+        """添加文件到树形视图"""
+        parent = self.ensure_parent_folders(relative_path)
         
         # 添加文件节点
         file_id = relative_path
         if not self.tree.exists(file_id):
-            # 检查状态
-            is_downloaded = relative_path in self.downloaded_files
-            is_failed = relative_path in self.failed_files
-            tags = ['file', url]
-            if is_downloaded:
-                tags.append('downloaded')
-            elif is_failed:
-                tags.append('failed')
-            
             # 直接从url获取文件大小（不再遍历）
             size_str = ''
             if url in self.all_files:
                 size_str = self.all_files[url].get('size', '')
             
-            self.tree.insert(parent, END, file_id, text=parts[-1], values=(size_str, '☐'), tags=tuple(tags))
+            name = relative_path.split('/')[-1]
+            mark = '☑' if relative_path in self.selection else '☐'
+            self.tree.insert(parent, END, file_id, text=name, values=(size_str, mark),
+                             tags=self.get_file_tags(relative_path, url))
+    
+    def add_removed_to_tree(self, relative_path):
+        """添加已从远端删除的文件（仅用于显示，不可选中）"""
+        parent = self.ensure_parent_folders(relative_path)
+        if not self.tree.exists(relative_path):
+            name = relative_path.split('/')[-1]
+            self.tree.insert(parent, END, relative_path, text=name, values=('已删除', ''), tags=('removed',))
     
     def toggle_item(self, event=None):
         """切换选中状态"""
@@ -822,111 +5488,117 @@ class GCBDownloader:
         if 'file' not in tags:
             return
             
-        if item in self.selected_items:
-            self.selected_items.discard(item)
-            self.tree.set(item, 'selected', '☐')
-        else:
-            self.selected_items.add(item)
-            self.tree.set(item, 'selected', '☑')
-        
+        selected = self.selection.toggle(item)
+        self.tree.set(item, 'selected', '☑' if selected else '☐')
         self.update_selected_count()
     
     def update_selected_count(self):
-        """更新选中数量和总大小"""
-        count = len(self.selected_items)
-        total_size_bytes = 0
-        
-        # 构建path到url的映射（只在需要时）
-        if count > 0:
-            # 使用path_to_url缓存加速查找
-            if not hasattr(self, '_path_to_url_cache') or len(self._path_to_url_cache) != len(self.all_files):
-                self._path_to_url_cache = {info['path']: url for url, info in self.all_files.items()}
-            
-            for path in self.selected_items:
-                url = self._path_to_url_cache.get(path)
-                if url and url in self.all_files:
-                    total_size_bytes += self.all_files[url].get('size_bytes', 0)
-        
+        """更新选中数量和总大小（选中模型中维护的累计值）"""
+        count = len(self.selection)
         # 转换为GB，保留一位小数
-        total_size_gb = total_size_bytes / (1024 * 1024 * 1024)
+        total_size_gb = self.selection.total_bytes / (1024 * 1024 * 1024)
         self.selected_count_label.config(text=f"已选择: {count} 个文件 ({total_size_gb:.1f} GB)")
     
     def select_all(self):
-        """全选"""
-        for url, info in self.all_files.items():
-            item = info['path']
-            if self.tree.exists(item):
-                self.selected_items.add(item)
-                self.tree.set(item, 'selected', '☑')
+        """全选（当前筛选结果）"""
+        self.push_selection_marks(self.selection.select(self.get_filtered_paths()))
         self.update_selected_count()
     
     def deselect_all(self):
         """取消全选"""
-        for item in list(self.selected_items):
-            if self.tree.exists(item):
-                self.tree.set(item, 'selected', '☐')
-        self.selected_items.clear()
+        self.push_selection_marks(self.selection.clear())
+        self.update_selected_count()
+    
+    def deselect_filtered(self):
+        """取消选中当前筛选结果"""
+        changed = self.selection.deselect(self.get_filtered_paths())
+        self.push_selection_marks(changed)
         self.update_selected_count()
+        self.log(f"已取消选中 {len(changed)} 个文件")
     
     def exclude_downloaded(self):
         """从已选择的文件中排除已下载的文件"""
-        excluded_count = 0
-        for item in list(self.selected_items):
-            if item in self.downloaded_files:
-                self.selected_items.discard(item)
-                if self.tree.exists(item):
-                    self.tree.set(item, 'selected', '☐')
-                excluded_count += 1
+        changed = self.selection.deselect(self.downloaded_files)
+        self.push_selection_marks(changed)
         
         self.update_selected_count()
-        if excluded_count > 0:
-            self.log(f"已排除 {excluded_count} 个已下载的文件")
+        if changed:
+            self.log(f"已排除 {len(changed)} 个已下载的文件")
         else:
             self.log("没有需要排除的已下载文件")
     
     def invert_selection(self):
-        """反选"""
-        for url, info in self.all_files.items():
-            item = info['path']
-            if self.tree.exists(item):
-                if item in self.selected_items:
-                    self.selected_items.discard(item)
-                    self.tree.set(item, 'selected', '☐')
-                else:
-                    self.selected_items.add(item)
-                    self.tree.set(item, 'selected', '☑')
+        """反选（当前筛选结果）"""
+        self.push_selection_marks(self.selection.invert(self.get_filtered_paths()))
         self.update_selected_count()
     
-    def apply_filter(self, event=None):
-        """应用筛选"""
-        filter_text = self.filter_entry.get().lower()
+    def matches_filter(self, path):
+        """检查文件是否符合当前筛选条件"""
+        # 检查是否只显示未下载
+        if not self.show_all_files and path in self.downloaded_files:
+            return False
+        
+        # 检查文件类型筛选
         ext_filter = self.ext_var.get()
+        if ext_filter != '全部' and not path.lower().endswith(ext_filter):
+            return False
+            
+        # 检查文本筛选
+        filter_text = self.filter_entry.get().lower()
+        if filter_text:
+            mode = self.search_modes[self.search_mode_var.get()]
+            if mode is None:
+                return filter_text in path.lower()
+            return self.nc_index.matches(path, filter_text, mode)
+        return True
+    
+    def on_search_mode_change(self, event=None):
+        """切换筛选方式，按变量或属性筛选时先增量更新NetCDF索引"""
+        self.refresh_nc_index()
+        self.apply_filter()
+    
+    def refresh_nc_index(self):
+        """后台增量更新已下载NetCDF文件的索引（只读取文件头），完成后刷新筛选结果"""
+        if self.nc_indexing or self.search_modes[self.search_mode_var.get()] is None:
+            return
+        self.nc_indexing = True
+        save_dir = self.save_dir_entry.get()
+        paths = list(self.downloaded_files)
         
-        # 清空树并重新添加匹配项
-        self.tree.delete(*self.tree.get_children())
+        def update():
+            try:
+                self.nc_index.load()
+                stats = self.nc_index.update(save_dir, paths)
+                changed = stats['indexed'] + stats['failed'] + stats['removed']
+                message = (f"NetCDF索引已更新: 读取 {stats['indexed']} 个，未变化 {stats['unchanged']} 个，"
+                           f"移除 {stats['removed']} 个，无法读取 {stats['failed']} 个")
+                self.root.after(0, lambda: self.log(message, logging.INFO if changed else logging.DEBUG))
+                self.root.after(0, self.apply_filter)
+            except Exception as e:
+                self.root.after(0, lambda e=e: self.log(f"更新NetCDF索引失败: {e}", logging.ERROR))
+            finally:
+                self.nc_indexing = False
+        
+        threading.Thread(target=update, daemon=True).start()
+    
+    def apply_filter(self, event=None):
+        """应用筛选"""
+        # 清空树并重新添加匹配项（勾选标记在插入时根据选中模型设置）
+        self.clear_tree()
         
         displayed_count = 0
         for url, info in self.all_files.items():
             path = info['path']
-            
-            # 检查是否只显示未下载
-            if not self.show_all_files and path in self.downloaded_files:
-                continue
-            
-            # 检查文件类型筛选
-            if ext_filter != '全部' and not path.lower().endswith(ext_filter):
-                continue
-                
-            # 检查文本筛选
-            if filter_text and filter_text not in path.lower():
+            if not self.matches_filter(path):
                 continue
             
             self.add_to_tree(path, url)
             displayed_count += 1
-            
-            # 恢复选中状态
-            if path in self.selected_items and self.tree.exists(path):
-                self.tree.set(path, 'selected', '☑')
+        
+        # 后台刷新中被删除的文件继续显示，直到下一次完整扫描或加载缓存
+        for path in self.catalog_diff['removed']:
+            if self.matches_filter(path):
+                self.add_removed_to_tree(path)
         
         # 更新显示的文件数量
         if self.show_all_files:
@@ -936,260 +5608,1054 @@ class GCBDownloader:
     
     def start_download(self):
         """开始下载"""
-        if not self.selected_items:
+        if not self.selection:
             messagebox.showwarning("警告", "请先选择要下载的文件！")
             return
-            
+        
+        download_list = [(url, info['path']) for url, info in self.all_files.items() if info['path'] in self.selection]
+        sizes = {info['path']: info.get('size_bytes') or 0 for info in self.all_files.values() if info['path'] in self.selection}
+        num_parallel = int(self.parallel_var.get())
+        save_dir = self.save_dir_entry.get()
+        try:
+            placement = self.get_placement(save_dir)
+        except (OSError, ValueError) as e:
+            self.log(f"存储卷配置无效: {e}", logging.ERROR)
+            return
+        pending = {path: size for path, size in sizes.items() if not find_stored_file(os.path.join(save_dir, path))}
+        if not self.confirm_free_space(save_dir, pending, placement, "开始下载"):
+            return
+        try:
+            self.queue_state.begin(download_list, save_dir, num_parallel, sizes)
+        except Exception as e:
+            self.log(f"保存下载队列失败: {e}", logging.ERROR)
+        self.run_download(download_list, save_dir, sizes)
+    
+    def run_download(self, download_list, save_dir, sizes, paused=()):
+        """在后台线程中下载文件列表；paused为提交后立即暂停的文件（继续上次的批次时）"""
         self.is_downloading = True
-        self.stop_download = False
         self.download_btn.config(state=DISABLED)
+        self.sync_btn.config(state=DISABLED)
         self.stop_btn.config(state=NORMAL)
+        self.pause_queue_btn.config(state=NORMAL)
         self.parallel_combo.config(state=DISABLED)
+        self.apply_post_steps()
         
         # 确保进度条数量正确
         num_parallel = int(self.parallel_var.get())
         self.create_task_progress_bars(num_parallel)
         
-        thread = threading.Thread(target=self.download_files_parallel, daemon=True)
+        # 镜像池在主线程中准备好，下载线程只读取
+        self.engine.mirror_pool = self.get_mirror_pool()
+        self.engine.set_max_workers(num_parallel)
+        
+        # 目录中已知的ETag（在主线程中读取文件列表），下载前按它查找可复用的文件
+        paths = {path for _, path in download_list}
+        etags = {info['path']: info['etag'] for info in self.all_files.values() if info.get('etag') and info['path'] in paths}
+        thread = threading.Thread(target=self.download_files_parallel, args=(download_list, save_dir, num_parallel, sizes),
+                                  kwargs={'paused': paused, 'etags': etags}, daemon=True)
         thread.start()
     
+    def offer_queue_resume(self):
+        """启动时检查上次未完成的下载批次（程序崩溃、断电或关闭窗口时中断），询问是否从中断处继续"""
+        try:
+            batch = self.queue_state.load()
+        except Exception as e:
+            self.log(f"读取下载队列失败: {e}", logging.ERROR)
+            return
+        if batch is None or self.is_downloading:
+            return
+        summary = self.queue_state.summary(batch)
+        counts = summary['counts']
+        finished = sum(counts.get(state, 0) for state in PersistentQueue.finished_states)
+        remaining = summary['total'] - finished
+        message = (f"上次的下载批次未完成：共 {summary['total']} 个文件，已结束 {finished} 个，剩余 {remaining} 个"
+                   f"（已下载 {format_size(summary['partial_bytes'])}）。\n"
+                   f"保存目录: {batch['save_dir']}\n\n是否从中断处继续下载？")
+        if not messagebox.askyesno("继续下载", message):
+            self.queue_state.discard()
+            self.log("已放弃上次未完成的下载批次")
+            return
+        items, paused = self.queue_state.resume(batch)
+        sizes = {path: entry['size'] for path, entry in batch['files'].items()}
+        self.parallel_var.set(str(batch['parallelism']))
+        self.save_dir_entry.delete(0, END)
+        self.save_dir_entry.insert(0, batch['save_dir'])
+        self.log(f"继续上次的下载批次: 剩余 {len(items)} 个文件（其中 {len(paused)} 个已暂停）")
+        self.run_download(items, batch['save_dir'], sizes, paused)
+    
+    def start_sync(self):
+        """同步：对比远程文件和下载目录中的清单，只下载新增或变化的文件"""
+        if not self.all_files:
+            messagebox.showwarning("警告", "请先扫描或加载缓存！")
+            return
+        
+        self.is_downloading = True
+        self.download_btn.config(state=DISABLED)
+        self.sync_btn.config(state=DISABLED)
+        self.stop_btn.config(state=NORMAL)
+        self.pause_queue_btn.config(state=NORMAL)
+        self.parallel_combo.config(state=DISABLED)
+        self.apply_post_steps()
+        
+        num_parallel = int(self.parallel_var.get())
+        self.create_task_progress_bars(num_parallel)
+        save_dir = self.save_dir_entry.get()
+        try:
+            placement = self.get_placement(save_dir)
+        except (OSError, ValueError) as e:
+            self.log(f"存储卷配置无效: {e}", logging.ERROR)
+            self.reset_download_buttons()
+            return
+        runner = SyncRunner(self.engine, self.all_files, save_dir, prune=self.prune_var.get(),
+                            log=lambda message: self.root.after(0, lambda: self.log(message)), placement=placement)
+        self.engine.mirror_pool = self.get_mirror_pool()
+        self.engine.set_max_workers(num_parallel)
+        self.log(f"开始同步到: {save_dir}")
+        self.status_var.set("正在对比远程文件...")
+        
+        def sync():
+            try:
+                runner.plan()
+            except Exception as e:
+                self.root.after(0, lambda e=e: self.log(f"同步对比失败: {e}", logging.ERROR))
+                self.root.after(0, self.reset_download_buttons)
+                return
+            self.root.after(0, lambda: self.log(f"对比完成: {runner.describe()}"))
+            self.root.after(0, lambda: confirm(runner))
+        
+        def confirm(runner):
+            # 需要下载的大小在对比后才知道，在主线程中检查剩余空间并询问
+            sizes = {path: runner.remote[path][1]['size_bytes'] for _, path in runner.download_items()}
+            if not self.confirm_free_space(save_dir, sizes, placement, "开始同步"):
+                self.log("已取消同步")
+                self.reset_download_buttons()
+                return
+            threading.Thread(target=self.download_files_parallel, args=(runner.download_items(), save_dir, num_parallel),
+                             kwargs={'sync': runner}, daemon=True).start()
+        
+        threading.Thread(target=sync, daemon=True).start()
+    
+    def reset_download_buttons(self):
+        """下载或同步结束后恢复按钮状态"""
+        self.download_btn.config(state=NORMAL)
+        self.sync_btn.config(state=NORMAL)
+        self.stop_btn.config(state=DISABLED)
+        if self.engine.paused:
+            self.engine.resume_all()
+        self.pause_queue_btn.config(text="暂停队列", state=DISABLED)
+        self.parallel_combo.config(state="readonly")
+        self.is_downloading = False
+    
     def stop_download_func(self):
         """停止下载"""
-        self.stop_download = True
+        if self.current_job:
+            self.engine.cancel(self.current_job.id)
         self.log("正在停止下载...")
     
-    def download_single_file(self, task_id, url, relative_path, save_dir, stats):
-        """下载单个文件（供线程池使用）- 带重试机制"""
-        headers = {"User-Agent": "Mozilla/5.0"}
-        file_path = os.path.join(save_dir, relative_path)
-        file_dir = os.path.dirname(file_path)
-        file_name = os.path.basename(relative_path)
+    def get_http_session(self):
+        """获取共享的HTTP会话（与下载引擎共用连接池）"""
+        return self.engine.get_session()
+    
+    def on_download_event(self, event):
+        """下载事件回调（工作线程）：直接写入结构化日志，再转到主线程更新界面"""
+        log_download_event(self.logger, event)
+        self.root.after(0, lambda: self.handle_download_event(event))
+    
+    def on_queued_download_event(self, event):
+        """界面下载批次的事件回调：先更新持久化队列（同步批次不记录）"""
+        self.queue_state.on_event(event)
+        self.on_download_event(event)
+    
+    def handle_download_event(self, event):
+        """根据下载事件更新任务进度条和日志"""
+        kind = event['type']
+        if kind == 'log':
+            self.show_log(event['message'])
+            return
+        
+        if kind in ('task_processed', 'task_process_failed'):
+            level = logging.INFO if kind == 'task_processed' else logging.ERROR
+            self.show_log(f"已处理 {event['path']}: {describe_post_results(event['results'])}", level)
+            return
         
-        # 获取对应的进度条组件
-        if task_id < len(self.task_widgets):
-            _, progress_var, _, name_label, detail_label, speed_label = self.task_widgets[task_id]
+        slot = event.get('slot')
+        if kind in ('task_paused', 'task_resumed', 'task_cancelled') and not event.get('in_place'):
+            verb = {'task_paused': "已暂停", 'task_resumed': "已继续", 'task_cancelled': "已取消"}[kind]
+            self.show_log(f"{verb}: {event['path']}")
+        if kind == 'task_resumed':
+            # 分段下载原地暂停后继续
+            for resumed_slot, path in self.slot_paths.items():
+                if path == event['path'] and resumed_slot < len(self.task_buttons):
+                    self.task_buttons[resumed_slot][0].config(text="暂停")
+                    self.task_widgets[resumed_slot][4].config(text="继续下载...")
+            return
+        if slot is None or slot >= len(self.task_widgets):
+            return
+        relative_path = event['path']
+        task_name = f"[任务{slot+1}]"
+        if kind in ('task_done', 'task_linked', 'task_error') and self.slot_paths.get(slot) != relative_path:
+            # 落盘和改名在后台完成，槽位可能已在下载下一个文件：只记录结果，不改动槽位的显示
+            if kind == 'task_linked':
+                self.show_log(f"{task_name} 与已下载的文件相同，已{LINK_METHOD_NAMES[event['method']]}: "
+                              f"{relative_path} <- {event['source']}")
+            if kind == 'task_error':
+                self.show_log(f"{task_name} 下载出错: {relative_path}: {event['error']}", logging.ERROR)
+                self.on_file_failed(relative_path)
+            else:
+                self.on_file_downloaded(relative_path)
+            return
+        _, progress_var, _, name_label, detail_label, speed_label = self.task_widgets[slot]
+        pause_btn, cancel_btn = self.task_buttons[slot]
+        
+        if kind == 'task_started':
+            self.slot_paths[slot] = relative_path
+            pause_btn.config(text="暂停", state=NORMAL)
+            cancel_btn.config(state=NORMAL)
+            name_label.config(text=os.path.basename(relative_path))
+            progress_var.set(0)
+            detail_label.config(text="正在连接...")
+            speed_label.config(text="")
+            self.show_log(f"{task_name} 下载: {relative_path}", logging.DEBUG)
+        elif kind == 'task_paused' and event.get('in_place'):
+            pause_btn.config(text="继续")
+            detail_label.config(text="已暂停")
+            speed_label.config(text="")
+            self.show_log(f"{task_name} 已暂停: {relative_path}")
+        elif kind == 'task_skipped':
+            self.show_log(f"{task_name} 文件已存在，跳过")
+            detail_label.config(text="已存在，跳过")
+            progress_var.set(100)
+        elif kind == 'task_deferred':
+            detail_label.config(text="其它节点下载中，稍后重试")
+            self.show_log(f"{task_name} 其它节点正在下载，稍后重试: {relative_path}")
+        elif kind == 'task_retry':
+            detail_label.config(text=f"重试 {event['attempt']}/{event['max_attempts']}...")
+            self.show_log(f"{task_name} {event['wait']} 秒后第 {event['attempt']} 次重试...", logging.WARNING)
+        elif kind == 'progress':
+            downloaded, total, speed = event['downloaded'], event['total'], event['speed']
+            total_str = format_size(total) if total > 0 else "未知"
+            if total > 0:
+                progress_var.set(downloaded / total * 100)
+            detail_label.config(text=f"{format_size(downloaded)} / {total_str}")
+            if downloaded:
+                eta = format_eta((total - downloaded) / speed) if speed > 0 and total > 0 else "..."
+                speed_label.config(text=f"{format_speed(speed)} | 剩余: {eta}")
+        elif kind == 'task_done':
+            progress_var.set(100)
+            detail_label.config(text="完成")
+            speed_label.config(text="")
+            self.on_file_downloaded(relative_path)
+        elif kind == 'task_linked':
+            progress_var.set(100)
+            detail_label.config(text="已复用已有文件")
+            speed_label.config(text="")
+            self.show_log(f"{task_name} 与已下载的文件相同，已{LINK_METHOD_NAMES[event['method']]}，"
+                          f"未重新下载: {relative_path} <- {event['source']}")
+            self.on_file_downloaded(relative_path)
+        elif kind == 'task_failed':
+            detail_label.config(text=f"失败: {event['error'][:30]}")
+            speed_label.config(text="")
+            self.show_log(f"{task_name} 下载失败(重试{event['retries']}次): {relative_path}", logging.ERROR)
+            self.on_file_failed(relative_path)
+        elif kind == 'task_error':
+            detail_label.config(text=f"错误: {event['error'][:30]}")
+            self.show_log(f"{task_name} 下载出错: {event['error']}", logging.ERROR)
+            self.on_file_failed(relative_path)
+        elif kind == 'task_paused':
+            detail_label.config(text="已暂停（保留已下载部分）")
+            speed_label.config(text="")
+        elif kind == 'task_cancelled':
+            detail_label.config(text="已取消")
+            speed_label.config(text="")
+        
+        # 文件结束或暂停后释放槽位的控制按钮
+        if kind in ('task_skipped', 'task_done', 'task_failed', 'task_error', 'task_cancelled') or (
+                kind == 'task_paused' and not event.get('in_place')):
+            if self.slot_paths.get(slot) == relative_path:
+                del self.slot_paths[slot]
+                pause_btn.config(text="暂停", state=DISABLED)
+                cancel_btn.config(state=DISABLED)
+    
+    def apply_post_steps(self):
+        """按界面勾选设置下载后处理步骤、去重和压缩选项"""
+        steps = []
+        if self.extract_var.get():
+            steps.append('extract')
+        if self.checksum_var.get():
+            steps.append('checksum')
+        self.engine.post_processor.steps = steps
+        self.engine.dedupe = self.dedupe_index if self.dedupe_var.get() else None
+        self.engine.compress_transfer = self.compress_transfer_var.get()
+        self.engine.store_compressed = self.store_gz_var.get()
+    
+    def toggle_task_pause(self, slot):
+        """暂停或继续某个任务槽位上正在下载的文件"""
+        path = self.slot_paths.get(slot)
+        if not self.current_job or path is None:
+            return
+        pause_btn = self.task_buttons[slot][0]
+        if pause_btn.cget('text') == "继续":
+            self.engine.resume_task(self.current_job.id, path)
         else:
-            return False
+            self.engine.pause_task(self.current_job.id, path)
+    
+    def cancel_task(self, slot):
+        """取消某个任务槽位上正在下载的文件"""
+        path = self.slot_paths.get(slot)
+        if self.current_job and path is not None:
+            self.engine.cancel_task(self.current_job.id, path)
+    
+    def toggle_queue_pause(self):
+        """暂停或继续整个下载队列（连接池保持不变）"""
+        if self.engine.paused:
+            self.engine.resume_all()
+            self.pause_queue_btn.config(text="暂停队列")
+            self.log("下载队列已继续")
+        else:
+            self.engine.pause_all()
+            self.pause_queue_btn.config(text="继续队列")
+            self.log("下载队列已暂停，正在下载的文件保留已下载部分")
+    
+    def prioritize_focused(self):
+        """把右键选中的文件或文件夹下的文件移到下载队列最前"""
+        if not self.current_job:
+            messagebox.showinfo("提示", "当前没有进行中的下载")
+            return
+        files = self.get_focused_files()
+        if files is None:
+            return
+        moved = self.engine.prioritize(self.current_job.id, files)
+        self.log(f"已将 {moved} 个文件移到队列最前")
+    
+    def control_focused(self, action, verb):
+        """对右键选中的文件或文件夹下的文件执行暂停/继续/取消"""
+        if not self.current_job:
+            messagebox.showinfo("提示", "当前没有进行中的下载")
+            return
+        files = self.get_focused_files()
+        if files is None:
+            return
+        count = sum(1 for path in files if action(self.current_job.id, path))
+        self.log(f"已{verb} {count} 个文件")
+    
+    def preview_focused(self):
+        """通过HTTP Range请求预览右键选中的文件（只读取文件头部，不完整下载）"""
+        path = self.tree.focus()
+        if not path or path not in self.path_trie.files:
+            messagebox.showwarning("警告", "请先选择一个文件！")
+            return
+        if not can_preview(path):
+            messagebox.showinfo("提示", "只支持预览 CSV/TXT、XLSX、ZIP 和 NetCDF 文件")
+            return
+        url = self.path_to_url.get(path)
+        if not url:
+            return
+        info = self.all_files.get(url, {})
+        etag = info.get('etag') or info.get('last_modified')
+        self.preview_info_var.set(f"正在预览: {path} ...")
+        self.side_notebook.select(self.preview_frame)
         
-        try:
-            if file_dir and not os.path.exists(file_dir):
-                os.makedirs(file_dir, exist_ok=True)
-            
-            # 更新UI - 文件名
-            self.root.after(0, lambda: name_label.config(text=f"{file_name}"))
-            self.root.after(0, lambda: progress_var.set(0))
-            self.root.after(0, lambda: detail_label.config(text="正在连接..."))
-            self.root.after(0, lambda: speed_label.config(text=""))
-            
-            self.root.after(0, lambda rp=relative_path: self.log(f"[任务{task_id+1}] 下载: {rp}"))
-            
-            if os.path.exists(file_path):
-                self.root.after(0, lambda: self.log(f"[任务{task_id+1}] 文件已存在，跳过"))
-                self.root.after(0, lambda: detail_label.config(text="已存在，跳过"))
-                self.root.after(0, lambda: progress_var.set(100))
-                with stats['lock']:
-                    stats['skipped'] += 1
-                return True
-            
-            # 重试机制
-            last_error = None
-            for retry in range(self.max_retries):
-                try:
-                    if self.stop_download:
-                        raise Exception("用户取消")
-                    
-                    if retry > 0:
-                        self.root.after(0, lambda r=retry: detail_label.config(text=f"重试 {r}/{self.max_retries-1}..."))
-                        self.root.after(0, lambda r=retry: self.log(f"[任务{task_id+1}] 第 {r} 次重试..."))
-                        time.sleep(self.retry_delay)
-                    
-                    with requests.get(url, headers=headers, stream=True, timeout=120) as r:
-                        r.raise_for_status()
-                        total_size = int(r.headers.get('content-length', 0))
-                        downloaded = 0
-                        start_time = time.time()
-                        last_update_time = start_time
-                        last_downloaded = 0
-                        
-                        size_str = format_size(total_size) if total_size > 0 else "未知"
-                        self.root.after(0, lambda s=size_str: detail_label.config(text=f"0 B / {s}"))
-                        
-                        with open(file_path, 'wb') as f:
-                            for chunk in r.iter_content(chunk_size=65536):
-                                if self.stop_download:
-                                    raise Exception("用户取消")
-                                size = f.write(chunk)
-                                downloaded += size
-                                
-                                current_time = time.time()
-                                if current_time - last_update_time >= 0.3:
-                                    elapsed = current_time - last_update_time
-                                    speed = (downloaded - last_downloaded) / elapsed if elapsed > 0 else 0
-                                    last_update_time = current_time
-                                    last_downloaded = downloaded
-                                    
-                                    if total_size > 0:
-                                        file_progress = (downloaded / total_size) * 100
-                                        self.root.after(0, lambda p=file_progress: progress_var.set(p))
-                                    
-                                    downloaded_str = format_size(downloaded)
-                                    total_str = format_size(total_size) if total_size > 0 else "未知"
-                                    speed_str = format_speed(speed)
-                                    
-                                    if speed > 0 and total_size > 0:
-                                        remaining = (total_size - downloaded) / speed
-                                        if remaining < 60:
-                                            eta = f"{remaining:.0f}秒"
-                                        elif remaining < 3600:
-                                            eta = f"{remaining/60:.1f}分"
-                                        else:
-                                            eta = f"{remaining/3600:.1f}时"
-                                    else:
-                                        eta = "..."
-                                    
-                                    self.root.after(0, lambda d=downloaded_str, t=total_str: 
-                                                   detail_label.config(text=f"{d} / {t}"))
-                                    self.root.after(0, lambda s=speed_str, e=eta: 
-                                                   speed_label.config(text=f"{s} | 剩余: {e}"))
-                        
-                        # 下载成功
-                        self.root.after(0, lambda: progress_var.set(100))
-                        self.root.after(0, lambda: detail_label.config(text="完成"))
-                        self.root.after(0, lambda: speed_label.config(text=""))
-                        self.root.after(0, lambda rp=relative_path: self.mark_as_downloaded(rp))
-                        with stats['lock']:
-                            stats['completed'] += 1
-                        return True
-                        
-                except Exception as e:
-                    last_error = e
-                    if str(e) == "用户取消":
-                        raise
-                    # 删除可能不完整的文件
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-                    continue
-            
-            # 所有重试都失败
-            error_msg = str(last_error)[:30] if last_error else "未知错误"
-            self.root.after(0, lambda e=error_msg: detail_label.config(text=f"失败: {e}"))
-            self.root.after(0, lambda: speed_label.config(text=""))
-            self.root.after(0, lambda rp=relative_path: self.log(f"[任务{task_id+1}] 下载失败(重试{self.max_retries}次): {rp}"))
-            self.root.after(0, lambda rp=relative_path: self.mark_as_failed(rp))
-            with stats['lock']:
-                stats['failed'] += 1
-            return False
-                    
-        except Exception as e:
-            if str(e) != "用户取消":
-                error_msg = str(e)[:30]
-                self.root.after(0, lambda e=error_msg: detail_label.config(text=f"错误: {e}"))
-                self.root.after(0, lambda e=e: self.log(f"[任务{task_id+1}] 下载出错: {e}"))
-                self.root.after(0, lambda rp=relative_path: self.mark_as_failed(rp))
-                with stats['lock']:
-                    stats['failed'] += 1
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
-            return False
+        def worker():
+            try:
+                preview, cached = get_preview(self.get_http_session(), self.preview_cache, url, etag)
+                self.root.after(0, lambda: self.show_preview(path, preview, cached))
+            except Exception as e:
+                self.root.after(0, lambda error=e: self.show_preview(path, None, False, error))
+        
+        threading.Thread(target=worker, daemon=True).start()
     
-    def download_files_parallel(self):
-        """并行下载文件"""
-        save_dir = self.save_dir_entry.get()
+    def show_preview(self, path, preview, cached, error=None):
+        """在预览页显示预览结果"""
+        if error is not None:
+            self.preview_info_var.set(f"预览失败: {path}")
+            self.log(f"预览失败: {path} - {error}", logging.ERROR)
+            return
+        if cached:
+            info = f"{path}（来自缓存）"
+        else:
+            size = format_size(preview['size']) if preview.get('size') else "未知大小"
+            info = (f"{path}  共 {size}，读取 {format_size(preview['fetched'])} / "
+                    f"{preview['requests']} 次请求，耗时 {preview['elapsed']:.1f} 秒")
+        self.preview_info_var.set(info)
+        self.preview_text.config(state=NORMAL)
+        self.preview_text.delete('1.0', END)
+        self.preview_text.insert(END, format_preview(preview))
+        self.preview_text.config(state=DISABLED)
+        self.side_notebook.select(self.preview_frame)
+    
+    def update_overall_progress(self, job):
+        """按字节刷新总体进度、总速度和整个批次的剩余时间（主线程每0.5秒调用，批次结束后停止）"""
+        if job.done.is_set():
+            return
+        progress = job.progress.snapshot()
+        stats = dict(job.stats)
+        self.progress_var.set(progress['fraction'] * 100)
+        total = format_size(progress['total_bytes']) if progress['total_bytes'] else "未知"
+        eta = format_eta(progress['eta']) if progress['eta'] is not None else "..."
+        # 磁盘跟不上网络时显示积压在写入缓冲区中的数据量，以及正在进行下载后处理的文件数
+        buffered = self.engine.writer_pool.snapshot()['buffered']
+        extra = f" | 待写入: {format_size(buffered)}" if buffered >= 1024 * 1024 else ""
+        if job.post_tasks:
+            extra += f" | 处理中: {len(job.post_tasks)}"
+        self.overall_progress_label.config(
+            text=f"进度: {progress['files_done']}/{progress['files_total']} | 完成: {stats['completed']} | "
+                 f"跳过: {stats['skipped']} | 失败: {stats['failed']}\n"
+                 f"{format_size(progress['done_bytes'])} / {total} | {format_speed(progress['throughput'])} | 剩余: {eta}{extra}")
+        self.root.after(500, lambda: self.update_overall_progress(job))
+    
+    def download_files_parallel(self, download_list, save_dir, num_parallel, sizes=None, sync=None, paused=(), etags=None):
+        """并行下载文件（提交给下载引擎，后台线程等待完成）；sync为SyncRunner时按同步方式提交，paused为提交后暂停的文件"""
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
         
-        # 构建下载列表
-        download_list = []
-        for url, info in self.all_files.items():
-            if info['path'] in self.selected_items:
-                download_list.append((url, info['path']))
-        
-        total_files = len(download_list)
-        num_parallel = int(self.parallel_var.get())
-        
-        # 统计信息（线程安全）
-        stats = {
-            'completed': 0,
-            'skipped': 0,
-            'failed': 0,
-            'lock': threading.Lock()
-        }
+        # 配置了备用镜像且尚未测速时，先测速再分配下载
+        pool = self.engine.mirror_pool
+        if download_list and len(pool.mirrors) > 1 and all(m.throughput is None for m in pool.mirrors):
+            self.root.after(0, lambda: self.status_var.set("正在测速镜像..."))
+            self.probe_mirrors(pool, download_list[0][0])
         
-        # 任务队列
-        task_queue = queue.Queue()
-        for item in download_list:
-            task_queue.put(item)
-        
-        # 更新总体进度的函数
-        def update_overall_progress():
-            while not self.stop_download:
-                with stats['lock']:
-                    done = stats['completed'] + stats['skipped'] + stats['failed']
-                progress = (done / total_files) * 100 if total_files > 0 else 0
-                self.root.after(0, lambda p=progress: self.progress_var.set(p))
-                self.root.after(0, lambda d=done, t=total_files, c=stats['completed'], s=stats['skipped'], f=stats['failed']: 
-                               self.overall_progress_label.config(text=f"进度: {d}/{t} | 完成: {c} | 跳过: {s} | 失败: {f}"))
-                if done >= total_files:
-                    break
-                time.sleep(0.5)
+        disk_before = self.engine.writer_pool.snapshot()
+        if sync is not None:
+            job = sync.start(num_parallel, listener=self.on_download_event)
+        else:
+            try:
+                placement = self.get_placement(save_dir)
+            except (OSError, ValueError) as e:
+                self.root.after(0, lambda e=e: self.log(f"存储卷配置无效，文件保存在下载目录中: {e}", logging.ERROR))
+                placement = None
+            job = self.engine.submit(download_list, save_dir, num_parallel, description="界面下载",
+                                     listener=self.on_queued_download_event, sizes=sizes, placement=placement, etags=etags)
+            for relative_path in paused:
+                self.engine.pause_task(job.id, relative_path)
+        self.current_job = job
         
-        # 启动进度更新线程
-        progress_thread = threading.Thread(target=update_overall_progress, daemon=True)
-        progress_thread.start()
+        # 总体进度由主线程定时刷新，这里只等待批次结束
+        if job is not None:
+            self.root.after(0, lambda: self.update_overall_progress(job))
+            job.done.wait()
         
-        # 工作线程函数
-        def worker(task_id):
-            while not self.stop_download:
-                try:
-                    url, relative_path = task_queue.get_nowait()
-                except queue.Empty:
-                    break
-                
-                self.download_single_file(task_id, url, relative_path, save_dir, stats)
-                task_queue.task_done()
-            
-            # 任务完成，清空显示
-            if task_id < len(self.task_widgets):
-                _, progress_var, _, name_label, detail_label, speed_label = self.task_widgets[task_id]
-                self.root.after(0, lambda: name_label.config(text="已完成"))
-                self.root.after(0, lambda: detail_label.config(text=""))
-                self.root.after(0, lambda: speed_label.config(text=""))
-        
-        # 启动工作线程
-        threads = []
-        for i in range(num_parallel):
-            t = threading.Thread(target=worker, args=(i,), daemon=True)
-            t.start()
-            threads.append(t)
-        
-        # 等待所有线程完成
-        for t in threads:
-            t.join()
-        
-        # 等待进度线程
-        progress_thread.join(timeout=1)
+        # 任务完成，清空显示
+        for _, progress_var, _, name_label, detail_label, speed_label in self.task_widgets:
+            self.root.after(0, lambda l=name_label: l.config(text="已完成"))
+            self.root.after(0, lambda l=detail_label: l.config(text=""))
+            self.root.after(0, lambda l=speed_label: l.config(text=""))
         
         # 完成
+        stats = job.stats if job is not None else {'completed': 0, 'skipped': 0, 'failed': 0}
         self.root.after(0, lambda: self.progress_var.set(100))
-        self.root.after(0, lambda c=stats['completed'], s=stats['skipped'], f=stats['failed']: 
-                       self.log(f"下载任务完成！成功: {c}, 跳过: {s}, 失败: {f}"))
+        disk = self.engine.writer_pool.snapshot()
+        if disk['stall_seconds'] > disk_before['stall_seconds']:
+            # 磁盘写入慢于网络接收，下载曾因写入缓冲区已满而等待
+            written = disk['written'] - disk_before['written']
+            write_seconds = disk['write_seconds'] - disk_before['write_seconds']
+            self.root.after(0, lambda m=(f"磁盘写入较慢: 平均 {format_speed(written / write_seconds if write_seconds else 0)}，"
+                                         f"下载等待磁盘 {disk['stalls'] - disk_before['stalls']} 次，"
+                                         f"共 {disk['stall_seconds'] - disk_before['stall_seconds']:.1f} 秒，"
+                                         f"缓冲峰值 {format_size(disk['peak_buffered'])}"): self.log(m, logging.WARNING))
+        if sync is not None:
+            try:
+                summary = sync.finish()['summary']
+                self.root.after(0, lambda m=summary: self.log(
+                    f"同步完成！下载: {m['downloaded']}, 失败: {m['failed']}, 删除: {m['pruned']}, "
+                    f"未变化: {m['unchanged'] + m['adopted']}, 用时 {time.time() - sync.started_at:.1f} 秒"))
+                self.root.after(0, lambda: self.log(f"变更报告: {sync.report_file}"))
+            except Exception as e:
+                self.root.after(0, lambda e=e: self.log(f"保存同步清单失败: {e}", logging.ERROR))
+            self.root.after(0, self.refresh_record_copies)
+            self.root.after(0, lambda: self.status_var.set("同步完成"))
+        else:
+            self.root.after(0, lambda c=stats['completed'], s=stats['skipped'], f=stats['failed']: 
+                           self.log(f"下载任务完成！成功: {c}, 跳过: {s}, 失败: {f}"))
+        if stats.get('processed') or stats.get('process_failed'):
+            self.root.after(0, lambda p=stats['processed'], f=stats['process_failed']:
+                           self.log(f"下载后处理完成！成功: {p}, 失败: {f}"))
+        if stats.get('linked') or stats.get('disk_saved'):
+            self.root.after(0, lambda m=(f"去重: {stats['linked']} 个文件直接复用已有文件，"
+                                         f"节省下载 {format_size(stats['saved_bytes'])}，"
+                                         f"节省磁盘 {format_size(stats['disk_saved'])}"): self.log(m))
+        if stats.get('transfer_saved') or stats.get('storage_saved'):
+            self.root.after(0, lambda m=(f"压缩: 传输节省 {format_size(stats['transfer_saved'])}，"
+                                         f"压缩保存节省磁盘 {format_size(stats['storage_saved'])}"): self.log(m))
         self.root.after(0, lambda c=stats['completed'], s=stats['skipped'], f=stats['failed']: 
                        self.overall_progress_label.config(text=f"完成! 成功: {c} | 跳过: {s} | 失败: {f}"))
-        self.root.after(0, lambda: self.download_btn.config(state=NORMAL))
-        self.root.after(0, lambda: self.stop_btn.config(state=DISABLED))
-        self.root.after(0, lambda: self.parallel_combo.config(state="readonly"))
-        self.is_downloading = False
+        if sync is None:
+            self.root.after(0, self.refresh_record_copies)
+        self.root.after(0, self.reset_download_buttons)
+        self.root.after(0, self.refresh_nc_index)
+        self.current_job = None
+
+class GCBService:
+    """后台服务模式 - 无界面运行扫描和下载引擎，通过本地HTTP/JSON接口控制"""
+    
+    def __init__(self, host='127.0.0.1', port=8765, max_workers=5, base_url=None):
+        self.host = host
+        self.port = port
+        self.base_url = base_url
+        self.cache_file = "gcb_file_cache.bin"  # 缓存文件名（与界面共用）
+        self.legacy_cache_file = "gcb_file_cache.json"  # 旧版JSON缓存
+        self.mirror_file = "gcb_mirrors.json"  # 镜像源配置文件
+        self.volume_file = "gcb_volumes.json"  # 多卷存放配置文件（与界面共用）
+        self.driver_cache_file = "gcb_driver_cache.json"  # ChromeDriver路径缓存文件
+        self.driver_check_interval = 24 * 3600  # ChromeDriver版本重新校验间隔（秒）
+        self.catalog = {}  # {url: info}
+        self.catalog_lock = threading.Lock()
+        self.scan_state = {'running': False, 'status': '', 'error': None, 'finished_at': None}
+        self.sync_state = {'running': False, 'status': '', 'job': None, 'report': None, 'summary': None}
+        
+        self.logger = setup_structured_log("gcb_log.jsonl")
+        self.records = DownloadRecords("gcb_downloaded_record.json", "gcb_failed_record.json")
+        self.records.load_downloaded()
+        self.records.load_failed()
+        self.engine = DownloadEngine(self.records, max_workers=max_workers)
+        self.engine.dedupe = DedupeIndex("gcb_dedupe_index.json")
+        self.nc_index = NetCDFIndex("gcb_nc_index.json")
+        self.index_lock = threading.Lock()
+        self.preview_cache = PreviewCache("gcb_preview_cache.json")
+        self.mirror_urls = []
+        if os.path.exists(self.mirror_file):
+            with open(self.mirror_file, 'r', encoding='utf-8') as f:
+                self.mirror_urls = json.load(f).get('mirrors', [])
+        self.volume_config = {'volumes': [], 'policy': 'free_space', 'pins': {}}
+        if os.path.exists(self.volume_file):
+            with open(self.volume_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.volume_config = {key: data.get(key, default) for key, default in
+                                  (('volumes', []), ('policy', 'free_space'), ('pins', {}))}
+        self.load_catalog()
+    
+    def log(self, message, level=logging.INFO, **fields):
+        """输出日志（同时写入结构化日志文件）"""
+        print(f"{time.strftime('%H:%M:%S')} - {message}", flush=True)
+        self.logger.log(level, message, extra={'fields': fields})
+    
+    def load_catalog(self):
+        """从缓存加载文件目录"""
+        try:
+            if os.path.exists(self.cache_file):
+                entries = iter_binary_cache(self.cache_file)
+                header = next(entries)
+                catalog = dict(entries)
+            elif os.path.exists(self.legacy_cache_file):
+                with open(self.legacy_cache_file, 'r', encoding='utf-8') as f:
+                    header = json.load(f)
+                catalog = header.pop('files', {})
+            else:
+                self.log("没有找到缓存文件，请先调用 POST /scan 扫描")
+                return
+        except Exception as e:
+            self.log(f"加载缓存失败: {e}", logging.ERROR)
+            return
+        
+        with self.catalog_lock:
+            self.catalog = catalog
+        self.base_url = self.base_url or header.get('url')
+        self.log(f"已加载缓存 (扫描时间: {header.get('scan_time', '未知')})，共 {len(catalog)} 个文件")
+    
+    def start_scan(self):
+        """在后台线程中重新扫描网站并更新缓存"""
+        with self.catalog_lock:
+            if self.scan_state['running']:
+                return False
+            if not self.base_url:
+                raise ValueError("未配置网址，请使用 --url 启动服务")
+            self.scan_state.update(running=True, status='开始扫描', error=None)
+        
+        def status(text):
+            self.scan_state['status'] = text
+        
+        def scan():
+            try:
+                found_urls = collect_file_links(self.base_url, self.driver_cache_file, self.driver_check_interval,
+                                                status, self.log)
+                catalog = build_catalog(found_urls, self.base_url)
+                with self.catalog_lock:
+                    # 沿用已知的文件大小等元数据
+                    for url, info in catalog.items():
+                        old_info = self.catalog.get(url)
+                        if old_info:
+                            for key in ('size', 'size_bytes', 'etag', 'last_modified'):
+                                if key in old_info:
+                                    info[key] = old_info[key]
+                    self.catalog = catalog
+                header = {'url': self.base_url, 'scan_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                          'scan_timestamp': time.time()}
+                write_binary_cache(self.cache_file, header, catalog)
+                self.log(f"扫描完成，共发现 {len(catalog)} 个文件")
+                status(f"扫描完成，共 {len(catalog)} 个文件")
+            except Exception as e:
+                self.scan_state['error'] = str(e)
+                self.log(f"扫描出错: {e}", logging.ERROR)
+            finally:
+                self.scan_state.update(running=False, finished_at=time.time())
+        
+        threading.Thread(target=scan, daemon=True).start()
+        return True
+    
+    def create_job(self, spec):
+        """根据请求创建下载批次：filter 为文件名关键字，extensions 为扩展名列表，paths 可直接指定文件"""
+        if not isinstance(spec, dict):
+            raise ValueError("请求内容必须是JSON对象")
+        for key in ('filter', 'target_dir', 'description'):
+            if not isinstance(spec.get(key, ''), str):
+                raise ValueError(f"{key} 必须是字符串")
+        for key in ('extensions', 'paths'):
+            value = spec.get(key, [])
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f"{key} 必须是字符串列表")
+        filter_text = spec.get('filter', '').lower()
+        extensions = tuple(ext.lower() for ext in spec.get('extensions', []))
+        paths = set(spec.get('paths', []))
+        save_dir = spec.get('target_dir', 'GCB_Data')
+        parallelism = int(spec.get('parallelism', 1))
+        
+        downloaded = self.records.snapshot()[0] if spec.get('skip_downloaded', True) else set()
+        with self.catalog_lock:
+            items = []
+            sizes = {}
+            etags = {}
+            for url, info in self.catalog.items():
+                path = info['path']
+                if paths and path not in paths:
+                    continue
+                if extensions and not path.lower().endswith(extensions):
+                    continue
+                if filter_text and filter_text not in path.lower():
+                    continue
+                if path in downloaded:
+                    continue
+                items.append((url, path))
+                sizes[path] = info.get('size_bytes') or 0
+                etags[path] = info.get('etag')
+        
+        placement = self.get_placement(save_dir)
+        pending = {path: size for path, size in sizes.items() if not find_stored_file(os.path.join(save_dir, path))}
+        self.check_free_space(save_dir, pending, placement, spec)
+        os.makedirs(save_dir, exist_ok=True)
+        self.ensure_mirror_pool()
+        job = self.engine.submit(items, save_dir, parallelism, description=spec.get('description', ''),
+                                 listener=self.log_job_event, sizes=sizes, placement=placement, etags=etags)
+        self.log(f"已创建下载任务 #{job.id}，共 {job.total} 个文件")
+        return job
+    
+    def search_index(self, text, mode, save_dir):
+        """增量更新NetCDF索引后搜索，返回匹配文件的维度、时间范围和匹配的变量"""
+        with self.index_lock:
+            self.nc_index.load()
+            stats = self.nc_index.update(save_dir, list(self.records.snapshot()[0]))
+        text = text.lower()
+        results = []
+        for path, entry in sorted(self.nc_index.entries.items()):
+            if 'error' in entry or not self.nc_index.matches(path, text, mode):
+                continue
+            result = {'path': path, 'format': entry['format'], 'dimensions': entry['dimensions'],
+                      'time_range': entry.get('time_range')}
+            if mode == 'variable':
+                result['variables'] = {name: {'dimensions': info['dimensions'], 'units': info['attributes'].get('units')}
+                                       for name, info in entry['variables'].items()
+                                       if text in self.nc_index.variable_text(name, info)}
+            results.append(result)
+        return {'index': stats, 'results': results}
+    
+    def preview(self, path):
+        """按相对路径预览远程文件，返回预览结果和显示文本"""
+        if not can_preview(path):
+            raise ValueError("只支持预览 CSV/TXT、XLSX、ZIP 和 NetCDF 文件")
+        with self.catalog_lock:
+            found = [(url, info) for url, info in self.catalog.items() if info['path'] == path]
+        if not found:
+            raise KeyError(path)
+        url, info = found[0]
+        preview, cached = get_preview(self.engine.get_session(), self.preview_cache, url,
+                                      info.get('etag') or info.get('last_modified'))
+        return {'path': path, 'url': url, 'cached': cached, 'preview': preview, 'text': format_preview(preview)}
+    
+    def get_placement(self, save_dir):
+        """按存储卷配置创建VolumePlacement，没有配置存储卷时返回None"""
+        config = self.volume_config
+        if not config['volumes'] and not config['pins']:
+            return None
+        return VolumePlacement(save_dir, config['volumes'], config['policy'], config['pins'])
+    
+    def check_free_space(self, save_dir, sizes, placement, spec):
+        """下载前检查剩余空间，不足时拒绝开始（请求中 ignore_space 为 true 时只记录警告）"""
+        short = preflight_space(save_dir, sizes, placement)
+        if not short:
+            return
+        message = f"剩余空间不足: {describe_space_shortage(short)}"
+        if not spec.get('ignore_space'):
+            raise ValueError(message)
+        self.log(message, logging.WARNING)
+    
+    def ensure_mirror_pool(self):
+        if self.engine.mirror_pool is None:
+            self.engine.mirror_pool = MirrorPool(self.base_url or '', self.mirror_urls)
+    
+    @staticmethod
+    def check_sync_spec(spec):
+        """检查同步请求的参数，格式不对时抛出ValueError"""
+        if not isinstance(spec, dict):
+            raise ValueError("请求内容必须是JSON对象")
+        if not isinstance(spec.get('target_dir', ''), str):
+            raise ValueError("target_dir 必须是字符串")
+        if not isinstance(spec.get('prune', False), bool):
+            # 只接受JSON布尔值："false"、"0" 等字符串按真值处理会误删本地文件
+            raise ValueError("prune 必须是 true 或 false")
+        try:
+            int(spec.get('parallelism', 1))
+        except (TypeError, ValueError):
+            raise ValueError("parallelism 必须是整数")
+    
+    def run_sync(self, spec):
+        """执行一次同步并等待完成，返回变更报告：target_dir 下载目录，prune 是否删除上游已移除的文件"""
+        self.check_sync_spec(spec)
+        with self.catalog_lock:
+            if self.sync_state['running']:
+                raise ValueError("已有同步正在进行")
+            catalog = dict(self.catalog)
+            self.sync_state.update(running=True, status='正在对比远程文件', job=None)
+        try:
+            save_dir = spec.get('target_dir', 'GCB_Data')
+            runner = SyncRunner(self.engine, catalog, save_dir, prune=spec.get('prune', False), log=self.log,
+                                placement=self.get_placement(save_dir))
+            runner.plan()
+            self.log(f"对比完成: {runner.describe()}")
+            sizes = {path: runner.remote[path][1]['size_bytes'] for _, path in runner.download_items()}
+            self.check_free_space(save_dir, sizes, runner.placement, spec)
+            self.ensure_mirror_pool()
+            job = runner.start(int(spec.get('parallelism', 1)), listener=self.log_job_event)
+            if job is not None:
+                self.sync_state.update(status='正在下载', job=job.id)
+                job.done.wait()
+            report = runner.finish()
+            self.log(f"同步完成，用时 {report['elapsed']} 秒，变更报告: {runner.report_file}")
+            self.sync_state.update(status='同步完成', report=runner.report_file, summary=report['summary'])
+            return report
+        except Exception as e:
+            self.sync_state['status'] = f"同步出错: {e}"
+            raise
+        finally:
+            self.sync_state['running'] = False
+    
+    def start_sync(self, spec):
+        """在后台线程中执行同步（参数在启动前检查，格式不对时抛出ValueError）"""
+        self.check_sync_spec(spec)
+        if self.sync_state['running']:
+            return False
+        
+        def sync():
+            try:
+                self.run_sync(spec)
+            except Exception as e:
+                self.log(f"同步出错: {e}", logging.ERROR)
+        
+        threading.Thread(target=sync, daemon=True).start()
+        return True
+    
+    def log_job_event(self, event):
+        """把任务事件写入结构化日志，主要事件同时输出到控制台"""
+        log_download_event(self.logger, event)
+        kind = event['type']
+        if kind in ('task_done', 'task_failed', 'task_error', 'task_processed', 'task_process_failed', 'job_done', 'log'):
+            detail = event.get('message') or event.get('path') or event.get('stats')
+            if 'results' in event:
+                detail = f"{detail} ({describe_post_results(event['results'])})"
+            print(f"{time.strftime('%H:%M:%S')} - [任务 #{event['job']}] {kind}: {detail}", flush=True)
+    
+    def status(self):
+        with self.catalog_lock:
+            catalog_size = len(self.catalog)
+        return {
+            'url': self.base_url,
+            'catalog_files': catalog_size,
+            'downloaded_files': len(self.records.downloaded),
+            'failed_files': len(self.records.failed),
+            'max_workers': self.engine.max_workers,
+            'queue_paused': self.engine.paused,
+            'disk': self.engine.writer_pool.snapshot(),
+            'scan': dict(self.scan_state),
+            'sync': dict(self.sync_state),
+            'jobs': [job.to_dict() for job in self.engine.list_jobs()]
+        }
+    
+    def serve_forever(self):
+        """启动HTTP服务"""
+        from http.server import ThreadingHTTPServer
+        server = ThreadingHTTPServer((self.host, self.port), make_service_handler(self))
+        self.log(f"服务已启动: http://{self.host}:{self.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.log("服务已停止")
+        finally:
+            server.server_close()
+
+def make_service_handler(service):
+    """创建服务模式的HTTP请求处理类
+    
+    GET  /status                 服务状态
+    POST /scan                   重新扫描网站
+    POST /sync                   同步到本地目录 {target_dir, prune, parallelism}
+    GET  /jobs                   列出下载任务
+    POST /jobs                   提交下载任务 {filter, extensions, paths, target_dir, parallelism}
+    GET  /jobs/<id>              任务详情
+    GET  /jobs/<id>/events       以 JSON Lines 流式输出任务事件（?since=序号）
+    POST /jobs/<id>/cancel       取消任务（也可使用 DELETE /jobs/<id>）
+    POST /jobs/<id>/tasks/<操作>  暂停/继续/取消/优先下载任务中的文件（pause/resume/cancel/prioritize）{paths}
+    POST /queue/pause            暂停整个队列（POST /queue/resume 继续）
+    GET  /search                 在已下载的NetCDF文件中搜索变量或属性（?q=关键字&mode=variable|attribute&target_dir=目录）
+    GET  /preview                通过HTTP Range读取远程文件头部预览，不完整下载（?path=相对路径）
+    """
+    from http.server import BaseHTTPRequestHandler
+    
+    class ServiceHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # 请求日志由服务统一输出
+        
+        def send_json(self, data, status=200):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def read_json(self):
+            """读取请求体中的JSON对象，格式不对时抛出ValueError（返回400）"""
+            length = int(self.headers.get('Content-Length', 0))
+            if not length:
+                return {}
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(data, dict):
+                raise ValueError("请求内容必须是JSON对象")
+            return data
+        
+        def get_job(self, parts):
+            try:
+                return service.engine.jobs.get(int(parts[1]))
+            except (IndexError, ValueError):
+                return None
+        
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            parts = [p for p in parsed.path.split('/') if p]
+            if parts == ['status']:
+                self.send_json(service.status())
+            elif parts == ['jobs']:
+                self.send_json([job.to_dict() for job in service.engine.list_jobs()])
+            elif len(parts) == 2 and parts[0] == 'jobs':
+                job = self.get_job(parts)
+                self.send_json(job.to_dict() if job else {'error': '任务不存在'}, 200 if job else 404)
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+                job = self.get_job(parts)
+                if job is None:
+                    self.send_json({'error': '任务不存在'}, 404)
+                    return
+                query = dict(pair.split('=', 1) for pair in parsed.query.split('&') if '=' in pair)
+                try:
+                    since = int(query.get('since', 0))
+                except ValueError:
+                    self.send_json({'error': 'since 必须是整数'}, 400)
+                    return
+                self.stream_events(job, since)
+            elif parts == ['search']:
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                if query.get('mode', 'variable') not in ('variable', 'attribute'):
+                    self.send_json({'error': 'mode 只能是 variable 或 attribute'}, 400)
+                    return
+                self.send_json(service.search_index(query.get('q', ''), query.get('mode', 'variable'),
+                                                    query.get('target_dir', 'GCB_Data')))
+            elif parts == ['preview']:
+                path = {key: values[0] for key, values in parse_qs(parsed.query).items()}.get('path', '')
+                try:
+                    self.send_json(service.preview(path))
+                except KeyError:
+                    self.send_json({'error': '文件不在目录中，请先扫描'}, 404)
+                except ValueError as e:
+                    self.send_json({'error': str(e)}, 400)
+                except Exception as e:
+                    self.send_json({'error': f'预览失败: {e}'}, 502)
+            else:
+                self.send_json({'error': '未知路径'}, 404)
+        
+        def do_POST(self):
+            parts = [p for p in urlparse(self.path).path.split('/') if p]
+            try:
+                if parts == ['scan']:
+                    started = service.start_scan()
+                    self.send_json({'started': started, 'scan': dict(service.scan_state)}, 202 if started else 409)
+                elif parts == ['sync']:
+                    started = service.start_sync(self.read_json())
+                    self.send_json({'started': started, 'sync': dict(service.sync_state)}, 202 if started else 409)
+                elif parts == ['jobs']:
+                    job = service.create_job(self.read_json())
+                    self.send_json(job.to_dict(), 201)
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+                    job = self.get_job(parts)
+                    if job is None:
+                        self.send_json({'error': '任务不存在'}, 404)
+                        return
+                    service.engine.cancel(job.id)
+                    self.send_json(job.to_dict())
+                elif len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'tasks':
+                    job = self.get_job(parts)
+                    if job is None:
+                        self.send_json({'error': '任务不存在'}, 404)
+                        return
+                    actions = {
+                        'pause': service.engine.pause_task,
+                        'resume': service.engine.resume_task,
+                        'cancel': service.engine.cancel_task,
+                    }
+                    paths = self.read_json().get('paths')
+                    if not isinstance(paths, list):
+                        raise ValueError("paths 必须是文件路径列表")
+                    if parts[3] == 'prioritize':
+                        count = service.engine.prioritize(job.id, paths)
+                    elif parts[3] in actions:
+                        count = sum(1 for path in paths if actions[parts[3]](job.id, path))
+                    else:
+                        self.send_json({'error': '未知路径'}, 404)
+                        return
+                    self.send_json({'affected': count, 'job': job.to_dict()})
+                elif parts == ['queue', 'pause']:
+                    service.engine.pause_all()
+                    self.send_json({'paused': True})
+                elif parts == ['queue', 'resume']:
+                    service.engine.resume_all()
+                    self.send_json({'paused': False})
+                else:
+                    self.send_json({'error': '未知路径'}, 404)
+            except (ValueError, TypeError) as e:
+                self.send_json({'error': str(e)}, 400)
+        
+        def do_DELETE(self):
+            parts = [p for p in urlparse(self.path).path.split('/') if p]
+            job = self.get_job(parts) if len(parts) == 2 and parts[0] == 'jobs' else None
+            if job is None:
+                self.send_json({'error': '任务不存在'}, 404)
+                return
+            service.engine.cancel(job.id)
+            self.send_json(job.to_dict())
+        
+        def stream_events(self, job, since):
+            """持续输出任务事件，直到任务结束"""
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+            self.end_headers()
+            seq = since
+            try:
+                while True:
+                    events = job.events_since(seq, timeout=15)
+                    if not events:
+                        if job.done.is_set():
+                            break
+                        events = [{'type': 'heartbeat', 'job': job.id, 'time': time.time()}]
+                    for event in events:
+                        self.wfile.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+                        if 'seq' in event:
+                            seq = event['seq'] + 1
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+    
+    return ServiceHandler
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="GCB 数据下载器")
+    parser.add_argument('--serve', action='store_true', help="以后台服务模式运行（无界面，提供本地HTTP接口）")
+    parser.add_argument('--host', default='127.0.0.1', help="服务监听地址")
+    parser.add_argument('--port', type=int, default=8765, help="服务监听端口")
+    parser.add_argument('--max-workers', type=int, default=5, help="所有下载任务共用的最大并发数")
+    parser.add_argument('--url', default=None, help="扫描网址（默认使用缓存中的网址）")
+    parser.add_argument('--sync', metavar='DIR', help="无界面同步到指定目录后退出（使用缓存中的文件列表）")
+    parser.add_argument('--prune', action='store_true', help="同步时删除上游已移除的本地文件")
+    parser.add_argument('--parallel', type=int, default=3, help="同步时的并行下载数")
+    parser.add_argument('--shard-mode', choices=['lease', 'hash'], help="多机协作：多个实例共用同一下载目录时的分配方式")
+    parser.add_argument('--shard', default='1/1', help="哈希分片时本节点的序号/节点数，如 2/3")
+    parser.add_argument('--lease-ttl', type=int, default=120, help="租约有效期（秒），节点崩溃后超过该时间由其它节点接管")
+    parser.add_argument('--post-process', default='', metavar='STEPS',
+                        help=f"下载后处理步骤，逗号分隔（可选: {', '.join(POST_PROCESS_STEPS)}）")
+    parser.add_argument('--no-dedupe', action='store_true', help="不做跨版本去重（每个文件都完整下载）")
+    parser.add_argument('--no-compress-transfer', action='store_true', help="文本文件传输时不请求gzip/deflate压缩")
+    parser.add_argument('--store-gz', action='store_true', help="CSV文件边下载边压缩，保存为 .csv.gz")
+    parser.add_argument('--volume', action='append', default=[], metavar='DIR',
+                        help="存储卷目录，可多次指定，文件按存放策略分散保存（默认使用 gcb_volumes.json）")
+    parser.add_argument('--placement', choices=list(VolumePlacement.policy_names), default='free_space',
+                        help="多卷存放策略：剩余空间优先 / 轮流 / 按顶层文件夹固定")
+    parser.add_argument('--pin', action='append', default=[], metavar='FOLDER=DIR',
+                        help="把顶层文件夹固定到指定的存储卷（--placement pinned 时使用），可多次指定")
+    parser.add_argument('--ignore-space', action='store_true', help="同步前剩余空间不足时仍然开始")
+    args = parser.parse_args()
+    
+    post_steps = [step for step in args.post_process.split(',') if step]
+    for step in post_steps:
+        if step not in POST_PROCESS_STEPS:
+            parser.error(f"未知的下载后处理步骤: {step}")
+    
+    shard = None
+    if args.shard_mode:
+        index, count = (int(n) for n in args.shard.split('/'))
+        if not 1 <= index <= count:
+            parser.error(f"分片序号超出范围: {args.shard}")
+        shard = {'mode': args.shard_mode, 'shard_index': index - 1, 'shard_count': count, 'lease_ttl': args.lease_ttl}
+    
+    volume_config = None
+    if args.volume or args.pin:
+        pins = {}
+        for pin in args.pin:
+            folder, sep, volume = pin.partition('=')
+            if not sep or not folder or not volume:
+                parser.error(f"--pin 格式应为 文件夹=目录: {pin}")
+            pins[folder.strip('/\\')] = volume
+        volume_config = {'volumes': args.volume, 'policy': args.placement, 'pins': pins}
+    
+    if args.sync:
+        service = GCBService(max_workers=max(args.max_workers, args.parallel), base_url=args.url)
+        service.engine.shard = shard
+        service.engine.post_processor.steps = post_steps
+        if args.no_dedupe:
+            service.engine.dedupe = None
+        service.engine.compress_transfer = not args.no_compress_transfer
+        service.engine.store_compressed = args.store_gz
+        if volume_config:
+            service.volume_config = volume_config
+        try:
+            report = service.run_sync({'target_dir': args.sync, 'prune': args.prune, 'parallelism': args.parallel,
+                                       'ignore_space': args.ignore_space})
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(report['summary'], ensure_ascii=False, indent=2))
+        sys.exit(1 if report['summary']['failed'] else 0)
+    
+    if args.serve:
+        service = GCBService(args.host, args.port, args.max_workers, args.url)
+        service.engine.shard = shard
+        service.engine.post_processor.steps = post_steps
+        if args.no_dedupe:
+            service.engine.dedupe = None
+        service.engine.compress_transfer = not args.no_compress_transfer
+        service.engine.store_compressed = args.store_gz
+        if volume_config:
+            service.volume_config = volume_config
+        service.serve_forever()
+        return
+    
     root = Tk()
     app = GCBDownloader(root)
+    app.engine.shard = shard
+    if post_steps:
+        app.extract_var.set('extract' in post_steps)
+        app.checksum_var.set('checksum' in post_steps)
+    app.dedupe_var.set(not args.no_dedupe)
+    app.compress_transfer_var.set(not args.no_compress_transfer)
+    app.store_gz_var.set(args.store_gz)
+    if volume_config:
+        app.volume_config = volume_config
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包为可执行文件时，下载后处理的子进程需要
+    multiprocessing.freeze_support()
     main()
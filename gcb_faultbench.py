@@ -0,0 +1,347 @@
+"""GCB 数据下载器 - 故障注入测试
+
+在本地启动一个模拟的HTTP服务器，对下载引擎注入网络故障：传输中途连接被重置、数据停止到达、
+响应体短于 Content-Length、连续的 5xx、带 Retry-After 的 429 以及响应很慢的 HEAD。
+每个场景检查下载的文件是否与服务器上的完全一致，并统计有效吞吐量、恢复时间和浪费的流量，
+修改重试或续传逻辑前后各运行一次即可量化比较（--json 保存结果，--compare 与之前的结果对比）。
+
+用法:
+    python gcb_faultbench.py
+    python gcb_faultbench.py --scenarios reset,stall --files 8 --size-mb 8 --json after.json --compare before.json
+"""
+import os
+import sys
+import time
+import json
+import struct
+import socket
+import shutil
+import hashlib
+import tempfile
+import argparse
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import gcb_downloader as gcb
+
+# 场景: (说明, 故障类型, 每个文件注入故障的请求数)
+SCENARIOS = collections.OrderedDict([
+    ('baseline', ("无故障（对照）", None, 0)),
+    ('reset', ("传输到一半时连接被重置 (RST)", 'reset', 1)),
+    ('stall', ("传输到一半后不再发送数据", 'stall', 1)),
+    ('truncate', ("响应体短于 Content-Length 后关闭连接", 'truncate', 1)),
+    ('5xx', ("连续返回 500/503", '5xx', 2)),
+    ('429', ("返回 429 并要求按 Retry-After 等待", '429', 1)),
+    ('slow_head', ("HEAD 响应很慢（获取文件大小）", 'slow_head', 0)),
+])
+
+class FaultServer:
+    """注入故障的本地文件服务器（支持 HEAD 和 Range 请求），统计发送的字节数和故障时间"""
+
+    def __init__(self, files, fault=None, fault_count=0, retry_after=2, stall_seconds=10, head_delay=7):
+        self.files = files  # {name: bytes}
+        self.fault = fault
+        self.fault_count = fault_count  # 每个文件前几次GET注入故障
+        self.retry_after = retry_after  # 429 响应要求等待的秒数
+        self.stall_seconds = stall_seconds  # 停止发送数据的时长（应大于客户端读取超时）
+        self.head_delay = head_delay  # HEAD 响应延迟
+        self.lock = threading.Lock()
+        self.gets = collections.Counter()  # 每个文件收到的GET次数
+        self.fault_times = {}  # 每个文件首次注入故障的时间
+        self.retry_not_before = {}  # 429 后客户端最早可以重试的时间
+        self.premature = 0  # 未等到 Retry-After 就重试的请求数
+        self.requests = 0
+        self.bytes_sent = 0  # 发送的响应体字节数（包括被中断的部分）
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def make_handler(self):
+        server = self
+
+        class FaultHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 保持连接，与真实服务器一致
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_file_headers(self, status, length, total, start=None):
+                self.send_response(status)
+                self.send_header('Content-Length', str(length))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', f'"{total}"')
+                if start is not None:
+                    self.send_header('Content-Range', f'bytes {start}-{start + length - 1}/{total}')
+                self.end_headers()
+
+            def send_body(self, body):
+                for i in range(0, len(body), 65536):
+                    self.wfile.write(body[i:i + 65536])
+                    with server.lock:
+                        server.bytes_sent += len(body[i:i + 65536])
+
+            def do_HEAD(self):
+                data = server.files.get(self.path.lstrip('/'))
+                if data is None:
+                    self.send_error(404)
+                    return
+                if server.fault == 'slow_head':
+                    time.sleep(server.head_delay)
+                self.send_file_headers(200, len(data), len(data))
+
+            def do_GET(self):
+                name = self.path.lstrip('/')
+                data = server.files.get(name)
+                if data is None:
+                    self.send_error(404)
+                    return
+                now = time.time()
+                with server.lock:
+                    server.requests += 1
+                    inject = server.fault not in (None, 'slow_head') and server.gets[name] < server.fault_count
+                    attempt = server.gets[name]
+                    server.gets[name] += 1
+                    if now < server.retry_not_before.get(name, 0):
+                        server.premature += 1
+                    if inject:
+                        server.fault_times.setdefault(name, now)
+
+                if inject and server.fault == '5xx':
+                    self.send_error(500 if attempt % 2 == 0 else 503)
+                    return
+                if inject and server.fault == '429':
+                    with server.lock:
+                        server.retry_not_before[name] = now + server.retry_after
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                start, end = 0, len(data) - 1
+                range_header = self.headers.get('Range', '')
+                if range_header.startswith('bytes='):
+                    first, _, last = range_header[6:].partition('-')
+                    start = int(first)
+                    end = min(int(last), end) if last else end
+                    if start > end:
+                        self.send_error(416)
+                        return
+                    self.send_file_headers(206, end - start + 1, len(data), start)
+                else:
+                    self.send_file_headers(200, len(data), len(data))
+                body = data[start:end + 1]
+
+                try:
+                    if not inject:
+                        self.send_body(body)
+                        return
+                    self.send_body(body[:len(body) // 2])
+                    self.wfile.flush()
+                    if server.fault == 'reset':
+                        # SO_LINGER=0 关闭时发送 RST 而不是 FIN
+                        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    elif server.fault == 'stall':
+                        time.sleep(server.stall_seconds)
+                    # truncate: 直接关闭连接，响应体短于 Content-Length
+                    self.close_connection = True
+                except OSError:
+                    self.close_connection = True  # 客户端已断开
+
+            def finish(self):
+                try:
+                    super().finish()
+                except OSError:
+                    pass
+
+        return FaultHandler
+
+def make_files(count, size):
+    """生成测试文件内容（随机数据，不可压缩）"""
+    return {f"data/file{i + 1}.nc": os.urandom(size) for i in range(count)}
+
+def run_downloads(server, files, args):
+    """用下载引擎下载全部文件，返回统计结果"""
+    work_dir = tempfile.mkdtemp(prefix='gcb_faultbench_')
+    try:
+        records = gcb.DownloadRecords(os.path.join(work_dir, 'downloaded.json'), os.path.join(work_dir, 'failed.json'))
+        engine = gcb.DownloadEngine(records, max_workers=args.parallel, max_retries=args.retries,
+                                    retry_delay=args.retry_delay)
+        engine.timeout = (5, args.read_timeout)
+        engine.mirror_pool = gcb.MirrorPool(server.base_url)
+        save_dir = os.path.join(work_dir, 'data')
+        done_times = {}
+        retries = collections.Counter()
+        errors = []
+
+        def listener(event):
+            if event['type'] == 'task_done':
+                done_times[event['path']] = event['time']
+            elif event['type'] == 'task_retry':
+                retries[event['path']] += 1
+            elif event['type'] in ('task_failed', 'task_error'):
+                errors.append(f"{event['path']}: {event['error']}")
+
+        items = [(server.base_url + name, name) for name in files]
+        sizes = {name: len(data) for name, data in files.items()}
+        start = time.time()
+        job = engine.submit(items, save_dir, args.parallel, description="故障注入测试", listener=listener, sizes=sizes)
+        finished = job.done.wait(args.timeout)
+        elapsed = time.time() - start
+        if not finished:
+            engine.cancel(job.id)
+            errors.append(f"超过 {args.timeout} 秒未完成")
+
+        # 逐个文件比较内容
+        correct = 0
+        for name, data in files.items():
+            file_path = os.path.join(save_dir, name)
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as f:
+                    if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                        correct += 1
+                        continue
+                errors.append(f"{name}: 内容与服务器不一致")
+
+        total_bytes = sum(sizes.values())
+        recovery = [done_times[name] - fault_time for name, fault_time in server.fault_times.items() if name in done_times]
+        return {
+            'files': len(files),
+            'correct': correct,
+            'elapsed': round(elapsed, 3),
+            'goodput': round(total_bytes * correct / len(files) / elapsed, 1) if elapsed else 0,
+            'recovery_mean': round(sum(recovery) / len(recovery), 3) if recovery else None,
+            'recovery_max': round(max(recovery), 3) if recovery else None,
+            'wasted_bytes': max(0, server.bytes_sent - total_bytes),
+            'requests': server.requests,
+            'retries': sum(retries.values()),
+            'premature_retries': server.premature,
+            'errors': errors[:10]
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_metadata(server, files, args):
+    """获取全部文件的大小（扫描后的大小探测），返回统计结果"""
+    session = gcb.create_http_session(args.parallel)
+
+    def fetch(name):
+        start = time.time()
+        metadata = gcb.fetch_file_metadata(session, server.base_url + name)
+        return name, metadata, time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        results = list(executor.map(fetch, files))
+    elapsed = time.time() - start
+    correct = sum(1 for name, metadata, _ in results if metadata and metadata['size_bytes'] == len(files[name]))
+    latencies = [latency for _, _, latency in results]
+    return {
+        'files': len(files),
+        'correct': correct,
+        'elapsed': round(elapsed, 3),
+        'goodput': None,
+        'recovery_mean': round(sum(latencies) / len(latencies), 3),
+        'recovery_max': round(max(latencies), 3),
+        'wasted_bytes': max(0, server.bytes_sent),
+        'requests': server.requests,
+        'retries': 0,
+        'premature_retries': 0,
+        'errors': [f"{name}: 未获取到大小" for name, metadata, _ in results if not metadata][:10]
+    }
+
+def run_scenario(name, files, args):
+    description, fault, fault_count = SCENARIOS[name]
+    server = FaultServer(files, fault, fault_count, retry_after=args.retry_after,
+                         stall_seconds=args.read_timeout * 2 + 1, head_delay=args.head_delay).start()
+    try:
+        if fault == 'slow_head':
+            result = run_metadata(server, files, args)
+        else:
+            result = run_downloads(server, files, args)
+    finally:
+        server.stop()
+    result.update(scenario=name, description=description, passed=result['correct'] == result['files'])
+    if fault == '429' and result['premature_retries']:
+        result['passed'] = False
+        result['errors'].append(f"{result['premature_retries']} 次请求未等到 Retry-After 就重试")
+    return result
+
+def format_seconds(value):
+    return '-' if value is None else f"{value:.2f}s"
+
+def print_results(results, previous=None):
+    """输出结果表格，有之前的结果时附带变化"""
+    print(f"{'场景':<10} {'结果':<4} {'正确':>6} {'用时':>8} {'有效吞吐':>12} {'恢复(平均/最大)':>16} "
+          f"{'浪费流量':>10} {'请求':>5} {'重试':>4}")
+    for result in results:
+        goodput = '-' if result['goodput'] is None else gcb.format_speed(result['goodput'])
+        recovery = f"{format_seconds(result['recovery_mean'])}/{format_seconds(result['recovery_max'])}"
+        print(f"{result['scenario']:<10} {'通过' if result['passed'] else '失败':<4} "
+              f"{result['correct']:>3}/{result['files']:<2} {format_seconds(result['elapsed']):>8} {goodput:>12} "
+              f"{recovery:>16} {gcb.format_size(result['wasted_bytes']):>10} {result['requests']:>5} {result['retries']:>4}")
+        before = (previous or {}).get(result['scenario'])
+        if before:
+            changes = []
+            for key, label in (('elapsed', "用时"), ('recovery_mean', "平均恢复"), ('wasted_bytes', "浪费流量")):
+                if before.get(key) is not None and result.get(key) is not None:
+                    changes.append(f"{label} {result[key] - before[key]:+.2f}" if key != 'wasted_bytes'
+                                   else f"{label} {gcb.format_size(abs(result[key] - before[key]))}"
+                                        f"{'↑' if result[key] > before[key] else '↓'}")
+            if before.get('goodput') and result.get('goodput'):
+                changes.append(f"有效吞吐 {(result['goodput'] / before['goodput'] - 1) * 100:+.0f}%")
+            print(f"{'':<10} 对比之前: {', '.join(changes)}")
+        for error in result['errors']:
+            print(f"{'':<10} - {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="GCB 数据下载器 - 故障注入测试")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"要运行的场景，逗号分隔（{', '.join(SCENARIOS)}）")
+    parser.add_argument('--files', type=int, default=6, help="测试文件数")
+    parser.add_argument('--size-mb', type=float, default=4, help="每个文件的大小（MB）")
+    parser.add_argument('--parallel', type=int, default=3, help="并行下载数")
+    parser.add_argument('--retries', type=int, default=3, help="最大重试次数（与下载器默认值相同）")
+    parser.add_argument('--retry-delay', type=float, default=1, help="重试间隔（秒）")
+    parser.add_argument('--read-timeout', type=float, default=3, help="读取超时（秒），下载器默认 120 秒，测试时缩短")
+    parser.add_argument('--retry-after', type=int, default=2, help="429 响应中 Retry-After 的秒数")
+    parser.add_argument('--head-delay', type=float, default=7, help="HEAD 响应延迟（秒），大于获取大小的超时（5 秒）")
+    parser.add_argument('--timeout', type=float, default=300, help="单个场景的最长时间（秒）")
+    parser.add_argument('--json', metavar='FILE', help="把结果保存为JSON")
+    parser.add_argument('--compare', metavar='FILE', help="与之前保存的结果对比")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = {result['scenario']: result for result in json.load(f)['results']}
+
+    files = make_files(args.files, int(args.size_mb * 1024 * 1024))
+    results = []
+    for name in names:
+        print(f"运行场景 {name}: {SCENARIOS[name][0]} ...", flush=True)
+        results.append(run_scenario(name, files, args))
+    print()
+    print_results(results, previous)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+if __name__ == "__main__":
+    main()